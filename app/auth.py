@@ -0,0 +1,401 @@
+"""
+auth.py
+=======
+
+This module authenticates the users of the protected endpoints.
+
+Passwords are stored as salted PBKDF2-SHA256 hashes in a pluggable `UserStore`, and
+checked by an `Authenticator`. Hashing is deliberately slow, so the authenticator keeps
+a bounded cache of recently verified credentials: a request whose username and password
+were verified within the cache's TTL is accepted after one HMAC, without a store lookup
+or a password hash. Hashes run in a thread, so the event loop keeps serving requests
+while one is computed, and concurrent requests with the same credentials share one
+verification. Every comparison is constant-time, and unknown usernames cost as much to
+reject as wrong passwords.
+
+Optionally, the authenticator issues short-lived tokens signed with HMAC-SHA256, which
+clients can send as `Authorization: Bearer <token>` instead of their password. Tokens are
+checked without any store lookup.
+
+Classes
+-------
+- `UserStore` : Interface of the stores of password hashes.
+- `MemoryUserStore` : Password hashes held in memory.
+- `MongoUserStore` : Password hashes in the `users` collection.
+- `Authenticator` : Verifies credentials and tokens.
+
+Functions
+---------
+- `hash_password` : Hash a password for storage.
+- `verify_password` : Check a password against a stored hash.
+- `authenticator_from_environ` : Build the authenticator configured by the environment.
+
+Configuration
+-------------
+- `AUTH_USER_STORE` : "memory" (the default) or "mongo".
+- `AUTH_USERS` : For the memory store, comma-separated `username:hash` pairs. Without
+  it, the store holds the default user `Joe` with the password `librarian`.
+- `AUTH_CACHE_SIZE` and `AUTH_CACHE_TTL_SECONDS` : The verified-credential cache, 1024
+  entries for 300 seconds by default. A size of 0 disables it.
+- `AUTH_TOKEN_SECRET` : Enables signed tokens. `AUTH_TOKEN_TTL_SECONDS` sets their
+  lifetime, 900 seconds by default.
+
+Usage
+-----
+Print the hash of a password, for `AUTH_USERS`:
+
+    python -m app.auth hash-password
+
+Add or update a user in the `users` collection:
+
+    python -m app.auth add-user Joe
+"""
+
+import argparse
+import asyncio
+import base64
+import getpass
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+from .cache import LRUCache
+from .database import users_collection
+
+PASSWORD_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_ITERATIONS = 600000
+DEFAULT_USERNAME = "Joe"
+DEFAULT_PASSWORD = "librarian"
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def hash_password(password, iterations=PASSWORD_ITERATIONS, salt=None):
+    """
+    Hash a password with a random salt.
+
+    Parameters:
+    password (str): The password.
+    iterations (int): PBKDF2 iterations.
+    salt (bytes): The salt, random if not given.
+
+    Returns:
+    str: `pbkdf2_sha256$<iterations>$<salt>$<hash>`, with base64 salt and hash.
+    """
+    salt = secrets.token_bytes(16) if salt is None else salt
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{PASSWORD_ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password, password_hash):
+    """
+    Check a password against a hash from `hash_password`, in constant time.
+
+    Parameters:
+    password (str): The password to check.
+    password_hash (str): The stored hash.
+
+    Returns:
+    bool: True if the password matches. Malformed hashes match nothing.
+    """
+    try:
+        algorithm, iterations, salt, expected = password_hash.split("$")
+        if algorithm != PASSWORD_ALGORITHM:
+            return False
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), _b64decode(salt), int(iterations))
+        return hmac.compare_digest(digest, _b64decode(expected))
+    except (ValueError, TypeError):
+        return False
+
+
+# Checked against when a username is unknown, so that it takes as long as a wrong password
+_UNKNOWN_USER_HASH = hash_password(secrets.token_urlsafe(16))
+
+
+class UserStore:
+    """
+    Interface of the stores of users' password hashes.
+    """
+
+    async def get_password_hash(self, username):
+        """
+        Look up a user's password hash.
+
+        Parameters:
+        username (str): The username.
+
+        Returns:
+        str or None: The hash, or None if there is no such user.
+        """
+        raise NotImplementedError
+
+    async def set_password_hash(self, username, password_hash):
+        """
+        Create a user, or replace their password hash.
+
+        Parameters:
+        username (str): The username.
+        password_hash (str): The hash, from `hash_password`.
+        """
+        raise NotImplementedError
+
+
+class MemoryUserStore(UserStore):
+    """
+    Password hashes held in memory, by username.
+    """
+
+    def __init__(self, users=None):
+        self.users = dict(users or {})
+
+    async def get_password_hash(self, username):
+        return self.users.get(username)
+
+    async def set_password_hash(self, username, password_hash):
+        self.users[username] = password_hash
+
+
+class MongoUserStore(UserStore):
+    """
+    Password hashes in a MongoDB collection, one `{"_id": username, "password_hash"}`
+    document per user.
+    """
+
+    def __init__(self, collection=users_collection):
+        self.collection = collection
+
+    async def get_password_hash(self, username):
+        user = await self.collection.find_one({"_id": username}, {"password_hash": 1})
+        return None if user is None else user.get("password_hash")
+
+    async def set_password_hash(self, username, password_hash):
+        await self.collection.update_one({"_id": username}, {"$set": {"password_hash": password_hash}}, upsert=True)
+
+
+class Authenticator:
+    """
+    Verifies usernames and passwords against a user store, and issues and verifies
+    signed tokens.
+
+    The cache holds, per username, an HMAC of the verified password under a key that
+    never leaves the process, so neither passwords nor anything usable against the
+    stored hashes are kept in memory.
+    """
+
+    def __init__(self, store, cache_size=1024, cache_ttl=300.0, token_secret=None, token_ttl=900.0):
+        """
+        Configure the authenticator.
+
+        Parameters:
+        store (UserStore): Where password hashes are looked up.
+        cache_size (int): Verified credentials kept, or 0 to verify every request.
+        cache_ttl (float): Seconds a verified credential is trusted without rechecking
+            the store, which bounds how long a changed password keeps working in other
+            workers.
+        token_secret (str): Key that signs tokens, or None to disable tokens.
+        token_ttl (float): Lifetime of issued tokens, in seconds.
+        """
+        self.store = store
+        self.token_secret = token_secret.encode() if token_secret else None
+        self.token_ttl = token_ttl
+        self._cache = LRUCache(max_entries=cache_size, ttl=cache_ttl) if cache_size else None
+        self._cache_key = secrets.token_bytes(32)
+        self._verifying = {}  # Fingerprint -> future of a verification in progress
+        self._invalidations = 0
+        self._stats = {"cache_hits": 0, "verifications": 0, "coalesced": 0, "failures": 0, "tokens_issued": 0}
+
+    def _fingerprint(self, username, password):
+        return hmac.new(self._cache_key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    async def authenticate(self, username, password):
+        """
+        Check a username and password.
+
+        Parameters:
+        username (str): The username.
+        password (str): The password.
+
+        Returns:
+        bool: True if the credentials are valid.
+        """
+        fingerprint = self._fingerprint(username, password)
+        if self._cache is not None:
+            cached = self._cache.get(username)
+            if cached is not None and hmac.compare_digest(cached, fingerprint):
+                self._stats["cache_hits"] += 1
+                return True
+
+        pending = self._verifying.get(fingerprint)
+        if pending is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+        pending = self._verifying[fingerprint] = asyncio.get_running_loop().create_future()
+        invalidations = self._invalidations
+        try:
+            valid = await self._verify(username, password)
+        except Exception as error:
+            pending.set_exception(error)
+            pending.exception()  # Marks the error retrieved, since nothing may be waiting
+            raise
+        except BaseException:
+            pending.cancel()
+            raise
+        else:
+            pending.set_result(valid)
+        finally:
+            del self._verifying[fingerprint]
+        # A password change during the verification may have made its result stale
+        if valid and self._cache is not None and invalidations == self._invalidations:
+            self._cache.set(username, fingerprint)
+        if not valid:
+            self._stats["failures"] += 1
+        return valid
+
+    async def _verify(self, username, password):
+        self._stats["verifications"] += 1
+        password_hash = await self.store.get_password_hash(username)
+        valid = await asyncio.to_thread(verify_password, password, password_hash or _UNKNOWN_USER_HASH)
+        return valid and password_hash is not None
+
+    async def set_password(self, username, password):
+        """
+        Create a user or change their password, and forget their cached credentials in
+        this process.
+
+        Parameters:
+        username (str): The username.
+        password (str): The new password.
+        """
+        password_hash = await asyncio.to_thread(hash_password, password)
+        await self.store.set_password_hash(username, password_hash)
+        self.invalidate(username)
+
+    def invalidate(self, username):
+        """
+        Forget a user's verified credentials in this process.
+        """
+        self._invalidations += 1
+        if self._cache is not None:
+            self._cache.delete(username)
+
+    def issue_token(self, username):
+        """
+        Issue a signed token for an authenticated user.
+
+        Parameters:
+        username (str): The username.
+
+        Returns:
+        str: `<payload>.<signature>`, both base64, where the payload holds the username and
+        expiry time.
+
+        Raises:
+        ValueError: If tokens are disabled.
+        """
+        if self.token_secret is None:
+            raise ValueError("Tokens are disabled; set AUTH_TOKEN_SECRET to enable them")
+        payload = _b64encode(json.dumps({"sub": username, "exp": int(time.time() + self.token_ttl)}).encode())
+        signature = hmac.new(self.token_secret, payload.encode(), hashlib.sha256).digest()
+        self._stats["tokens_issued"] += 1
+        return f"{payload}.{_b64encode(signature)}"
+
+    def verify_token(self, token):
+        """
+        Check a token's signature and expiry.
+
+        Parameters:
+        token (str): A token from `issue_token`.
+
+        Returns:
+        str or None: The token's username, or None if the token is invalid, expired or
+        tokens are disabled.
+        """
+        if self.token_secret is None:
+            return None
+        try:
+            payload, signature = token.split(".")
+            expected = hmac.new(self.token_secret, payload.encode(), hashlib.sha256).digest()
+            if not hmac.compare_digest(_b64decode(signature), expected):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except ValueError:  # Includes malformed base64 and JSON
+            return None
+        if not isinstance(claims, dict) or not isinstance(claims.get("exp"), int) or claims["exp"] <= time.time():
+            return None
+        username = claims.get("sub")
+        return username if isinstance(username, str) else None
+
+    def stats(self):
+        """
+        Report the authenticator's counters.
+
+        Returns:
+        dict: Requests accepted from the cache, password `verifications` run, requests
+        that shared another's verification, rejected credentials, tokens issued, and the
+        number of cached credentials.
+        """
+        return {**self._stats, "cached": 0 if self._cache is None else len(self._cache)}
+
+
+def authenticator_from_environ(environ=os.environ):
+    """
+    Build the authenticator configured by the `AUTH_*` environment variables.
+
+    Parameters:
+    environ (dict): The environment to read.
+
+    Returns:
+    Authenticator: The authenticator.
+
+    Raises:
+    ValueError: If the store is unknown or `AUTH_USERS` is malformed.
+    """
+    store_name = environ.get("AUTH_USER_STORE", "memory")
+    if store_name == "mongo":
+        store = MongoUserStore()
+    elif store_name == "memory":
+        if environ.get("AUTH_USERS"):
+            try:
+                users = dict(entry.strip().split(":", 1) for entry in environ["AUTH_USERS"].split(","))
+            except ValueError:
+                raise ValueError("AUTH_USERS must be comma-separated username:hash pairs")
+        else:
+            users = {DEFAULT_USERNAME: hash_password(DEFAULT_PASSWORD)}
+        store = MemoryUserStore(users)
+    else:
+        raise ValueError(f"Unknown user store '{store_name}'; expected 'memory' or 'mongo'")
+    return Authenticator(
+        store,
+        cache_size=int(environ.get("AUTH_CACHE_SIZE", 1024)),
+        cache_ttl=float(environ.get("AUTH_CACHE_TTL_SECONDS", 300)),
+        token_secret=environ.get("AUTH_TOKEN_SECRET") or None,
+        token_ttl=float(environ.get("AUTH_TOKEN_TTL_SECONDS", 900)),
+    )
+
+
+async def main(command, username):
+    password = getpass.getpass("Password: ")
+    if command == "hash-password":
+        print(hash_password(password))
+    else:
+        await MongoUserStore().set_password_hash(username, hash_password(password))
+        print(f"Saved the password of '{username}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the credentials of the protected endpoints.")
+    parser.add_argument("command", choices=("hash-password", "add-user"))
+    parser.add_argument("username", nargs="?")
+    args = parser.parse_args()
+    if args.command == "add-user" and not args.username:
+        parser.error("add-user needs a username")
+    asyncio.run(main(args.command, args.username))
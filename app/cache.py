@@ -0,0 +1,303 @@
+"""
+cache.py
+========
+
+This module provides the read-through cache in front of the book and review lookups.
+
+Entries live in an in-process LRU cache with a time-to-live and a bounded number of
+entries. An optional shared backend, such as Redis, is consulted on a local miss, so a
+worker that starts cold can reuse entries that another worker loaded. Writes invalidate
+the affected keys in both layers. Other workers' local copies expire after the TTL.
+
+Each cached entry carries an ETag computed from its content, so a client that already
+holds the current version gets a 304 without the database being queried.
+
+Classes
+-------
+- `LRUCache` : In-process LRU cache with a TTL.
+- `MemoryBackend` : Shared-backend stand-in kept in process memory.
+- `RedisBackend` : Shared backend on Redis.
+- `ReadThroughCache` : Combines the local cache with an optional shared backend.
+
+Functions
+---------
+- `compute_etag` : Compute the ETag of a JSON-serializable value.
+- `etag_matches` : Evaluate an `If-None-Match` header.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # pragma: no cover - the shared backend is optional
+    redis = None
+
+
+def compute_etag(value):
+    """
+    Compute a strong ETag for a JSON-serializable value.
+
+    Parameters:
+    value: The response body.
+
+    Returns:
+    str: The quoted ETag.
+    """
+    body = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an `If-None-Match` request header against the current ETag.
+
+    Parameters:
+    if_none_match (str): The header value, or None.
+    etag (str): The current ETag.
+
+    Returns:
+    bool: Whether the client's copy is current.
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so a W/ prefix is ignored
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+class LRUCache:
+    """
+    In-process cache with least-recently-used eviction and a time-to-live.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0, clock=time.monotonic):
+        """
+        Initialize the cache.
+
+        Parameters:
+        max_entries (int): Entries kept before the least recently used one is evicted.
+        ttl (float): Seconds an entry stays valid.
+        clock (callable): Time source, replaceable in tests.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return a cached value and mark it as recently used.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        The value, or None if it is missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entries beyond `max_entries`.
+
+        Parameters:
+        key (str): The cache key.
+        value: The value to store.
+        """
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        """
+        Remove a key if it is cached.
+
+        Parameters:
+        key (str): The cache key.
+        """
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class MemoryBackend:
+    """
+    Shared-backend stand-in that keeps JSON strings in a dict.
+
+    It has the same interface as `RedisBackend`, so tests and single-host deployments
+    can use it in place of a Redis server.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._values = {}
+
+    async def get(self, key):
+        entry = self._values.get(key)
+        if entry is None or entry[0] <= self.clock():
+            self._values.pop(key, None)
+            return None
+        return entry[1]
+
+    async def set(self, key, value, ttl):
+        self._values[key] = (self.clock() + ttl, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._values.pop(key, None)
+
+
+class RedisBackend:
+    """
+    Shared backend that stores entries in Redis with an expiry.
+
+    Requires the optional `redis` package.
+    """
+
+    def __init__(self, url, prefix="bookslibrary:"):
+        """
+        Initialize the backend.
+
+        Parameters:
+        url (str): The Redis connection URL, e.g. "redis://localhost:6379/0".
+        prefix (str): Prefix for every key, so several apps can share a server.
+
+        Raises:
+        RuntimeError: If the `redis` package is not installed.
+        """
+        if redis is None:
+            raise RuntimeError("The redis package is required for the shared cache backend")
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+
+    async def get(self, key):
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key, value, ttl):
+        await self._client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    async def delete(self, *keys):
+        if keys:
+            await self._client.delete(*(self.prefix + key for key in keys))
+
+
+class ReadThroughCache:
+    """
+    Read-through cache over an `LRUCache` and an optional shared backend.
+
+    Values must be JSON-serializable. Each is stored with its ETag as an
+    `{"value": ..., "etag": ...}` entry.
+    """
+
+    def __init__(self, local=None, shared=None):
+        """
+        Initialize the cache.
+
+        Parameters:
+        local (LRUCache): The in-process cache; a default-sized one if omitted.
+        shared: A backend with async `get`, `set` and `delete`, or None.
+        """
+        self.local = local if local is not None else LRUCache()
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._loading = {}  # Key -> [invalidations seen, loads in flight]
+
+    async def get(self, key, loader):
+        """
+        Return the cached entry for a key, loading and caching it on a miss.
+
+        Parameters:
+        key (str): The cache key.
+        loader (callable): Coroutine function that loads the value, returning None if
+            it does not exist. Missing values are not cached.
+
+        Returns:
+        dict or None: The entry, with the `value` and its `etag`, or None.
+        """
+        entry = self.local.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        if self.shared is not None:
+            stored = await self.shared.get(key)
+            if stored is not None:
+                self.shared_hits += 1
+                entry = json.loads(stored)
+                self.local.set(key, entry)
+                return entry
+
+        self.misses += 1
+        loading = self._loading.setdefault(key, [0, 0])
+        invalidated = loading[0]
+        loading[1] += 1
+        try:
+            value = await loader()
+        finally:
+            loading[1] -= 1
+            if not loading[1]:
+                del self._loading[key]
+        if value is None:
+            return None
+        entry = {"value": value, "etag": compute_etag(value)}
+        # A write that invalidated the key while it was loading makes the loaded value stale
+        if loading[0] == invalidated:
+            self.local.set(key, entry)
+            if self.shared is not None:
+                await self.shared.set(key, json.dumps(entry, default=str), self.local.ttl)
+        return entry
+
+    async def invalidate(self, *keys):
+        """
+        Drop keys from the local cache and the shared backend.
+
+        Parameters:
+        keys (str): The cache keys.
+        """
+        for key in keys:
+            self.local.delete(key)
+            if key in self._loading:
+                self._loading[key][0] += 1
+        self.invalidations += len(keys)
+        if self.shared is not None:
+            await self.shared.delete(*keys)
+
+    def stats(self):
+        """
+        Report the cache counters.
+
+        Returns:
+        dict: Local `hits`, `shared_hits`, `misses`, `evictions`, `expirations` and
+        `invalidations`, and the number of local `entries`.
+        """
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "invalidations": self.invalidations,
+            "entries": len(self.local),
+        }
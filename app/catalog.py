@@ -0,0 +1,329 @@
+"""
+catalog.py
+==========
+
+This module provides the compact, columnar store of the books the recommender serves.
+
+The recommender only needs each book's ID, title, average rating and rating count, so
+`load_data` projects `merged_review` down to those fields and the genres, and the books
+are kept column by column instead of as a DataFrame of whole documents. IDs are a
+fixed-width byte array searched through a sorted permutation, titles are packed into one
+UTF-8 buffer indexed by offsets, ratings are float32 and rating counts int32. Genres are
+interned by the recommender into its sparse genre matrix.
+
+A column costs a few bytes per book and no Python object per value, so a worker's
+resident memory stays close to the size of the data itself.
+
+Classes
+-------
+- `StringColumn` : Strings packed into one buffer with offsets.
+- `Catalog` : The columns of the books.
+- `BookRecord` : A view of one book's fields.
+
+Constants
+---------
+- `CATALOG_PROJECTION` : The `merged_review` fields the recommender loads.
+"""
+
+import numpy as np
+import pandas as pd
+
+CATALOG_PROJECTION = {"_id": 1, "title": 1, "genre": 1, "average_rating": 1, "review_count": 1}
+
+
+class StringColumn:
+    """
+    Strings packed into one UTF-8 buffer, indexed by offsets.
+
+    String `i` is `buffer[offsets[i]:offsets[i + 1]]`. Values appended or replaced after
+    the column is built are kept in a short list and a small dict of patches until the
+    column is next selected or packed, so neither rewrites the buffer, and extended
+    copies of a column share it.
+    """
+
+    def __init__(self, buffer, offsets, patches=None, appended=()):
+        """
+        Wrap a packed buffer.
+
+        Parameters:
+        buffer (np.ndarray): The UTF-8 bytes, as uint8.
+        offsets (np.ndarray): Start of each string and the end of the last one, as int64.
+        patches (dict): Replaced values by row.
+        appended (sequence of str): Values of the rows after the packed ones.
+        """
+        self.buffer = buffer
+        self.offsets = offsets
+        self.patches = {} if patches is None else patches
+        self.appended = appended
+
+    @classmethod
+    def from_strings(cls, values):
+        """
+        Pack strings into a column. Values that are not strings are stored as "".
+
+        Parameters:
+        values (iterable of str): The strings, in row order.
+
+        Returns:
+        StringColumn: The packed column.
+        """
+        encoded = [value.encode() if isinstance(value, str) else b"" for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.appended)
+
+    def __getitem__(self, row):
+        patched = self.patches.get(row)
+        if patched is not None:
+            return patched
+        packed = len(self.offsets) - 1
+        if row >= packed:
+            return self.appended[row - packed]
+        return self.buffer[self.offsets[row]:self.offsets[row + 1]].tobytes().decode()
+
+    def __iter__(self):
+        raw = self.buffer.tobytes()
+        patches = self.patches
+        for row, (start, end) in enumerate(zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())):
+            patched = patches.get(row)
+            yield raw[start:end].decode() if patched is None else patched
+        for row, value in enumerate(self.appended, start=len(self.offsets) - 1):
+            yield patches.get(row, value)
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes + self.offsets.nbytes
+
+    def take(self, rows):
+        """
+        Decode the strings at some rows.
+
+        Parameters:
+        rows (array-like of int): Row positions.
+
+        Returns:
+        list of str: The strings, in the order of `rows`.
+        """
+        return [self[row] for row in rows]
+
+    def set(self, row, value):
+        """
+        Replace the string at a row.
+
+        Parameters:
+        row (int): Row position.
+        value (str): The new string.
+        """
+        self.patches[row] = value
+
+    def extend(self, values):
+        """
+        Return a copy of the column with strings appended.
+
+        Parameters:
+        values (iterable of str): The strings to append.
+
+        Returns:
+        StringColumn: The extended column.
+        """
+        appended = [value if isinstance(value, str) else "" for value in values]
+        return StringColumn(self.buffer, self.offsets, dict(self.patches), (*self.appended, *appended))
+
+    def select(self, keep):
+        """
+        Return a packed copy of the column holding only some rows.
+
+        Parameters:
+        keep (np.ndarray): Boolean mask of the rows to keep.
+
+        Returns:
+        StringColumn: The selected rows, packed into a new buffer.
+        """
+        if self.patches or self.appended:
+            return StringColumn.from_strings(value for value, kept in zip(self, keep) if kept)
+        starts = self.offsets[:-1][keep]
+        lengths = self.offsets[1:][keep] - starts
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Byte i of the result comes from its string's start plus its position in that string
+        positions = np.arange(offsets[-1], dtype=np.int64) + np.repeat(starts - offsets[:-1], lengths)
+        return StringColumn(self.buffer[positions], offsets)
+
+    def packed(self):
+        """
+        Return the column with its appended and patched values folded into the buffer.
+        """
+        return self.select(np.ones(len(self), dtype=bool)) if self.patches or self.appended else self
+
+
+class Catalog:
+    """
+    The books served by the recommender, stored column by column.
+
+    Rows line up with the rows of the recommender's genre matrix. The sorted ID
+    permutation covers the rows present when the catalog was built; rows appended later
+    are located by the recommender until the catalog is next rebuilt.
+    """
+
+    def __init__(self, ids, titles, ratings, rating_counts, id_order=None):
+        """
+        Wrap the columns.
+
+        Parameters:
+        ids (np.ndarray): Book IDs as fixed-width bytes, b"" where unknown.
+        titles (StringColumn): Book titles.
+        ratings (np.ndarray): Average ratings as float32, NaN where unrated.
+        rating_counts (np.ndarray): Number of ratings behind each average, as int32.
+        id_order (np.ndarray): Rows in ID order, computed when not given.
+        """
+        self.ids = ids
+        self.titles = titles
+        self.ratings = ratings
+        self.rating_counts = rating_counts
+        # Kept as intp: `searchsorted` copies a sorter of any other dtype on every call
+        self.id_order = np.argsort(ids, kind="stable") if id_order is None else np.asarray(id_order, dtype=np.intp)
+
+    @classmethod
+    def from_columns(cls, columns, keep=None):
+        """
+        Build a catalog from loaded columns.
+
+        Parameters:
+        columns (dict or pd.DataFrame): Lists of `_id`, `title`, `average_rating` and
+            `review_count` values; missing columns or values are filled in. A book
+            without a rating count but with an average rating counts as rated once.
+        keep (np.ndarray): Boolean mask of the rows to keep, or None for all.
+
+        Returns:
+        Catalog: The catalog.
+        """
+        if keep is None:
+            keep = np.ones(len(columns.get("title", ())), dtype=bool)
+
+        def column(name):
+            values = columns.get(name)
+            if values is None:
+                return np.full(keep.sum(), None, dtype=object)
+            return np.asarray(values, dtype=object)[keep]
+
+        ids = np.array([b"" if book_id is None else str(book_id).encode() for book_id in column("_id")], dtype="S")
+        ratings = pd.to_numeric(pd.Series(column("average_rating")), errors="coerce").to_numpy(np.float32)
+        counts = pd.to_numeric(pd.Series(column("review_count")), errors="coerce").to_numpy(np.float64)
+        counts = np.where(np.isnan(counts), ~np.isnan(ratings), counts)
+        return cls(ids, StringColumn.from_strings(column("title")), ratings, counts.astype(np.int32))
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def __getitem__(self, row):
+        return BookRecord(self, row)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the columns.
+        """
+        return self.ids.nbytes + self.titles.nbytes + self.ratings.nbytes + self.rating_counts.nbytes + self.id_order.nbytes
+
+    def locate(self, book_id):
+        """
+        Find a book's row among the rows present when the catalog was built.
+
+        Parameters:
+        book_id (str or ObjectId): The book's ID.
+
+        Returns:
+        int or None: The row, or None if the ID is unknown.
+        """
+        key = str(book_id).encode()
+        position = np.searchsorted(self.ids[:len(self.id_order)], key, sorter=self.id_order)
+        if position < len(self.id_order):
+            row = int(self.id_order[position])
+            if self.ids[row] == key:
+                return row
+        return None
+
+    def extend(self, ids, titles, ratings, rating_counts):
+        """
+        Return a copy of the catalog with books appended.
+
+        The copy shares the ID permutation, so appended rows are not found by `locate`.
+
+        Parameters:
+        ids (list of str): The appended books' IDs.
+        titles (list of str): Their titles.
+        ratings (list of float): Their average ratings.
+        rating_counts (list of int): Their rating counts.
+
+        Returns:
+        Catalog: The extended catalog.
+        """
+        return Catalog(
+            np.concatenate([self.ids, np.array([str(book_id).encode() for book_id in ids], dtype="S")]),
+            self.titles.extend(titles),
+            np.concatenate([self.ratings, np.asarray(ratings, dtype=np.float32)]),
+            np.concatenate([self.rating_counts, np.asarray(rating_counts, dtype=np.int32)]),
+            self.id_order,
+        )
+
+    def copy(self):
+        """
+        Return a copy that later rating and title writes to this catalog do not affect.
+
+        The ID and title buffers are never written in place, so they are shared.
+
+        Returns:
+        Catalog: The copy.
+        """
+        titles = StringColumn(self.titles.buffer, self.titles.offsets, dict(self.titles.patches), self.titles.appended)
+        return Catalog(self.ids, titles, self.ratings.copy(), self.rating_counts.copy(), self.id_order)
+
+    def select(self, keep):
+        """
+        Return a catalog holding only some rows.
+
+        Parameters:
+        keep (np.ndarray): Boolean mask of the rows to keep.
+
+        Returns:
+        Catalog: The selected rows, with a fresh ID permutation.
+        """
+        return Catalog(self.ids[keep], self.titles.select(keep), self.ratings[keep], self.rating_counts[keep])
+
+
+class BookRecord:
+    """
+    A read-only view of one book in a `Catalog`.
+
+    Fields are read from the columns on access, so records are cheap to create and
+    always reflect the catalog's current values.
+    """
+
+    __slots__ = ("catalog", "row")
+
+    def __init__(self, catalog, row):
+        self.catalog = catalog
+        self.row = row
+
+    @property
+    def id(self):
+        return self.catalog.ids[self.row].decode()
+
+    @property
+    def title(self):
+        return self.catalog.titles[self.row]
+
+    @property
+    def average_rating(self):
+        return float(self.catalog.ratings[self.row])
+
+    @property
+    def review_count(self):
+        return int(self.catalog.rating_counts[self.row])
+
+    def __repr__(self):
+        return f"BookRecord(id={self.id!r}, title={self.title!r}, average_rating={self.average_rating})"
+
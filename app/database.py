@@ -9,12 +9,21 @@ allowing CRUD operations and other interactions with books and reviews data.
 
 Configuration
 -------------
-- MongoDB connection details are specified via the `MONGO_DETAILS` constant.
-- The database is initialized as `BooksLibrary`.
+- The connection string is read from the `MONGO_DETAILS` environment variable and
+  defaults to a local server, `mongodb://localhost:27017`.
+- The database is `MONGO_DATABASE`, `BooksLibrary` by default.
+- Pool size, timeouts, read preference and wire compression are set by the environment
+  variables in `CLIENT_OPTIONS`. Unset ones keep the driver's defaults.
 - Collections:
   - `books_collection` : Stores book metadata.
   - `reviews_collection` : Stores user reviews.
   - `merged_review_collection` : Combines book and review data for recommendations.
+  - `users_collection` : Stores password hashes, when `app.auth` uses the MongoDB store.
+- `ensure_indexes` creates the indexes listed in `INDEXES` that the request path relies on.
+- `connect` checks that the server is reachable and warms the connection pool up to its
+  minimum size. The application runs it before taking traffic.
+- `pool_metrics` counts connection pool events, for pool utilization reporting.
+- `command_metrics` times every command, into `app.metrics`.
 
 Dependencies
 ------------
@@ -31,23 +40,227 @@ Example:
         return await books_collection.find({}).to_list(length=None)
 """
 
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import ServerSelectionTimeoutError
+import asyncio
 import logging
+import os
+import threading
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, monitoring
+from pymongo.common import MAX_POOL_SIZE
+from pymongo.errors import PyMongoError
+
+from .metrics import CommandMetrics
 
 logging.basicConfig(level=logging.INFO)
 
-MONGO_DETAILS = "mongodb+srv://<user>:<password>@cluster.s.mongodb.net/?authMechanism=SCRAM-SHA-1"  # Replace with your MongoDB connection string
+MONGO_DETAILS = os.environ.get("MONGO_DETAILS", "mongodb://localhost:27017")
+MONGO_DATABASE = os.environ.get("MONGO_DATABASE", "BooksLibrary")
+
+# Environment variables for the client options, with the `MongoClient` keyword each one
+# sets and how its value is parsed
+CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_READ_PREFERENCE": ("readPreference", str),
+    "MONGO_COMPRESSORS": ("compressors", str),
+    "MONGO_APP_NAME": ("appname", str),
+}
+
+
+def client_options(environ=os.environ):
+    """
+    Read the client options from the environment.
+
+    Parameters:
+    environ (mapping): The environment variables.
+
+    Returns:
+    dict: `MongoClient` keyword arguments for the variables in `CLIENT_OPTIONS` that are set.
+
+    Raises:
+    ValueError: If a numeric variable is not an integer.
+    """
+    options = {}
+    for variable, (option, parse) in CLIENT_OPTIONS.items():
+        value = environ.get(variable)
+        if not value:
+            continue
+        try:
+            options[option] = parse(value)
+        except ValueError:
+            raise ValueError(f"{variable} must be an integer, got {value!r}")
+    return options
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener that keeps utilization counters for every server's pool.
+
+    The driver calls the listener from its own threads, so the counters are updated under
+    a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._max_pool_sizes = {}  # Server address -> maxPoolSize of its pool
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_seconds = 0.0
+        self.clears = 0
+
+    def pool_created(self, event):
+        with self._lock:
+            # The event only lists options that differ from the driver's defaults
+            self._max_pool_sizes[event.address] = event.options.get("maxPoolSize", MAX_POOL_SIZE)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.clears += 1
 
-client = AsyncIOMotorClient(MONGO_DETAILS)
-database = client.BooksLibrary
+    def pool_closed(self, event):
+        with self._lock:
+            self._max_pool_sizes.pop(event.address, None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.checkouts += 1
+            self.checkout_seconds += event.duration or 0.0
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def stats(self):
+        """
+        Report the pool counters, summed over the servers' pools.
+
+        Returns:
+        dict: Connections `open`, `in_use` and `idle`, operations `waiting` for one, and
+        `utilization` (in-use connections over the pools' capacity); connections `created`
+        and `closed`, `checkouts`, `checkout_failures` and the mean checkout wait so far;
+        pool `clears`; and the number of `servers` and their `max_pool_size`.
+        """
+        with self._lock:
+            sizes = [size for size in self._max_pool_sizes.values() if size]
+            capacity = sum(sizes)
+            return {
+                "open": self.open,
+                "in_use": self.in_use,
+                "idle": self.open - self.in_use,
+                "waiting": self.waiting,
+                "utilization": self.in_use / capacity if capacity else 0.0,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "mean_checkout_ms": 1000 * self.checkout_seconds / self.checkouts if self.checkouts else 0.0,
+                "clears": self.clears,
+                "servers": len(self._max_pool_sizes),
+                "max_pool_size": max(sizes, default=None),
+            }
+
+
+pool_metrics = PoolMetrics()
+command_metrics = CommandMetrics()
+client = AsyncIOMotorClient(MONGO_DETAILS, event_listeners=[pool_metrics, command_metrics], **client_options())
+database = client[MONGO_DATABASE]
 books_collection = database.get_collection("books")
 reviews_collection = database.get_collection("reviews")
 merged_review_collection = database.get_collection("merged_review")
+users_collection = database.get_collection("users")
+
+# Indexes per collection. `_id` is indexed by MongoDB itself, which covers book lookups
+# and the keyset pagination of `/books`.
+INDEXES = {
+    reviews_collection: [
+        # Reviews of one book, paginated by `_id`
+        IndexModel([("book_id", ASCENDING), ("_id", ASCENDING)], name="book_id_id"),
+    ],
+    merged_review_collection: [
+        # Recommender freshness checks and change polling
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_1"),
+        # Case-insensitive title lookups
+        IndexModel([("title_key", ASCENDING)], name="title_key_1"),
+        # Books sharing a genre (multikey over the genre array)
+        IndexModel([("genre", ASCENDING), ("average_rating", DESCENDING)], name="genre_average_rating"),
+    ],
+}
+
+
+async def ensure_indexes():
+    """
+    Create the indexes in `INDEXES`. Existing indexes are left as they are, so this is
+    safe to run on every startup.
+    """
+    for collection, indexes in INDEXES.items():
+        await collection.create_indexes(indexes)
+
+
+async def connect(warm_connections=None):
+    """
+    Check that the server is reachable and warm the connection pool.
+
+    The pool is warmed by running concurrent pings, each of which checks out its own
+    connection, so the connections are open before the first requests arrive.
 
+    Parameters:
+    warm_connections (int): Connections to open, the pool's `minPoolSize` by default.
 
-try:
-    client.server_info()
-    logging.info("Successfully connected to MongoDB")
-except ServerSelectionTimeoutError:
-    logging.error("Unable to connect to MongoDB")
+    Raises:
+    PyMongoError: If the server cannot be reached within the server selection timeout.
+    """
+    started = time.perf_counter()
+    try:
+        await client.admin.command("ping")
+    except PyMongoError:
+        logging.error("Unable to connect to MongoDB")
+        raise
+    if warm_connections is None:
+        warm_connections = client.options.pool_options.min_pool_size
+    if warm_connections > 1:
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(warm_connections)))
+    logging.info(
+        "Connected to MongoDB in %.0f ms with %d pooled connections",
+        1000 * (time.perf_counter() - started),
+        pool_metrics.open,
+    )
@@ -0,0 +1,123 @@
+"""
+diagnostics.py
+==============
+
+This module reports MongoDB query plans for the queries on the request path.
+
+Each entry in `hot_queries` mirrors a query the API or the recommender issues. It is
+shaped the same way, with a placeholder ObjectId where a real ID would go.
+`explain_hot_queries` runs `explain()` on each one and summarizes the winning plan, so
+a deployment or a CI job can check that no hot query falls back to a collection scan.
+
+Functions
+---------
+- `hot_queries` : The queries whose plans are reported.
+- `summarize_plan` : Condense an `explain()` result.
+- `explain_hot_queries` : Explain every hot query.
+"""
+
+from bson import ObjectId
+
+from .database import books_collection, merged_review_collection, reviews_collection
+
+# The page queries fetch one extra document to detect whether a next page exists
+PAGE_QUERY_LIMIT = 1001
+
+
+def hot_queries():
+    """
+    List the request-path queries whose plans are reported.
+
+    Returns:
+    list of dict: Each with a `name`, `collection`, `filter` and optional `sort` and `limit`.
+    """
+    sample_id = ObjectId()
+    return [
+        {"name": "get_book", "collection": books_collection, "filter": {"_id": sample_id}},
+        {
+            "name": "get_books",
+            "collection": books_collection,
+            "filter": {"_id": {"$gt": sample_id}},
+            "sort": [("_id", 1)],
+            "limit": PAGE_QUERY_LIMIT,
+        },
+        {
+            "name": "get_reviews",
+            "collection": reviews_collection,
+            "filter": {"book_id": sample_id, "_id": {"$gt": sample_id}},
+            "sort": [("_id", 1)],
+            "limit": PAGE_QUERY_LIMIT,
+        },
+        {"name": "merged_review_by_book", "collection": merged_review_collection, "filter": {"_id": sample_id}},
+        {
+            "name": "top_rated_by_genre",
+            "collection": merged_review_collection,
+            "filter": {"genre": "Fiction", "average_rating": {"$type": "number"}},
+            "sort": [("average_rating", -1)],
+            "limit": 10,
+        },
+        {
+            "name": "merged_review_freshness",
+            "collection": merged_review_collection,
+            "filter": {"updated_at": {"$exists": True}},
+            "sort": [("updated_at", -1)],
+            "limit": 1,
+        },
+    ]
+
+
+def summarize_plan(explain):
+    """
+    Condense an `explain()` result to the facts needed to judge a plan.
+
+    Parameters:
+    explain (dict): The output of `Cursor.explain()`.
+
+    Returns:
+    dict: The winning plan's `stages` (outermost first), the `indexes` it uses, whether it
+    contains a `collscan`, and the keys and documents examined for the documents returned.
+    """
+    winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    # Plans run by the slot-based engine nest the classic plan under "queryPlan"
+    winning_plan = winning_plan.get("queryPlan", winning_plan)
+
+    stages = []
+    indexes = []
+    pending = [winning_plan]
+    while pending:
+        stage = pending.pop(0)
+        stages.append(stage.get("stage"))
+        if "indexName" in stage:
+            indexes.append(stage["indexName"])
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+
+    stats = explain.get("executionStats", {})
+    return {
+        "stages": stages,
+        "indexes": indexes,
+        "collscan": "COLLSCAN" in stages,
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+    }
+
+
+async def explain_hot_queries():
+    """
+    Explain every query in `hot_queries`.
+
+    Returns:
+    list of dict: The `name` and `collection` of each query with its `summarize_plan` summary.
+    """
+    summaries = []
+    for query in hot_queries():
+        cursor = query["collection"].find(query["filter"])
+        if "sort" in query:
+            cursor = cursor.sort(query["sort"])
+        if "limit" in query:
+            cursor = cursor.limit(query["limit"])
+        explain = await cursor.explain()
+        summaries.append({"name": query["name"], "collection": query["collection"].name, **summarize_plan(explain)})
+    return summaries
@@ -0,0 +1,164 @@
+"""
+genres.py
+=========
+
+This module normalizes book genres for the Books Library Management System.
+
+The `merged_review` data imported from CSV stores each book's genres as a stringified
+Python list (e.g. "['Fantasy', 'Adventure']"). This module parses that form safely,
+rewrites it once into native MongoDB arrays, and interns genre names into dense integer
+IDs for the recommender.
+
+Functions
+---------
+- `parse_genres` : Parse any supported genre field into a list of names.
+- `normalize_genre_field` : Migration that stores genres as native arrays.
+
+Classes
+-------
+- `GenreVocabulary` : Interned genre names with integer IDs.
+
+Usage
+-----
+Run the migration once after importing the CSV data:
+
+    python -m app.genres
+"""
+
+import ast
+import asyncio
+import logging
+
+from pymongo import UpdateOne
+
+from .database import merged_review_collection
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_genres(value):
+    """
+    Parse a genre field into a list of genre names.
+
+    Accepts native lists, the stringified lists stored in `merged_review`
+    (e.g. "['Fantasy', 'Adventure']") and the comma-separated strings submitted
+    through the `Book` model. The stringified form is parsed with `ast.literal_eval`,
+    so the field is never executed as code.
+
+    Parameters:
+    value (list or str): The raw genre field.
+
+    Returns:
+    list of str: The genre names, in their original order.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                return []
+        else:
+            value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return []
+    return [str(genre).strip() for genre in value if str(genre).strip()]
+
+
+class GenreVocabulary:
+    """
+    Interned genre names with dense integer IDs, assigned in first-seen order.
+
+    The IDs double as column positions in the recommender's genre matrix, so a book's
+    genres can be stored as a handful of integers instead of a list of strings.
+    """
+
+    def __init__(self, names=()):
+        """
+        Initialize the vocabulary.
+
+        Parameters:
+        names (iterable of str): Genre names to intern up front.
+        """
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def intern(self, name):
+        """
+        Return the ID of a genre, assigning the next free ID if it is new.
+
+        Parameters:
+        name (str): The genre name.
+
+        Returns:
+        int: The genre ID.
+        """
+        genre_id = self.ids.get(name)
+        if genre_id is None:
+            genre_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return genre_id
+
+    def encode(self, names):
+        """
+        Intern a book's genres.
+
+        Parameters:
+        names (list of str): The genre names; duplicates are dropped.
+
+        Returns:
+        list of int: The genre IDs, in first-seen order.
+        """
+        return [self.intern(name) for name in dict.fromkeys(names)]
+
+    def lookup(self, names):
+        """
+        Map query genres to IDs without growing the vocabulary.
+
+        Parameters:
+        names (list of str): The genre names.
+
+        Returns:
+        list of int: The sorted, unique IDs of the known genres.
+        """
+        return sorted({self.ids[name] for name in names if name in self.ids})
+
+
+async def normalize_genre_field(collection=merged_review_collection, batch_size=1000):
+    """
+    Rewrite stringified genre lists as native arrays, in unordered bulk batches.
+
+    Documents whose `genre` is already an array are left untouched, so the migration
+    can be re-run safely after each import.
+
+    Parameters:
+    collection: The Motor collection to migrate.
+    batch_size (int): Number of updates per `bulk_write`.
+
+    Returns:
+    int: The number of documents updated.
+    """
+    cursor = collection.find({"genre": {"$type": "string"}}, {"genre": 1}).batch_size(batch_size)
+    updates = []
+    updated = 0
+    async for document in cursor:
+        updates.append(UpdateOne({"_id": document["_id"]}, {"$set": {"genre": parse_genres(document["genre"])}}))
+        if len(updates) >= batch_size:
+            updated += (await collection.bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        updated += (await collection.bulk_write(updates, ordered=False)).modified_count
+    return updated
+
+
+if __name__ == "__main__":
+    count = asyncio.run(normalize_genre_field())
+    logging.info("Normalized genres for %d documents", count)
@@ -0,0 +1,393 @@
+"""
+indexes.py
+==========
+
+This module provides the candidate indexes behind `BookRecommender`.
+
+An index maps a query's genre IDs to candidate book rows and the number of query genres
+each candidate matches. The recommender then filters and ranks the candidates. Three
+implementations trade accuracy for latency:
+
+- `BruteForceIndex` : Scores every book with one sparse matrix product. Exact.
+- `InvertedIndex` : Walks only the posting lists of the query's genres, in rating order
+  when the query has a minimum rating. Exact.
+- `LSHIndex` : Random-hyperplane locality-sensitive hashing over the genre vectors,
+  re-scored exactly. Approximate; its recall is measured with
+  `app.recommender.recall_at_k`.
+
+Every index is immutable. `extend` returns a new index that also covers rows appended
+to the genre matrix, so scoring jobs that hold the old index are unaffected.
+
+Classes
+-------
+- `CandidateIndex` : The index interface.
+- `BruteForceIndex`, `InvertedIndex`, `LSHIndex` : The implementations.
+- `PostingLists` : Delta-encoded per-genre row lists.
+
+Functions
+---------
+- `index_factory` : Look up an index class by name.
+"""
+
+import copy
+
+import numpy as np
+from scipy import sparse
+
+
+class CandidateIndex:
+    """
+    Interface of the recommender's candidate indexes.
+    """
+
+    name = None
+
+    def __init__(self, features, ratings=None):
+        """
+        Build the index.
+
+        Parameters:
+        features (sparse.csr_matrix): The binary genre matrix, one row per book.
+        ratings (np.ndarray): Average rating of each row when the index is built, for
+            indexes that order postings by rating.
+        """
+        self.features = features
+
+    def extend(self, features, first_row):
+        """
+        Return an index over a genre matrix that gained rows.
+
+        Parameters:
+        features (sparse.csr_matrix): The extended genre matrix.
+        first_row (int): The first appended row.
+
+        Returns:
+        CandidateIndex: The new index.
+        """
+        return type(self)(features)
+
+    def rerated(self, row):
+        """
+        Return an index that accounts for a changed average rating.
+
+        Parameters:
+        row (int): The row whose rating changed.
+
+        Returns:
+        CandidateIndex: The index to use from now on.
+        """
+        return self
+
+    def candidates(self, genre_ids, min_rating=None):
+        """
+        Find the books that share genres with a query.
+
+        Parameters:
+        genre_ids (list of int): The query's genre IDs.
+        min_rating (float): If given, the index may leave out books rated below it.
+
+        Returns:
+        tuple: The candidate rows in ascending order, and the number of query genres
+        each one matches.
+        """
+        raise NotImplementedError
+
+    def candidates_many(self, query_columns, min_ratings=None):
+        """
+        Find the candidates of many queries.
+
+        Parameters:
+        query_columns (list of list of int): Genre IDs for each query.
+        min_ratings (list of float): The minimum rating of each query, if known.
+
+        Returns:
+        list of tuple: The `candidates` result for each query.
+        """
+        if min_ratings is None:
+            min_ratings = [None] * len(query_columns)
+        return [self.candidates(genre_ids, min_rating) for genre_ids, min_rating in zip(query_columns, min_ratings)]
+
+    def _query_vector(self, genre_ids):
+        query = np.zeros(self.features.shape[1], dtype=np.float32)
+        query[genre_ids] = 1
+        return query
+
+
+class BruteForceIndex(CandidateIndex):
+    """
+    Exact index that scores every book with one sparse matrix-vector product.
+    """
+
+    name = 'brute'
+
+    def candidates(self, genre_ids, min_rating=None):
+        matched = self.features @ self._query_vector(genre_ids)
+        rows = np.flatnonzero(matched)
+        return rows, matched[rows]
+
+    def candidates_many(self, query_columns, min_ratings=None):
+        # One sparse matrix product scores every query at once
+        indptr = np.cumsum([0] + [len(columns) for columns in query_columns])
+        indices = np.fromiter((column for columns in query_columns for column in columns), dtype=np.int32, count=indptr[-1])
+        query_matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(query_columns), self.features.shape[1]),
+        )
+        matched = (self.features @ query_matrix.T).tocsc()
+        matched.sort_indices()
+        return [
+            (matched.indices[start:end].astype(np.int64), matched.data[start:end])
+            for start, end in zip(matched.indptr[:-1], matched.indptr[1:])
+        ]
+
+
+class PostingLists:
+    """
+    Per-genre sorted row IDs, delta-encoded in the narrowest unsigned dtype that fits.
+
+    Each list stores its first row separately and the gaps between consecutive rows
+    after it. Catalog-wide genres have small gaps, so a posting usually takes one or two
+    bytes instead of four.
+    """
+
+    def __init__(self, columns, offset=0):
+        """
+        Encode the posting lists of a column-major genre matrix.
+
+        Parameters:
+        columns (sparse.csc_matrix): The genre matrix, with sorted indices.
+        offset (int): Added to every row ID, for blocks of appended rows.
+        """
+        self.indptr = columns.indptr.astype(np.int64)
+        rows = columns.indices.astype(np.int64) + offset
+        gaps = np.zeros(len(rows), dtype=np.int64)
+        gaps[1:] = np.diff(rows)
+        nonempty = self.indptr[:-1] < self.indptr[1:]
+        heads = self.indptr[:-1][nonempty]
+        self.firsts = np.zeros(len(self.indptr) - 1, dtype=np.int64)
+        self.firsts[nonempty] = rows[heads]
+        gaps[heads] = 0
+        self.gaps = gaps.astype(np.min_scalar_type(gaps.max() if len(gaps) else 0))
+
+    @property
+    def num_genres(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self):
+        return self.gaps.nbytes + self.firsts.nbytes + self.indptr.nbytes
+
+    def rows(self, genre_id):
+        """
+        Decode the rows of one genre.
+
+        Parameters:
+        genre_id (int): The genre ID.
+
+        Returns:
+        np.ndarray: The sorted row IDs, empty for genres the block does not know.
+        """
+        if genre_id >= self.num_genres:
+            return np.empty(0, dtype=np.int64)
+        start, end = self.indptr[genre_id], self.indptr[genre_id + 1]
+        return self.firsts[genre_id] + np.cumsum(self.gaps[start:end], dtype=np.int64)
+
+
+class InvertedIndex(CandidateIndex):
+    """
+    Exact index over per-genre posting lists.
+
+    A query only touches the rows listed under its own genres, so its cost follows the
+    popularity of those genres rather than the size of the catalog. Besides the
+    compressed row-ordered postings, each genre keeps its rows ordered by rating, so a
+    query with a minimum rating only reads the prefix of each list that passes it.
+
+    Ratings can change after the index is built. `rerated` records those rows, and
+    they are checked separately against every query. Rows appended after the build go
+    into small row-ordered blocks. Both sets are folded in when the model is next
+    compacted or retrained.
+    """
+
+    name = 'inverted'
+
+    def __init__(self, features, ratings=None):
+        super().__init__(features)
+        columns = features.tocsc()
+        columns.sort_indices()
+        self.blocks = [PostingLists(columns)]  # Appended rows get blocks of their own
+        self.indexed_rows = features.shape[0]
+        self.rerated_rows = np.empty(0, dtype=np.int64)
+        self.rating_rows = None
+        if ratings is not None:
+            # Within each genre, rows by descending rating; unrated rows go last
+            genres = np.repeat(np.arange(columns.shape[1]), np.diff(columns.indptr))
+            # Kept as float32, like the catalog's ratings, so thresholds compare the same way
+            values = np.nan_to_num(np.asarray(ratings, dtype=np.float32)[columns.indices], nan=-np.inf)
+            order = np.lexsort((-values, genres))
+            self.rating_indptr = columns.indptr.astype(np.int64)
+            self.rating_rows = columns.indices[order].astype(np.int32)
+            self.rating_values = values[order]
+
+    def extend(self, features, first_row):
+        columns = features[first_row:].tocsc()
+        columns.sort_indices()
+        extended = copy.copy(self)
+        extended.features = features
+        extended.blocks = self.blocks + [PostingLists(columns, offset=first_row)]
+        return extended
+
+    def rerated(self, row):
+        if self.rating_rows is None or row >= self.indexed_rows or row in self.rerated_rows:
+            return self
+        rerated = copy.copy(self)
+        rerated.rerated_rows = np.append(self.rerated_rows, row)
+        return rerated
+
+    def candidates(self, genre_ids, min_rating=None):
+        use_ratings = min_rating is not None and self.rating_rows is not None
+        postings = []
+        for genre_id in genre_ids:
+            if use_ratings:
+                if genre_id < len(self.rating_indptr) - 1:
+                    start, end = self.rating_indptr[genre_id], self.rating_indptr[genre_id + 1]
+                    # Ratings are descending, so the rows that pass form a prefix
+                    passing = np.searchsorted(-self.rating_values[start:end], -np.float32(min_rating), side='right')
+                    postings.append(self.rating_rows[start:start + passing])
+            else:
+                postings.append(self.blocks[0].rows(genre_id))
+            postings.extend(block.rows(genre_id) for block in self.blocks[1:])
+        postings = [posting for posting in postings if len(posting)]
+        if postings:
+            rows, matched = np.unique(np.concatenate(postings).astype(np.int64), return_counts=True)
+        else:
+            rows, matched = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        if use_ratings and len(self.rerated_rows):
+            # Their build-time rating may have cut them, so they are scored directly
+            fresh = ~np.isin(rows, self.rerated_rows)
+            rows, matched = rows[fresh], matched[fresh]
+            rerated_matched = self.features[self.rerated_rows] @ self._query_vector(genre_ids)
+            hit = rerated_matched > 0
+            rows = np.concatenate([rows, self.rerated_rows[hit]])
+            matched = np.concatenate([matched, rerated_matched[hit].astype(np.int64)])
+            order = np.argsort(rows, kind='stable')
+            rows, matched = rows[order], matched[order]
+        return rows, matched.astype(np.float32)
+
+
+class LSHIndex(CandidateIndex):
+    """
+    Approximate index using random-hyperplane (SimHash) locality-sensitive hashing.
+
+    Each of `tables` hash tables signs each genre vector against `bits` random
+    hyperplanes, so books with a high cosine similarity tend to share a bucket. A query
+    probes its own bucket and, with `multiprobe`, the buckets one bit away, in every
+    table. The union of those buckets is then scored exactly. More tables and probes
+    raise recall at the cost of larger candidate sets; fewer bits make buckets larger.
+    Codes and bucket order are stored as int32, so `bits` must be at most 31.
+    """
+
+    name = 'lsh'
+    BUILD_CHUNK = 65536
+
+    def __init__(self, features, ratings=None, tables=16, bits=10, multiprobe=True, seed=0, state=None):
+        super().__init__(features)
+        self.tables = tables
+        self.bits = bits
+        self.multiprobe = multiprobe
+        self.seed = seed
+        if state is not None:
+            self.planes, self.sorted_codes, self.order, self.tail_rows, self.tail_codes = state
+            return
+        self.planes = self._planes(0, features.shape[1])
+        codes = self._codes(features)
+        self.order = np.argsort(codes, axis=0, kind='stable').T.astype(np.int32)
+        self.sorted_codes = np.take_along_axis(codes, self.order.T, axis=0).T
+        self.tail_rows = np.empty(0, dtype=np.int64)
+        self.tail_codes = np.empty((0, tables), dtype=np.int32)
+
+    def _planes(self, start, stop):
+        """
+        Return the hyperplane coefficients of genres `start` to `stop`.
+
+        Each genre's coefficients come from its own seeded generator, so genres interned
+        after the index was built get the same planes as they would in a rebuild.
+        """
+        rows = [np.random.default_rng([self.seed, genre_id]).standard_normal(self.tables * self.bits) for genre_id in range(start, stop)]
+        return np.array(rows, dtype=np.float32).reshape(stop - start, self.tables * self.bits)
+
+    def _planes_for(self, num_genres):
+        if num_genres <= len(self.planes):
+            return self.planes[:num_genres]
+        return np.vstack([self.planes, self._planes(len(self.planes), num_genres)])
+
+    def _codes(self, features):
+        planes = self._planes_for(features.shape[1])
+        weights = np.int32(1) << np.arange(self.bits, dtype=np.int32)
+        codes = np.empty((features.shape[0], self.tables), dtype=np.int32)
+        for start in range(0, features.shape[0], self.BUILD_CHUNK):
+            signs = np.asarray(features[start:start + self.BUILD_CHUNK] @ planes) > 0
+            codes[start:start + len(signs)] = signs.reshape(len(signs), self.tables, self.bits) @ weights
+        return codes
+
+    def extend(self, features, first_row):
+        planes = self._planes_for(features.shape[1])
+        state = (
+            planes,
+            self.sorted_codes,
+            self.order,
+            np.concatenate([self.tail_rows, np.arange(first_row, features.shape[0], dtype=np.int64)]),
+            np.vstack([self.tail_codes, self._codes(features[first_row:])]),
+        )
+        return LSHIndex(features, None, self.tables, self.bits, self.multiprobe, self.seed, state)
+
+    def candidates(self, genre_ids, min_rating=None):
+        if len(genre_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = self._query_vector(genre_ids)
+        signs = (query @ self._planes_for(len(query))) > 0
+        # Probes share the int32 dtype of the stored codes, so searchsorted does not copy them
+        flips = np.int32(1) << np.arange(self.bits, dtype=np.int32)
+        codes = (signs.reshape(self.tables, self.bits) @ flips).astype(np.int32)
+        probes = codes[:, None]
+        if self.multiprobe:
+            probes = np.hstack([probes, codes[:, None] ^ flips[None, :]])
+
+        found = []
+        for table in range(self.tables):
+            table_codes = self.sorted_codes[table]
+            starts = np.searchsorted(table_codes, probes[table], side='left')
+            ends = np.searchsorted(table_codes, probes[table], side='right')
+            found.extend(self.order[table][start:end] for start, end in zip(starts, ends) if end > start)
+        if len(self.tail_rows):
+            hits = (self.tail_codes[:, :, None] == probes[None, :, :]).any(axis=(1, 2))
+            found.append(self.tail_rows[hits])
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows = np.unique(np.concatenate(found).astype(np.int64))
+        matched = self.features[rows] @ query
+        keep = matched > 0
+        return rows[keep], matched[keep]
+
+
+INDEXES = {index.name: index for index in (BruteForceIndex, InvertedIndex, LSHIndex)}
+
+
+def index_factory(name):
+    """
+    Look up an index class by name.
+
+    Parameters:
+    name (str): 'brute', 'inverted' or 'lsh'.
+
+    Returns:
+    type: The `CandidateIndex` subclass.
+
+    Raises:
+    ValueError: If the name is unknown.
+    """
+    try:
+        return INDEXES[name]
+    except KeyError:
+        raise ValueError(f"Unknown recommender index '{name}'; expected one of {sorted(INDEXES)}")
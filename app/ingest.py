@@ -0,0 +1,230 @@
+"""
+ingest.py
+=========
+
+This module bulk-imports books and reviews from NDJSON or CSV files.
+
+Records are validated against the `Book` and `Review` models and written with unordered
+`insert_many` calls, several batches at a time. A row that fails validation or insertion
+is reported with its row number and does not stop the import. After each batch is
+written, the affected books are re-materialized into `merged_review` on the server. The
+`/import` endpoint retrains its worker's recommender once, after the whole import. The
+command line import runs outside the API, so it leaves that to the running workers. Their
+change feeds (`app.sync`) apply the re-materialized books in micro-batches as they are
+written.
+
+Review records carry the reviewed book's ID in a `book_id` field.
+
+Functions
+---------
+- `iter_records` : Read raw records from a text file.
+- `ingest` : Validate and insert records in concurrent batches.
+
+Usage
+-----
+    python -m app.ingest books books.ndjson
+    python -m app.ingest reviews reviews.csv --batch-size 5000 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError
+
+from .database import books_collection, reviews_collection
+from .models import Book, Review
+from .pipelines import refresh_merged_review
+
+logging.basicConfig(level=logging.INFO)
+
+FORMATS = ("ndjson", "csv")
+KINDS = ("books", "reviews")
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CONCURRENCY = 4
+# Reports keep the first errors only, so an import of a malformed file stays bounded
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_records(file, format):
+    """
+    Read raw records from a text file.
+
+    Parameters:
+    file (file object): The text file, opened with `newline=""` for CSV.
+    format (str): "ndjson" or "csv".
+
+    Returns:
+    generator: `(row, record)` pairs, where `row` is the 1-based line number and `record`
+    is a dict, or a `ValueError` if the line could not be parsed.
+    """
+    if format == "csv":
+        reader = csv.DictReader(file)
+        for record in reader:
+            if None in record:
+                yield reader.line_num, ValueError("Row has more fields than the header")
+            else:
+                yield reader.line_num, record
+        return
+    for row, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield row, ValueError(f"Invalid JSON: {error}")
+            continue
+        if not isinstance(record, dict):
+            yield row, ValueError("Record is not a JSON object")
+        else:
+            yield row, record
+
+
+def validate_record(kind, record):
+    """
+    Validate one raw record and convert it into a document to insert.
+
+    Parameters:
+    kind (str): "books" or "reviews".
+    record (dict): The raw record.
+
+    Returns:
+    dict: The document.
+
+    Raises:
+    ValueError: If the record is invalid.
+    """
+    if kind == "books":
+        return Book(**record).dict()
+    try:
+        book_id = ObjectId(record.get("book_id"))
+    except (InvalidId, TypeError):
+        raise ValueError("book_id is not a valid ObjectId")
+    document = Review(**record).dict()
+    document["book_id"] = book_id
+    return document
+
+
+async def _insert_batch(collection, batch, rows, report):
+    """
+    Insert one batch without stopping at failed documents, and record what was written.
+
+    Returns:
+    list: The documents that were inserted.
+    """
+    failed = {}
+    try:
+        await collection.insert_many(batch, ordered=False)
+    except BulkWriteError as error:
+        failed = {write_error["index"]: write_error.get("errmsg", "Write failed") for write_error in error.details["writeErrors"]}
+    for index, message in sorted(failed.items()):
+        _report_error(report, rows[index], message)
+    inserted = [document for index, document in enumerate(batch) if index not in failed]
+    report["inserted"] += len(inserted)
+    return inserted
+
+
+async def _write_batch(kind, batch, rows, report):
+    collection = books_collection if kind == "books" else reviews_collection
+    inserted = await _insert_batch(collection, batch, rows, report)
+    if kind == "books":
+        book_ids = [document["_id"] for document in inserted]
+    else:
+        book_ids = list({document["book_id"] for document in inserted})
+    report["book_ids"].update(book_ids)
+    if book_ids:
+        await refresh_merged_review(book_ids)
+
+
+def _report_error(report, row, message):
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": row, "error": message})
+
+
+async def ingest(kind, records, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Validate records and insert them in concurrent, unordered batches.
+
+    Parsing stops while `concurrency` batches are being written, so memory stays bounded
+    by `batch_size * concurrency` records regardless of the input size.
+
+    Parameters:
+    kind (str): "books" or "reviews".
+    records (iterable): `(row, record)` pairs, as produced by `iter_records`.
+    batch_size (int): Documents per `insert_many` call.
+    concurrency (int): Batches written at the same time.
+
+    Returns:
+    dict: The number of documents `inserted` and rows `failed`, the first
+    `MAX_REPORTED_ERRORS` `errors` as `{"row", "error"}` dicts, and the set of affected
+    `book_ids`.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown record kind '{kind}'")
+    report = {"inserted": 0, "failed": 0, "errors": [], "book_ids": set()}
+    slots = asyncio.Semaphore(concurrency)
+    writes = set()
+
+    async def write(batch, rows):
+        try:
+            await _write_batch(kind, batch, rows, report)
+        finally:
+            slots.release()
+
+    async def flush(batch, rows):
+        await slots.acquire()
+        task = asyncio.ensure_future(write(batch, rows))
+        writes.add(task)
+        task.add_done_callback(writes.discard)
+
+    batch, rows = [], []
+    for row, record in records:
+        if isinstance(record, Exception):
+            _report_error(report, row, str(record))
+            continue
+        try:
+            batch.append(validate_record(kind, record))
+        except ValueError as error:  # Includes pydantic's ValidationError
+            _report_error(report, row, str(error))
+            continue
+        rows.append(row)
+        if len(batch) >= batch_size:
+            await flush(batch, rows)
+            batch, rows = [], []
+    if batch:
+        await flush(batch, rows)
+    if writes:
+        await asyncio.gather(*writes)
+    return report
+
+
+async def main(kind, path, format, batch_size, concurrency):
+    with open(path, newline="", encoding="utf-8") as file:
+        report = await ingest(kind, iter_records(file, format), batch_size, concurrency)
+    for error in report["errors"]:
+        logging.warning("Row %d: %s", error["row"], error["error"])
+    logging.info("Imported %d %s, %d rows failed", report["inserted"], kind, report["failed"])
+    if report["inserted"]:
+        logging.info(
+            "Running API workers apply the import to their recommender through their change feed, "
+            "unless RECOMMENDER_SYNC=off, in which case they see it when restarted"
+        )
+        if kind == "books":
+            logging.info("Their search indexes include the imported books when they are restarted")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-import books or reviews from NDJSON or CSV.")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+    file_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    asyncio.run(main(args.kind, args.path, file_format, args.batch_size, args.concurrency))
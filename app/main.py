@@ -9,87 +9,234 @@ retrieve book summaries, generate recommendations, and manage reviews.
 
 The module includes the following features:
 - CRUD operations for books and reviews.
-- Book recommendations based on genres and average ratings.
-- Integration with MongoDB for data persistence.
-- Basic authentication for secure access to endpoints.
+- Book recommendations based on genres and average ratings, kept in sync with book and
+  review writes without retraining, including writes made by other workers. Title recommendations are read from per-book neighbor
+  lists precomputed in the background.
+- Title and author search with prefix autocomplete and genre and year filters, served
+  from an in-memory index kept in sync with book writes.
+- Integration with MongoDB for data persistence, with the recommender's `merged_review`
+  collection kept up to date from book and review writes.
+- Per-book review counts, rating sums and rating histograms kept up to date by each review,
+  served per book and as top-rated lists per genre.
+- A read-through cache with ETags for book and review lookups, invalidated by writes.
+- orjson-encoded responses, with the read endpoints fetching only the fields they return.
+- Basic authentication, or optional signed bearer tokens, for secure access to endpoints.
+- Request, recommender and MongoDB command metrics in the Prometheus format, and an
+  opt-in sampling profiler for slow requests.
 
 Routes
 ------
 - `/` : Health check endpoint.
 - `/books` : CRUD operations for books.
+- `/books/search` : Search books by title and author words, genres and publication year.
+- `/books/top-rated` : The best rated books of each of several genres.
+- `/books/{id}/stats` : A book's review count, average rating and rating histogram.
 - `/reviews` : CRUD operations for reviews.
+- `/import` : Bulk-import books or reviews from NDJSON or CSV.
 - `/recommendations` : Generate book recommendations.
+- `/recommendations/batch` : Generate recommendations for many titles or genre lists in one call.
+- `/admin/query-plans` : Query plan summaries for the hot MongoDB queries.
+- `/admin/recommender` : Recommender queueing and timing counters.
+- `/admin/cache` : Entity cache hit, miss and eviction counters.
+- `/admin/database` : MongoDB connection pool utilization counters.
+- `/admin/auth` : Authentication cache and verification counters.
+- `/admin/search` : Search index size counters.
+- `/auth/token` : Issue a short-lived signed token.
+- `/admin/profiles` : Stack samples of recent slow requests, when profiling is enabled.
+- `/metrics` : Metrics in the Prometheus text format.
 
 Authentication
 --------------
 Basic Authentication is used to protect endpoints, with a default username of `Joe` and a password of `librarian`.
+Users and tokens are configured through the `AUTH_*` environment variables described in `app.auth`.
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Path
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from typing import List
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
+from typing import List, Optional
+from pydantic import BaseModel, Field, model_validator
 from bson import ObjectId
 from bson.errors import InvalidId
 import motor.motor_asyncio
+import asyncio
+import io
 import logging
-
-from .database import books_collection, reviews_collection, client
-from .recommender import BookRecommender
+import os
+import tempfile
+
+from .auth import authenticator_from_environ
+from .cache import LRUCache, ReadThroughCache, RedisBackend, etag_matches
+from .catalog import CATALOG_PROJECTION
+from .database import books_collection, reviews_collection, merged_review_collection, client, connect, ensure_indexes, pool_metrics
+from .diagnostics import explain_hot_queries
+from .ingest import DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, ingest, iter_records
+from .metrics import CONTENT_TYPE, RequestMetricsMiddleware, SlowRequestProfiler, registry
+from .models import Book, Review
+from .pipelines import rating_stats, record_review, refresh_merged_review, remove_merged_review
+from .recommender import BookRecommender, RecommenderBusy
+from .search import SearchIndex
+from .serialization import FastJSONResponse, dumps, frame_records, model_projection, project_documents
+from .sync import ChangeFeed
 
 logging.basicConfig(level=logging.INFO)
 
 app = FastAPI(
     title="Books Library Management System",
     description="API for managing a library of books and reviews, with recommendations based on the genre and average rating of a provided book title.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+)
+basic_security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
+authenticator = authenticator_from_environ()
+
+MAX_BATCH_ITEMS = 1000
+
+class RecommendationQuery(BaseModel):
+    key: Optional[str] = None
+    title: Optional[str] = None
+    genres: Optional[List[str]] = None
+    min_rating: float = 4.0
+    num_recommendations: int = Field(5, ge=0)
+
+    @model_validator(mode="after")
+    def check_seed(self):
+        if (self.title is None) == (self.genres is None):
+            raise ValueError("Provide exactly one of 'title' or 'genres'")
+        return self
+
+class BatchRecommendationRequest(BaseModel):
+    items: List[RecommendationQuery] = Field(max_length=MAX_BATCH_ITEMS)
+
+entity_cache = ReadThroughCache(
+    LRUCache(
+        max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", 10000)),
+        ttl=float(os.environ.get("CACHE_TTL_SECONDS", 300)),
+    ),
+    RedisBackend(os.environ["CACHE_REDIS_URL"]) if os.environ.get("CACHE_REDIS_URL") else None,
 )
-security = HTTPBasic()
-
-class Book(BaseModel):
-    title: str
-    author: str
-    genre: str
-    year_published: int
-    summary: str
 
-class Review(BaseModel):
-    user_id: str
-    review_text: str
-    rating: float
+def book_cache_key(book_id):
+    return f"book:{book_id}"
+
+def reviews_cache_key(book_id):
+    return f"reviews:{book_id}"
+
+book_recommender = BookRecommender(
+    snapshot_dir=os.environ.get("RECOMMENDER_SNAPSHOT_DIR"),
+    scoring_threads=int(os.environ.get("RECOMMENDER_SCORING_THREADS", 4)),
+    max_queued=int(os.environ.get("RECOMMENDER_MAX_QUEUED", 64)),
+    training_executor=os.environ.get("RECOMMENDER_TRAINING_EXECUTOR", "process"),
+    result_cache_size=int(os.environ.get("RECOMMENDER_RESULT_CACHE_SIZE", 1024)),
+    index=os.environ.get("RECOMMENDER_INDEX", "inverted"),
+    neighbors=int(os.environ.get("RECOMMENDER_NEIGHBORS", 10)),
+    neighbor_refresh_seconds=float(os.environ.get("RECOMMENDER_NEIGHBOR_REFRESH_SECONDS", 600)),
+    neighbor_workers=int(os.environ["RECOMMENDER_NEIGHBOR_WORKERS"]) if os.environ.get("RECOMMENDER_NEIGHBOR_WORKERS") else None,
+)
 
-book_recommender = BookRecommender()
+search_index = SearchIndex(compact_threshold=int(os.environ.get("SEARCH_COMPACT_THRESHOLD", 1000)))
+
+# Applies other workers' writes to this worker's recommender; RECOMMENDER_SYNC=off disables it
+recommender_sync_mode = os.environ.get("RECOMMENDER_SYNC", "auto")
+recommender_sync = ChangeFeed(
+    merged_review_collection,
+    book_recommender.apply_changes,
+    resync=book_recommender.prepare_data,
+    projection=CATALOG_PROJECTION,
+    mode=recommender_sync_mode,
+    batch_seconds=float(os.environ.get("RECOMMENDER_SYNC_BATCH_MS", 100)) / 1000,
+    poll_seconds=float(os.environ.get("RECOMMENDER_SYNC_POLL_SECONDS", 1)),
+    reconcile_seconds=float(os.environ.get("RECOMMENDER_SYNC_RECONCILE_SECONDS", 60)),
+) if recommender_sync_mode != "off" else None
+
+# Profiling is opt-in: with PROFILE_SLOW_REQUESTS_MS set, requests slower than that are profiled
+profiler = SlowRequestProfiler(
+    threshold=float(os.environ["PROFILE_SLOW_REQUESTS_MS"]) / 1000,
+    interval=float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5)) / 1000,
+) if os.environ.get("PROFILE_SLOW_REQUESTS_MS") else None
+app.add_middleware(RequestMetricsMiddleware, profiler=profiler)
+
+registry.register_stats("bookslibrary_recommender", book_recommender.executor_stats, "Recommender counter")
+registry.register_stats("bookslibrary_cache", entity_cache.stats, "Entity cache counter")
+registry.register_stats("bookslibrary_mongodb_pool", pool_metrics.stats, "MongoDB connection pool counter")
+registry.register_stats("bookslibrary_auth", authenticator.stats, "Authentication counter")
+registry.register_stats("bookslibrary_search", search_index.stats, "Search index size")
+if recommender_sync is not None:
+    registry.register_stats("bookslibrary_recommender_sync", recommender_sync.stats, "Recommender change feed counter")
 
 async def startup_db_client():
-    await client.server_info()
-    logging.info("Connected to MongoDB")
-    await book_recommender.prepare_data() 
+    await connect()
+    await ensure_indexes()
+    if recommender_sync is not None:
+        # Started first, so writes made while the model loads are applied to it
+        await recommender_sync.start()
+        logging.info("Book recommender following other workers' writes through %s", recommender_sync.source)
+    await book_recommender.load_or_prepare()
     logging.info("Book recommender system trained and ready")
+    await search_index.load()
+    logging.info("Search index built with %d books", search_index.stats()["books"])
 
 async def shutdown_db_client():
-    await client.close()
+    if recommender_sync is not None:
+        recommender_sync.close()
+    client.close()
     logging.info("MongoDB connection closed")
+    book_recommender.close()
+
+MAX_PAGE_SIZE = 1000
+MAX_SEARCH_RESULTS = 100
+MAX_TOP_RATED_RESULTS = 100
+MAX_TOP_RATED_GENRES = 20
+STREAM_BATCH_SIZE = 500
+RATING_STATS_PROJECTION = {"review_count": 1, "rating_sum": 1, "average_rating": 1, "rating_histogram": 1}
+TOP_RATED_PROJECTION = {"title": 1, "author": 1, "review_count": 1, "average_rating": 1}
+# Bulk imports larger than this are spooled to a temporary file instead of memory
+IMPORT_SPOOL_SIZE = 16 * 1024 * 1024
 
 app.add_event_handler("startup", startup_db_client)
 app.add_event_handler("shutdown", shutdown_db_client)
 
-def get_current_user(credentials: HTTPBasicCredentials = Depends(security)):
+@app.exception_handler(RecommenderBusy)
+async def recommender_busy_handler(request, exc):
+    """
+    Shed recommendation requests that arrive while the scoring queue is full.
+
+    Returns:
+        JSONResponse: 503 with a `Retry-After` header.
+    """
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+async def get_current_user(
+    credentials: Optional[HTTPBasicCredentials] = Depends(basic_security),
+    token: Optional[HTTPAuthorizationCredentials] = Depends(bearer_security),
+):
     """
-    Authenticate the user using HTTP Basic Authentication.
-    
+    Authenticate the user using HTTP Basic Authentication or a signed bearer token.
+
+    Credentials verified recently are accepted from the authenticator's cache, without
+    hashing the password again.
+
     Args:
         credentials (HTTPBasicCredentials): HTTP Basic Authentication credentials.
+        token (HTTPAuthorizationCredentials): A bearer token from `/auth/token`.
 
     Returns:
         str: The username if authentication is successful.
 
     Raises:
-        HTTPException: If the username or password is incorrect.
+        HTTPException: If no credentials are given, the username or password is
+        incorrect, or the token is invalid or expired.
     """
-    correct_username = "Joe"
-    correct_password = "librarian"
-    if credentials.username != correct_username or credentials.password != correct_password:
-        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if token is not None:
+        username = authenticator.verify_token(token.credentials)
+        if username is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+        return username
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Basic"})
+    if not await authenticator.authenticate(credentials.username, credentials.password):
+        raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
     return credentials.username
 
 def parse_objectid(id: str):
@@ -110,6 +257,113 @@ def parse_objectid(id: str):
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid ID format")
 
+async def fetch_page(collection, query: dict, after: Optional[str], limit: Optional[int], projection: Optional[dict] = None):
+    """
+    Fetch one page of documents using keyset pagination on `_id`.
+
+    Args:
+        collection: The Motor collection to query.
+        query (dict): The filter to apply.
+        after (str): Only return documents whose `_id` is greater than this ObjectId.
+        limit (int): The page size, at most `MAX_PAGE_SIZE`.
+        projection (dict): The fields to return, or None for whole documents.
+
+    Returns:
+        tuple: The documents on the page in `_id` order, and the cursor for the next
+        page or None if this is the last one.
+
+    Raises:
+        HTTPException: If the cursor is invalid or the limit is too large.
+    """
+    limit = MAX_PAGE_SIZE if limit is None else limit
+    if limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must not exceed {MAX_PAGE_SIZE} unless streaming")
+    if after is not None:
+        query = {**query, "_id": {"$gt": parse_objectid(after)}}
+    documents = await collection.find(query, projection).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    if len(documents) > limit:
+        documents = documents[:limit]
+        return documents, str(documents[-1]["_id"])
+    return documents, None
+
+async def find_page(collection, query: dict, model, after: Optional[str], limit: Optional[int]):
+    """
+    Fetch one page of documents as a response, with the `X-Next-Cursor` header set when
+    more follow.
+
+    Only the model's fields are read, and the documents are encoded without being
+    validated again, as they were validated when written.
+
+    Args:
+        collection: The Motor collection to query.
+        query (dict): The filter to apply.
+        model: The pydantic model whose fields are returned.
+        after (str): Only return documents whose `_id` is greater than this ObjectId.
+        limit (int): The page size, at most `MAX_PAGE_SIZE`.
+
+    Returns:
+        FastJSONResponse: The documents on the page, in `_id` order.
+
+    Raises:
+        HTTPException: If the cursor is invalid or the limit is too large.
+    """
+    documents, next_cursor = await fetch_page(collection, query, after, limit, model_projection(model))
+    headers = {} if next_cursor is None else {"X-Next-Cursor": next_cursor}
+    return FastJSONResponse(project_documents(documents, model), headers=headers)
+
+def cached_response(entry: dict, if_none_match: Optional[str], content=None, headers: Optional[dict] = None):
+    """
+    Answer a request from a cache entry, honouring `If-None-Match`.
+
+    Args:
+        entry (dict): The cache entry, with its `value` and `etag`.
+        if_none_match (str): The request's `If-None-Match` header.
+        content: The body to send, if not the whole cached value.
+        headers (dict): Further response headers.
+
+    Returns:
+        Response: The cached value with its `ETag` header, or an empty 304 response if
+        the client's copy is current.
+    """
+    headers = {**(headers or {}), "ETag": entry["etag"]}
+    if etag_matches(if_none_match, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(entry["value"] if content is None else content, headers=headers)
+
+def stream_documents(collection, query: dict, model, after: Optional[str], limit: Optional[int]):
+    """
+    Stream documents as newline-delimited JSON straight from a Motor cursor.
+
+    Only the model's fields are read, and documents are encoded one at a time as each
+    cursor batch arrives, so memory stays bounded by `STREAM_BATCH_SIZE` regardless of
+    the result size.
+
+    Args:
+        collection: The Motor collection to query.
+        query (dict): The filter to apply.
+        model: The pydantic model whose fields are returned.
+        after (str): Only return documents whose `_id` is greater than this ObjectId.
+        limit (int): The maximum number of documents, or None for all of them.
+
+    Returns:
+        StreamingResponse: The NDJSON response.
+
+    Raises:
+        HTTPException: If the cursor is invalid.
+    """
+    if after is not None:
+        query = {**query, "_id": {"$gt": parse_objectid(after)}}
+    cursor = collection.find(query, model_projection(model)).sort("_id", 1).batch_size(STREAM_BATCH_SIZE)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    fields = tuple(model.model_fields)
+
+    async def serialize():
+        async for document in cursor:
+            yield dumps({field: document.get(field) for field in fields}) + b"\n"
+
+    return StreamingResponse(serialize(), media_type="application/x-ndjson")
+
 @app.get("/")
 async def root():
     """
@@ -120,6 +374,28 @@ async def root():
     """
     return {"message": "Welcome to our library"}
 
+@app.post("/auth/token")
+async def issue_token(credentials: Optional[HTTPBasicCredentials] = Depends(basic_security)):
+    """
+    Issue a short-lived signed token, for use as `Authorization: Bearer <token>`.
+
+    Tokens are only issued for a username and password, so a token cannot be used to
+    extend itself.
+
+    Args:
+        credentials (HTTPBasicCredentials): HTTP Basic Authentication credentials.
+
+    Returns:
+        dict: The `access_token`, its `token_type` and the seconds it `expires_in`.
+
+    Raises:
+        HTTPException: If the credentials are missing or incorrect, or tokens are disabled.
+    """
+    if authenticator.token_secret is None:
+        raise HTTPException(status_code=404, detail="Tokens are disabled")
+    username = await get_current_user(credentials, None)
+    return {"access_token": authenticator.issue_token(username), "token_type": "bearer", "expires_in": int(authenticator.token_ttl)}
+
 @app.post("/books", response_model=Book)
 async def add_book(book: Book, username: str = Depends(get_current_user)):
     """
@@ -135,26 +411,125 @@ async def add_book(book: Book, username: str = Depends(get_current_user)):
     book_dict = book.dict()
     result = await books_collection.insert_one(book_dict)
     book_dict["_id"] = str(result.inserted_id)
+    await refresh_merged_review([result.inserted_id])
+    await book_recommender.upsert_book(result.inserted_id, book.title, book.genre)
+    await search_index.upsert_book(result.inserted_id, book.title, book.author, book.genre, book.year_published)
     return book_dict
 
 @app.get("/books", response_model=List[Book])
-async def get_books():
+async def get_books(
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    limit: Optional[int] = Query(None, ge=1, description=f"Page size, at most {MAX_PAGE_SIZE} unless streaming"),
+    stream: bool = Query(False, description="Stream all matching books as newline-delimited JSON"),
+):
+    """
+    Get the books in the library, one page at a time.
+
+    Pages are ordered by ID. When more books follow, the `X-Next-Cursor` response header
+    holds the value to pass as `after` for the next page. Only the `Book` fields are read
+    from MongoDB, and they are encoded without revalidation.
+
+    Args:
+        after (str): Only return books after this cursor.
+        limit (int): The maximum number of books to return.
+        stream (bool): Stream the books as NDJSON instead of returning a single page.
+
+    Returns:
+        List[Book]: A page of books.
+    """
+    if stream:
+        return stream_documents(books_collection, {}, Book, after, limit)
+    return await find_page(books_collection, {}, Book, after, limit)
+
+@app.get("/books/search")
+async def search_books(
+    q: str = Query("", max_length=200, description="Title and author words; the last is matched as a prefix unless followed by a space"),
+    genre: List[str] = Query([], description="Genres the books must have, case-insensitively"),
+    year_from: Optional[int] = Query(None, description="Earliest publication year"),
+    year_to: Optional[int] = Query(None, description="Latest publication year"),
+    prefix: bool = Query(True, description="Match the last word of the query as a prefix"),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS, description=f"Number of books to return, at most {MAX_SEARCH_RESULTS}"),
+):
+    """
+    Search books by title and author words, genres and publication year.
+
+    Results come from the in-memory search index, best rated first.
+
+    Args:
+        q (str): The words to look for in the title or author.
+        genre (List[str]): Genres the books must all have.
+        year_from (int): Earliest publication year.
+        year_to (int): Latest publication year.
+        prefix (bool): Match the last word of the query as a prefix, for autocomplete.
+        limit (int): The maximum number of books to return.
+
+    Returns:
+        list: The matching books with their ID, title, author, genres, publication year
+        and average rating.
+    """
+    return FastJSONResponse(search_index.search(q, genre, year_from, year_to, prefix, limit))
+
+@app.get("/books/top-rated")
+async def get_top_rated_books(
+    genre: List[str] = Query(..., description="Genres to rank books in, by exact name; repeat for several"),
+    limit: int = Query(10, ge=1, le=MAX_TOP_RATED_RESULTS, description=f"Books per genre, at most {MAX_TOP_RATED_RESULTS}"),
+    min_reviews: int = Query(0, ge=0, description="Only rank books with at least this many reviews"),
+):
     """
-    Get a list of all books in the library.
+    Get the best rated books of each of several genres.
+
+    Each genre is read from the precomputed ratings in `merged_review` through its
+    genre and average rating index, so the cost does not depend on the number of
+    reviews. The genres are queried concurrently.
+
+    Args:
+        genre (List[str]): The genres, at most `MAX_TOP_RATED_GENRES`.
+        limit (int): The number of books per genre.
+        min_reviews (int): The minimum review count. Books imported with an average
+            rating but no review count are excluded when it is set.
 
     Returns:
-        List[Book]: A list of all books.
+        dict: For each genre, its rated books with their ID, title, author, average
+        rating and review count, best rated first.
+
+    Raises:
+        HTTPException: If too many genres are given.
     """
-    books = await books_collection.find().to_list(1000)
-    return books
+    genres = list(dict.fromkeys(genre))
+    if len(genres) > MAX_TOP_RATED_GENRES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TOP_RATED_GENRES} genres can be ranked at once")
+
+    async def top_rated(name):
+        query = {"genre": name, "average_rating": {"$type": "number"}}
+        if min_reviews:
+            query["review_count"] = {"$gte": min_reviews}
+        cursor = merged_review_collection.find(query, TOP_RATED_PROJECTION).sort("average_rating", -1).limit(limit)
+        books = []
+        for book in await cursor.to_list(limit):
+            stats = rating_stats(book)
+            books.append({
+                "id": str(book["_id"]), "title": book.get("title"), "author": book.get("author"),
+                "average_rating": stats["average_rating"], "review_count": stats["review_count"],
+            })
+        return books
+
+    ranked = await asyncio.gather(*(top_rated(name) for name in genres))
+    return FastJSONResponse(dict(zip(genres, ranked)))
 
 @app.get("/books/{id}", response_model=Book)
-async def get_book(id: str = Path(..., description="The ID of the book as a valid MongoDB ObjectId")):
+async def get_book(
+    id: str = Path(..., description="The ID of the book as a valid MongoDB ObjectId"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Get a book by its ID.
 
+    Books are served through the entity cache. The response carries an `ETag`, and a
+    request whose `If-None-Match` matches the cached version gets a 304.
+
     Args:
         id (str): The ID of the book as a valid MongoDB ObjectId.
+        if_none_match (str): ETags of the versions the client already has.
 
     Returns:
         Book: The book details.
@@ -163,10 +538,40 @@ async def get_book(id: str = Path(..., description="The ID of the book as a vali
         HTTPException: If the book is not found or the ID format is invalid.
     """
     book_id = parse_objectid(id)
-    book = await books_collection.find_one({"_id": book_id})
+
+    async def load():
+        book = await books_collection.find_one({"_id": book_id}, model_projection(Book))
+        return None if book is None else project_documents([book], Book)[0]
+
+    entry = await entity_cache.get(book_cache_key(book_id), load)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return cached_response(entry, if_none_match)
+
+@app.get("/books/{id}/stats")
+async def get_book_stats(id: str = Path(..., description="The ID of the book as a valid MongoDB ObjectId")):
+    """
+    Get a book's rating statistics.
+
+    The statistics are kept up to date by each review in `merged_review`, so they are
+    read with one lookup instead of aggregating the book's reviews.
+
+    Args:
+        id (str): The ID of the book as a valid MongoDB ObjectId.
+
+    Returns:
+        dict: The book's `id`, `review_count`, `rating_sum`, `average_rating` (None
+        without ratings) and `rating_histogram`, the number of reviews rated 1 to 5 stars
+        rounded down.
+
+    Raises:
+        HTTPException: If the book is not found or the ID format is invalid.
+    """
+    book_id = parse_objectid(id)
+    book = await merged_review_collection.find_one({"_id": book_id}, RATING_STATS_PROJECTION)
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    return Book(**book)
+    return FastJSONResponse({"id": id, **rating_stats(book)})
 
 @app.put("/books/{id}", response_model=Book)
 async def update_book(
@@ -192,6 +597,10 @@ async def update_book(
     result = await books_collection.update_one({"_id": book_id}, {"$set": book.dict()})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Book not found")
+    await entity_cache.invalidate(book_cache_key(book_id))
+    await refresh_merged_review([book_id])
+    await book_recommender.upsert_book(book_id, book.title, book.genre)
+    await search_index.upsert_book(book_id, book.title, book.author, book.genre, book.year_published)
     return book.dict()
 
 @app.delete("/books/{id}")
@@ -213,6 +622,10 @@ async def delete_book(id: str = Path(..., description="The ID of the book as a v
     result = await books_collection.delete_one({"_id": book_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Book not found")
+    await entity_cache.invalidate(book_cache_key(book_id), reviews_cache_key(book_id))
+    await remove_merged_review(book_id)
+    await book_recommender.remove_book(book_id)
+    await search_index.remove_book(book_id)
     return {"message": "Book deleted"}
 
 @app.post("/reviews/{book_id}", response_model=Review)
@@ -240,25 +653,104 @@ async def add_review(
     review_dict["book_id"] = book_id
     result = await reviews_collection.insert_one(review_dict)
     review_dict["_id"] = str(result.inserted_id)
+    await entity_cache.invalidate(reviews_cache_key(book_id))
+    await record_review(book_id, review.rating)
+    await book_recommender.record_rating(book_id, review.rating)
     return review_dict
 
 @app.get("/reviews/{book_id}", response_model=List[Review])
-async def get_reviews(book_id: str = Path(..., description="The ID of the book as a valid MongoDB ObjectId")):
+async def get_reviews(
+    book_id: str = Path(..., description="The ID of the book as a valid MongoDB ObjectId"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    limit: Optional[int] = Query(None, ge=1, description=f"Page size, at most {MAX_PAGE_SIZE} unless streaming"),
+    stream: bool = Query(False, description="Stream all matching reviews as newline-delimited JSON"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
-    Get a list of reviews for a specific book.
+    Get the reviews for a specific book, one page at a time.
+
+    Pages are ordered by review ID. When more reviews follow, the `X-Next-Cursor`
+    response header holds the value to pass as `after` for the next page. The first page
+    at the default size is served through the entity cache, with an `ETag` and 304
+    responses to a matching `If-None-Match`.
 
     Args:
         book_id (str): The ID of the book as a valid MongoDB ObjectId.
+        after (str): Only return reviews after this cursor.
+        limit (int): The maximum number of reviews to return.
+        stream (bool): Stream the reviews as NDJSON instead of returning a single page.
+        if_none_match (str): ETags of the versions the client already has.
 
     Returns:
-        List[Review]: A list of reviews for the book.
+        List[Review]: A page of reviews for the book.
 
     Raises:
-        HTTPException: If the ID format is invalid.
+        HTTPException: If the ID or cursor format is invalid.
     """
     book_id = parse_objectid(book_id)
-    reviews = await reviews_collection.find({"book_id": book_id}).to_list(1000)
-    return reviews
+    query = {"book_id": book_id}
+    if stream:
+        return stream_documents(reviews_collection, query, Review, after, limit)
+    if after is not None or limit is not None:
+        return await find_page(reviews_collection, query, Review, after, limit)
+
+    async def load():
+        documents, next_cursor = await fetch_page(reviews_collection, query, None, None, model_projection(Review))
+        return {"reviews": project_documents(documents, Review), "next_cursor": next_cursor}
+
+    entry = await entity_cache.get(reviews_cache_key(book_id), load)
+    next_cursor = entry["value"]["next_cursor"]
+    headers = {} if next_cursor is None else {"X-Next-Cursor": next_cursor}
+    return cached_response(entry, if_none_match, entry["value"]["reviews"], headers)
+
+@app.post("/import/{kind}")
+async def import_records(
+    request: Request,
+    kind: str = Path(..., pattern="^(books|reviews)$", description="Either books or reviews"),
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$", description="Defaults to the Content-Type"),
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=10000, description="Documents per insert_many call"),
+    concurrency: int = Query(DEFAULT_CONCURRENCY, ge=1, le=32, description="Batches written at the same time"),
+    username: str = Depends(get_current_user),
+):
+    """
+    Bulk-import books or reviews from an NDJSON or CSV request body.
+
+    Records are validated against the `Book` or `Review` model and inserted in unordered
+    batches; invalid rows are skipped and reported. Review records carry a `book_id`.
+    The recommender is retrained once, after the whole import.
+
+    Args:
+        kind (str): Either "books" or "reviews".
+        format (str): "ndjson" or "csv"; "csv" if the Content-Type mentions CSV otherwise.
+        batch_size (int): Documents per `insert_many` call.
+        concurrency (int): Batches written at the same time.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: The number of records `inserted` and `failed`, and per-row `errors`.
+
+    Raises:
+        HTTPException: If the body is not valid UTF-8.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            records = iter_records(io.TextIOWrapper(spool, encoding="utf-8", newline=""), format)
+            report = await ingest(kind, records, batch_size, concurrency)
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="The request body is not valid UTF-8")
+
+    if kind == "reviews":
+        await entity_cache.invalidate(*(reviews_cache_key(book_id) for book_id in report["book_ids"]))
+    if report["inserted"]:
+        await book_recommender.prepare_data()
+        if kind == "books":
+            await search_index.load()
+    return {"inserted": report["inserted"], "failed": report["failed"], "errors": report["errors"]}
 
 @app.get("/recommendations/{book_title}")
 async def get_recommendations(book_title: str = Path(..., description="The title of the book for generating recommendations based on genre and average rating")):
@@ -274,4 +766,148 @@ async def get_recommendations(book_title: str = Path(..., description="The title
     recommendations = await book_recommender.recommend_books_by_title(book_title)
     if isinstance(recommendations, str):
         raise HTTPException(status_code=404, detail=recommendations)
-    return recommendations.to_dict(orient="records")
+    return FastJSONResponse(frame_records(recommendations))
+
+@app.post("/recommendations/batch")
+async def get_batch_recommendations(batch: BatchRecommendationRequest):
+    """
+    Get book recommendations for many seed titles or genre lists in one call.
+
+    All items are scored together in one job. With the brute-force index that is a single
+    sparse matrix product; the default inverted index reads each item's posting lists in turn.
+    Results are streamed as newline-delimited JSON, one line per item in input order,
+    keyed by the item's `key` or, if it has none, its position in `items`. Keys need not
+    be unique. At most `MAX_BATCH_ITEMS` items are accepted.
+
+    Args:
+        batch (BatchRecommendationRequest): The seed titles or genre lists with their
+            per-item `min_rating` and `num_recommendations`.
+
+    Returns:
+        StreamingResponse: NDJSON lines with either `recommendations` or a `detail`
+        message for titles that were not found.
+    """
+    results = await book_recommender.recommend_many([item.dict(exclude_none=True) for item in batch.items])
+
+    def serialize():
+        for position, (item, recommendations) in enumerate(zip(batch.items, results)):
+            key = position if item.key is None else item.key
+            if isinstance(recommendations, str):
+                line = {"key": key, "detail": recommendations}
+            else:
+                line = {"key": key, "recommendations": frame_records(recommendations)}
+            yield dumps(line) + b"\n"
+
+    return StreamingResponse(serialize(), media_type="application/x-ndjson")
+
+@app.get("/admin/query-plans")
+async def get_query_plans(username: str = Depends(get_current_user)):
+    """
+    Report the MongoDB query plan of each hot request-path query.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: Per-query plan summaries, and `collscan` set if any of them scans a whole
+        collection.
+    """
+    queries = await explain_hot_queries()
+    return {"collscan": any(query["collscan"] for query in queries), "queries": queries}
+
+@app.get("/admin/recommender")
+async def get_recommender_stats(username: str = Depends(get_current_user)):
+    """
+    Report the recommender's scoring queue and training counters.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: The counters from `BookRecommender.executor_stats`, and under `sync` those
+        of the feed of other workers' writes, if it is enabled.
+    """
+    stats = book_recommender.executor_stats()
+    if recommender_sync is not None:
+        stats["sync"] = recommender_sync.stats()
+    return stats
+
+@app.get("/admin/cache")
+async def get_cache_stats(username: str = Depends(get_current_user)):
+    """
+    Report the entity cache counters.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: The counters from `ReadThroughCache.stats`.
+    """
+    return entity_cache.stats()
+
+@app.get("/admin/database")
+async def get_database_stats(username: str = Depends(get_current_user)):
+    """
+    Report this worker's MongoDB connection pool counters.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: The counters from `PoolMetrics.stats`.
+    """
+    return pool_metrics.stats()
+
+@app.get("/admin/auth")
+async def get_auth_stats(username: str = Depends(get_current_user)):
+    """
+    Report this worker's authentication counters.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: The counters from `Authenticator.stats`.
+    """
+    return authenticator.stats()
+
+@app.get("/admin/search")
+async def get_search_stats(username: str = Depends(get_current_user)):
+    """
+    Report the size of the search index.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: The counters from `SearchIndex.stats`.
+    """
+    return search_index.stats()
+
+@app.get("/admin/profiles")
+async def get_profiles(username: str = Depends(get_current_user)):
+    """
+    Report the stack samples of this worker's recent slow requests.
+
+    Args:
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: Whether profiling is `enabled`, its `threshold_ms`, and the `profiles`
+        from `SlowRequestProfiler.profiles`.
+    """
+    if profiler is None:
+        return {"enabled": False, "threshold_ms": None, "profiles": []}
+    return {"enabled": True, "threshold_ms": profiler.threshold * 1000, "profiles": profiler.profiles()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Expose this worker's metrics in the Prometheus text format.
+
+    Returns:
+        Response: Request latency and size histograms, requests in flight, recommender
+        phase and MongoDB command timings, and the recommender, cache and connection
+        pool counters.
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,481 @@
+"""
+metrics.py
+==========
+
+This module collects the API's performance metrics and renders them in the Prometheus
+text exposition format, for `GET /metrics`.
+
+Three sources feed the process-wide `registry`:
+
+- `RequestMetricsMiddleware` times every HTTP request and records its response size,
+  labeled by method, route template and status, and counts the requests in flight.
+- `BookRecommender` times its load, encode, fit, queue and score phases.
+- `CommandMetrics`, registered with the MongoDB client, times every database command.
+
+Counters that other components already keep, such as the connection pool and cache
+statistics, are exported through `MetricsRegistry.register_stats` when scraped. Each
+worker process keeps its own registry, so every worker is scraped separately.
+
+`SlowRequestProfiler` is an opt-in sampling profiler. While requests are in flight, a
+background thread samples the stack of every thread in the process, and the samples
+taken during a request slower than the threshold are kept as collapsed stacks, the
+input format of flame graph tools.
+
+Classes
+-------
+- `Counter` : A monotonically increasing value per label set.
+- `Gauge` : A value per label set that can go up and down.
+- `Histogram` : Bucketed observations per label set.
+- `MetricsRegistry` : Holds metrics and renders them.
+- `RequestMetricsMiddleware` : ASGI middleware recording request metrics.
+- `CommandMetrics` : pymongo command listener recording command durations.
+- `SlowRequestProfiler` : Samples stacks and keeps the profiles of slow requests.
+
+Constants
+---------
+- `registry` : The process-wide registry.
+"""
+
+import bisect
+import collections
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+from pymongo import monitoring
+
+logging.basicConfig(level=logging.INFO)
+
+# Request and phase durations, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Response sizes, in bytes
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+# Route label of requests that matched no route, so unknown paths add no label values
+UNMATCHED_ROUTE = "<unmatched>"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Metric:
+    """
+    A named metric holding one value per combination of label values.
+
+    Metrics are updated from the event loop, the scoring threads and the MongoDB
+    driver's threads, so every update is made under a lock.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # Label values -> value
+
+    def _check(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {label_values}")
+        return tuple(str(value) for value in label_values)
+
+    def value(self, *label_values):
+        """
+        Return the current value for some label values, or None if never set.
+        """
+        with self._lock:
+            return self._values.get(self._check(label_values))
+
+    def samples(self):
+        """
+        Yield `(name, labels, value)` for every label set, for rendering.
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            yield self.name, list(zip(self.labels, label_values)), value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        """
+        Add to the counter of some label values.
+        """
+        key = self._check(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        key = self._check(label_values)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *label_values, amount=1):
+        key = self._check(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    """
+    Observations counted into cumulative buckets, with their sum and count, per label set.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        """
+        Record one observation for some label values.
+        """
+        key = self._check(label_values)
+        # A value equal to a bucket's upper bound belongs to that bucket
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def value(self, *label_values):
+        """
+        Return the sum and count of the observations for some label values, or None.
+        """
+        with self._lock:
+            state = self._values.get(self._check(label_values))
+            return None if state is None else {"sum": state[1], "count": state[2]}
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for label_values, (counts, total, count) in sorted(values):
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + [("le", _format_value(float(bound)))], cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process, and the statistics exported alongside them when scraped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._stats = {}  # Prefix -> (documentation, function returning a dict)
+
+    def _register(self, metric_class, name, documentation, labels, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, documentation, labels, **options)
+            elif not isinstance(metric, metric_class) or metric.labels != tuple(labels):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Register a counter, or return the one already registered under that name.
+        """
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        """
+        Register a gauge, or return the one already registered under that name.
+        """
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Register a histogram, or return the one already registered under that name.
+        """
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def register_stats(self, prefix, stats, documentation):
+        """
+        Export a statistics dict when the registry is rendered.
+
+        Every numeric value of the dict becomes an untyped metric named after the prefix
+        and its key. Other values are skipped.
+
+        Parameters:
+        prefix (str): Prefix of the metric names.
+        stats (callable): Returns the statistics dict, called on every render.
+        documentation (str): Help text, followed by the key in each metric's help.
+        """
+        with self._lock:
+            self._stats[prefix] = (documentation, stats)
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+        str: The exposition, one sample per line.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+            stats = sorted(self._stats.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        for prefix, (documentation, function) in stats:
+            for key, value in function().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {documentation}: {key}")
+                lines.append(f"# TYPE {name} untyped")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    "bookslibrary_http_request_duration_seconds",
+    "Time from receiving an HTTP request to sending the end of its response",
+    labels=("method", "route", "status"),
+)
+RESPONSE_BYTES = registry.histogram(
+    "bookslibrary_http_response_size_bytes",
+    "Size of HTTP response bodies",
+    labels=("method", "route"),
+    buckets=SIZE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "bookslibrary_http_requests_in_flight",
+    "HTTP requests being served",
+)
+RECOMMENDER_PHASE_SECONDS = registry.histogram(
+    "bookslibrary_recommender_phase_seconds",
+    "Time spent in each recommender phase: load, encode, fit, queue and score",
+    labels=("phase",),
+)
+SLOW_REQUESTS = registry.counter(
+    "bookslibrary_http_slow_requests_total",
+    "HTTP requests slower than the profiler's threshold",
+    labels=("method", "route"),
+)
+MONGODB_COMMAND_SECONDS = registry.histogram(
+    "bookslibrary_mongodb_command_duration_seconds",
+    "Duration of MongoDB commands, as reported by the driver",
+    labels=("command", "outcome"),
+)
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of the process's threads while requests are in flight, and keeps
+    the samples taken during requests slower than a threshold.
+
+    Requests share the event loop, so a sample is attributed to every request in flight
+    when it is taken: a profile shows what the process was doing while the request ran,
+    including its scoring threads and the other requests it waited behind.
+    """
+
+    def __init__(self, threshold, interval=0.005, max_profiles=20, max_stacks=50):
+        """
+        Configure the profiler. The sampling thread starts with the first request.
+
+        Parameters:
+        threshold (float): Seconds after which a request's profile is kept.
+        interval (float): Seconds between samples.
+        max_profiles (int): Number of recent slow-request profiles kept.
+        max_stacks (int): Number of distinct stacks kept per profile, most sampled first.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._profiles = collections.deque(maxlen=max_profiles)
+        self._active = {}  # id() of each in-flight request's samples -> the samples
+        self._lock = threading.Lock()
+        self._busy = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start collecting samples for a request.
+
+        Returns:
+        collections.Counter: The request's samples, to pass to `stop`.
+        """
+        samples = collections.Counter()
+        with self._lock:
+            self._active[id(samples)] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+        self._busy.set()
+        return samples
+
+    def stop(self, samples, method, route, path, seconds):
+        """
+        Stop collecting samples for a request, and keep its profile if it was slow.
+
+        Parameters:
+        samples (collections.Counter): As returned by `start`.
+        method (str): The request method.
+        route (str): The route template the request matched.
+        path (str): The request path.
+        seconds (float): The request's duration.
+        """
+        with self._lock:
+            self._active.pop(id(samples), None)
+            if not self._active:
+                self._busy.clear()
+        if seconds < self.threshold:
+            return
+        SLOW_REQUESTS.inc(method, route)
+        logging.warning("Slow request: %s %s took %.0f ms", method, path, seconds * 1000)
+        self._profiles.append({
+            "method": method,
+            "path": path,
+            "seconds": seconds,
+            "finished_at": time.time(),
+            "samples": sum(samples.values()),
+            "stacks": [{"stack": stack, "samples": count} for stack, count in samples.most_common(self.max_stacks)],
+        })
+
+    def profiles(self):
+        """
+        Return the kept profiles, most recent last.
+
+        Returns:
+        list of dict: Each with the request's `method`, `path`, `seconds` and
+        `finished_at`, the number of `samples` taken while it ran and its most sampled
+        `stacks`, as collapsed stacks (thread name, then frames outermost first, separated
+        by ";").
+        """
+        return list(self._profiles)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [
+                self._collapse(names.get(thread_id, str(thread_id)), frame)
+                for thread_id, frame in sys._current_frames().items()
+                if thread_id != own
+            ]
+            with self._lock:
+                for samples in self._active.values():
+                    samples.update(stacks)
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join([thread_name, *reversed(frames)])
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware that records the duration, response size and status of every HTTP
+    request, and optionally profiles slow ones.
+
+    Requests are labeled with their route template, such as "/books/{id}", rather than
+    their path, so IDs do not multiply the label values. The route is known once the
+    request has been routed, so it is read from the scope after the response.
+    """
+
+    def __init__(self, app, profiler=None):
+        """
+        Parameters:
+        app (ASGI app): The application to wrap.
+        profiler (SlowRequestProfiler): Profiler to run for every request, or None.
+        """
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500  # Reported if the app fails before starting a response
+        size = 0
+
+        async def send_measured(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        samples = self.profiler.start() if self.profiler is not None else None
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_measured)
+        finally:
+            elapsed = time.perf_counter() - started
+            REQUESTS_IN_FLIGHT.dec()
+            method = scope["method"]
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            REQUEST_SECONDS.observe(elapsed, method, route, status)
+            RESPONSE_BYTES.observe(size, method, route)
+            if samples is not None:
+                self.profiler.stop(samples, method, route, scope["path"], elapsed)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Command listener that records the duration of every MongoDB command in
+    `MONGODB_COMMAND_SECONDS`, by command name and outcome.
+
+    The driver reports each command's duration with its completion event, so nothing is
+    kept between the events.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGODB_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "succeeded")
+
+    def failed(self, event):
+        MONGODB_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, "failed")
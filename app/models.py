@@ -0,0 +1,29 @@
+"""
+models.py
+=========
+
+This module defines the pydantic models for the documents stored by the Books Library
+Management System. They validate request bodies in `app.main` and records in bulk
+imports in `app.ingest`.
+
+Classes
+-------
+- `Book` : A book in the `books` collection.
+- `Review` : A review in the `reviews` collection.
+"""
+
+from pydantic import BaseModel
+
+
+class Book(BaseModel):
+    title: str
+    author: str
+    genre: str
+    year_published: int
+    summary: str
+
+
+class Review(BaseModel):
+    user_id: str
+    review_text: str
+    rating: float
@@ -0,0 +1,140 @@
+"""
+neighbors.py
+============
+
+This module provides the precomputed "similar books" lists behind
+`BookRecommender.recommend_books_by_title`.
+
+A book's recommendations depend only on its set of genres, so books are grouped by genre
+set and the top `k` neighbors are stored once per group: a row of neighbor IDs and their
+matched-genre counts. Looking a book up is a search for its ID followed by reading that
+row, whatever the size of the catalog.
+
+Neighbors are stored by book ID rather than by recommender row, so a table stays usable
+across retrains and compactions. It reflects the catalog as of the last refresh. Books
+removed since then are dropped at lookup, and books added since then have no entry, so
+the recommender scores them live.
+
+Classes
+-------
+- `NeighborTable` : Top-`k` neighbors of every book, grouped by genre set.
+
+Functions
+---------
+- `genre_groups` : Group the rows of a genre matrix by genre set.
+"""
+
+import numpy as np
+
+
+def genre_groups(features):
+    """
+    Group the rows of a genre matrix by their set of genres.
+
+    Parameters:
+    features (sparse.csr_matrix): The binary genre matrix, one row per book, with sorted
+        column indices.
+
+    Returns:
+    tuple: The group of each row as an int32 array, and the genre IDs of each group in
+    group order.
+    """
+    indptr, indices = features.indptr.tolist(), features.indices
+    groups = {}
+    members = np.fromiter(
+        (groups.setdefault(indices[start:end].tobytes(), len(groups)) for start, end in zip(indptr[:-1], indptr[1:])),
+        dtype=np.int32,
+        count=len(indptr) - 1,
+    )
+    return members, [np.frombuffer(key, dtype=indices.dtype).tolist() for key in groups]
+
+
+class NeighborTable:
+    """
+    Top-`k` neighbors of every book, grouped by genre set.
+
+    `ids` holds each book once and `groups` maps it to its group, and row `g` of `neighbors` and
+    `scores` holds group `g`'s neighbors, best first, as indexes into `ids` with their
+    matched-genre counts. Groups with fewer than `k` neighbors are padded with -1.
+    """
+
+    def __init__(self, ids, groups, neighbors, scores, min_rating, id_order=None, model_version=None):
+        """
+        Wrap the arrays.
+
+        Parameters:
+        ids (np.ndarray): Book IDs as fixed-width bytes.
+        groups (np.ndarray): Group of each book, as int32.
+        neighbors (np.ndarray): Neighbor positions in `ids`, one row of `k` per group.
+        scores (np.ndarray): Matched-genre count of each neighbor.
+        min_rating (float): The minimum average rating the neighbors were selected with.
+        id_order (np.ndarray): Positions in ID order, computed when not given.
+        model_version (int): The recommender's `model_version` when the table was computed.
+        """
+        self.ids = ids
+        self.groups = groups
+        self.neighbors = neighbors
+        self.scores = scores
+        self.min_rating = float(min_rating)
+        # Kept as intp: `searchsorted` copies a sorter of any other dtype on every call
+        self.id_order = np.argsort(ids, kind="stable") if id_order is None else np.asarray(id_order, dtype=np.intp)
+        self.model_version = model_version
+
+    @classmethod
+    def from_arrays(cls, arrays, meta, model_version=None):
+        """
+        Rebuild a table persisted with `arrays` and `meta`.
+        """
+        return cls(
+            arrays["ids"], arrays["groups"], arrays["neighbors"], arrays["scores"], meta["min_rating"],
+            arrays["id_order"], model_version,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.groups.nbytes + self.neighbors.nbytes + self.scores.nbytes + self.id_order.nbytes
+
+    def arrays(self):
+        """
+        Return the arrays to persist, by name.
+        """
+        return {
+            "ids": self.ids,
+            "groups": self.groups,
+            "neighbors": self.neighbors,
+            "scores": self.scores,
+            "id_order": self.id_order,
+        }
+
+    def meta(self):
+        """
+        Return the metadata to persist alongside `arrays`.
+        """
+        return {"min_rating": self.min_rating, "k": self.k, "books": len(self), "genre_sets": len(self.neighbors)}
+
+    def lookup(self, book_id):
+        """
+        Return a book's neighbors.
+
+        Parameters:
+        book_id (str or bytes): The book's ID.
+
+        Returns:
+        tuple or None: The neighbors' IDs as bytes and their matched-genre counts, best
+        first, or None if the book was not in the catalog when the table was computed.
+        """
+        key = book_id if isinstance(book_id, bytes) else str(book_id).encode()
+        position = np.searchsorted(self.ids, key, sorter=self.id_order)
+        if position >= len(self.id_order) or self.ids[self.id_order[position]] != key:
+            return None
+        group = self.groups[self.id_order[position]]
+        neighbors = self.neighbors[group]
+        found = neighbors >= 0
+        return self.ids[neighbors[found]], self.scores[group][found]
@@ -0,0 +1,285 @@
+"""
+pipelines.py
+============
+
+This module maintains the `merged_review` collection read by the recommender.
+
+Each `merged_review` document is a book from `books` joined with its rating statistics
+from `reviews`: `review_count`, `rating_sum`, `average_rating` and `rating_histogram`, the
+number of reviews per star rating. The join runs on the MongoDB server as an aggregation
+pipeline that ends in `$merge`, so no book or review is shipped to the application to
+compute it. Writes keep the collection current at O(changed books) cost:
+
+- Book inserts and updates re-run the pipeline for that one book.
+- Review inserts update the book's statistics with a single atomic pipeline update.
+- Book deletes remove the book's document.
+
+A book loaded with an `average_rating` but no counters (such as one uploaded from the
+CSV) counts that average as a single rating. Whichever of the two writes reaches it
+first keeps the average in `legacy_rating`, and both add it to the book's reviews, so a
+refresh and a sequence of reviews agree on the statistics.
+
+The correlated `$lookup` needs MongoDB 5.0 or later.
+
+Functions
+---------
+- `rating_bucket` : The histogram bucket of a rating.
+- `rating_stats` : Read a `merged_review` document's rating statistics.
+- `merged_review_pipeline` : Build the aggregation pipeline.
+- `refresh_merged_review` : Materialize some or all books into `merged_review`.
+- `record_review` : Fold one review into a book's rating statistics.
+- `remove_merged_review` : Remove a deleted book.
+
+Usage
+-----
+Rebuild the whole collection from `books` and `reviews`:
+
+    python -m app.pipelines
+"""
+
+import asyncio
+import logging
+import math
+
+from .database import books_collection, ensure_indexes, merged_review_collection, reviews_collection
+
+logging.basicConfig(level=logging.INFO)
+
+# Characters stripped from each comma-separated genre, so that both "Fantasy, Adventure"
+# and the stringified list form "['Fantasy', 'Adventure']" split into clean names.
+GENRE_TRIM_CHARS = " []'\""
+
+# `rating_histogram[i]` counts the reviews rated from i + 1 up to, but not including,
+# i + 2 stars. Ratings below 1 count as 1 star and ratings of 5 or more as 5 stars.
+RATING_BUCKETS = 5
+RATING_BUCKET_EXPRESSION = {"$subtract": [{"$min": [{"$max": [{"$floor": "$rating"}, 1]}, RATING_BUCKETS]}, 1]}
+
+# The stored document's legacy average: the kept `legacy_rating`, or the `average_rating`
+# of a document without counters. NaN is the only number below -inf.
+LEGACY_RATING_EXPRESSION = {
+    "$ifNull": [
+        "$legacy_rating",
+        {
+            "$cond": [
+                {
+                    "$and": [
+                        {"$eq": [{"$ifNull": ["$review_count", None]}, None]},
+                        {"$isNumber": "$average_rating"},
+                        {"$gte": ["$average_rating", float("-inf")]},
+                    ]
+                },
+                "$average_rating",
+                None,
+            ]
+        },
+    ]
+}
+LEGACY_COUNT_EXPRESSION = {"$cond": [{"$isNumber": "$legacy_rating"}, 1, 0]}
+AVERAGE_RATING_STAGE = {
+    "$set": {
+        "average_rating": {"$cond": [{"$gt": ["$review_count", 0]}, {"$divide": ["$rating_sum", "$review_count"]}, None]}
+    }
+}
+
+
+def rating_bucket(rating):
+    """
+    Find the `rating_histogram` bucket a rating is counted in.
+
+    Parameters:
+    rating (float): The review rating.
+
+    Returns:
+    int: The bucket, from 0 for 1 star to `RATING_BUCKETS - 1`.
+    """
+    if not rating >= 2:
+        return 0
+    return math.floor(min(rating, RATING_BUCKETS)) - 1
+
+
+def rating_stats(document):
+    """
+    Read the rating statistics of a `merged_review` document.
+
+    Like the writes, a document that has an `average_rating` but no counters (such as
+    one uploaded from the CSV) counts that average as a single rating. The histogram
+    only counts reviews, so it then sums to less than `review_count`.
+
+    Parameters:
+    document (dict): The `merged_review` document.
+
+    Returns:
+    dict: The `review_count`, `rating_sum`, `average_rating` and `rating_histogram`.
+    """
+    average_rating = document.get("average_rating")
+    if not isinstance(average_rating, (int, float)) or math.isnan(average_rating):
+        average_rating = None
+    review_count = document.get("review_count")
+    if review_count is None:
+        review_count = 0 if average_rating is None else 1
+    rating_sum = document.get("rating_sum")
+    if rating_sum is None:
+        rating_sum = average_rating or 0
+    histogram = list(document.get("rating_histogram") or [])
+    histogram = histogram[:RATING_BUCKETS] + [0] * (RATING_BUCKETS - len(histogram))
+    return {
+        "review_count": review_count,
+        "rating_sum": rating_sum,
+        "average_rating": average_rating,
+        "rating_histogram": histogram,
+    }
+
+
+def merged_review_pipeline(book_ids=None):
+    """
+    Build the aggregation pipeline that materializes books into `merged_review`.
+
+    Parameters:
+    book_ids (list of ObjectId): Restrict the pipeline to these books, or None for all.
+
+    Returns:
+    list of dict: The pipeline stages, to run against `books`.
+    """
+    pipeline = []
+    if book_ids is not None:
+        pipeline.append({"$match": {"_id": {"$in": list(book_ids)}}})
+    pipeline += [
+        {
+            "$lookup": {
+                "from": reviews_collection.name,
+                "localField": "_id",
+                "foreignField": "book_id",
+                "pipeline": [
+                    {
+                        "$group": {
+                            "_id": None,
+                            "review_count": {"$sum": 1},
+                            "rating_sum": {"$sum": "$rating"},
+                            **{
+                                f"bucket_{bucket}": {"$sum": {"$cond": [{"$eq": [RATING_BUCKET_EXPRESSION, bucket]}, 1, 0]}}
+                                for bucket in range(RATING_BUCKETS)
+                            },
+                        }
+                    },
+                ],
+                "as": "stats",
+            }
+        },
+        {"$set": {"stats": {"$first": "$stats"}}},
+        {
+            "$project": {
+                "title": 1,
+                "title_key": {"$toLower": "$title"},
+                "author": 1,
+                "year_published": 1,
+                "genre": {
+                    "$cond": [
+                        {"$isArray": "$genre"},
+                        "$genre",
+                        {
+                            "$filter": {
+                                "input": {
+                                    "$map": {
+                                        "input": {"$split": [{"$ifNull": ["$genre", ""]}, ","]},
+                                        "as": "genre",
+                                        "in": {"$trim": {"input": "$$genre", "chars": GENRE_TRIM_CHARS}},
+                                    }
+                                },
+                                "as": "genre",
+                                "cond": {"$ne": ["$$genre", ""]},
+                            }
+                        },
+                    ]
+                },
+                "review_count": {"$ifNull": ["$stats.review_count", 0]},
+                "rating_sum": {"$ifNull": ["$stats.rating_sum", 0]},
+                "rating_histogram": [{"$ifNull": [f"$stats.bucket_{bucket}", 0]} for bucket in range(RATING_BUCKETS)],
+                "updated_at": "$$NOW",
+            }
+        },
+        AVERAGE_RATING_STAGE,
+        {
+            "$merge": {
+                "into": merged_review_collection.name,
+                "on": "_id",
+                # Replace the stored document, adding its legacy average to the reviews
+                "whenMatched": [
+                    {"$set": {"legacy_rating": LEGACY_RATING_EXPRESSION}},
+                    {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$$new", {"legacy_rating": "$legacy_rating"}]}}},
+                    {
+                        "$set": {
+                            "review_count": {"$add": ["$review_count", LEGACY_COUNT_EXPRESSION]},
+                            "rating_sum": {"$add": ["$rating_sum", {"$ifNull": ["$legacy_rating", 0]}]},
+                        }
+                    },
+                    AVERAGE_RATING_STAGE,
+                ],
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+    return pipeline
+
+
+async def refresh_merged_review(book_ids=None):
+    """
+    Materialize books and their rating statistics into `merged_review`.
+
+    Parameters:
+    book_ids (list of ObjectId): The books to refresh, or None to rebuild every book.
+    """
+    await books_collection.aggregate(merged_review_pipeline(book_ids)).to_list(length=None)
+
+
+async def record_review(book_id, rating):
+    """
+    Fold a new review into a book's rating statistics.
+
+    The counters, the histogram and the derived average are updated in one pipeline-style
+    update, so concurrent reviews of the same book cannot interleave between them. A
+    legacy average counts as a single rating, as in `merged_review_pipeline` and the
+    recommender.
+
+    Parameters:
+    book_id (ObjectId): The reviewed book's ID.
+    rating (float): The review rating.
+    """
+    bucket = rating_bucket(rating)
+    await merged_review_collection.update_one(
+        {"_id": book_id},
+        [
+            {"$set": {"legacy_rating": LEGACY_RATING_EXPRESSION}},
+            {
+                "$set": {
+                    "review_count": {"$add": [{"$ifNull": ["$review_count", LEGACY_COUNT_EXPRESSION]}, 1]},
+                    "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", {"$ifNull": ["$legacy_rating", 0]}]}, rating]},
+                    "rating_histogram": [
+                        {"$add": [{"$ifNull": [{"$arrayElemAt": ["$rating_histogram", index]}, 0]}, int(index == bucket)]}
+                        for index in range(RATING_BUCKETS)
+                    ],
+                    "updated_at": "$$NOW",
+                }
+            },
+            {"$set": {"average_rating": {"$divide": ["$rating_sum", "$review_count"]}}},
+        ],
+    )
+
+
+async def remove_merged_review(book_id):
+    """
+    Remove a deleted book from `merged_review`.
+
+    Parameters:
+    book_id (ObjectId): The deleted book's ID.
+    """
+    await merged_review_collection.delete_one({"_id": book_id})
+
+
+async def rebuild():
+    await ensure_indexes()
+    await refresh_merged_review()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
+    logging.info("merged_review rebuilt from books and reviews")
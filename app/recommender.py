@@ -2,22 +2,38 @@
 recommender.py
 ==============
 
-This module provides the `BookRecommender` class, which implements a K-Nearest Neighbors (KNN)
-algorithm for recommending books based on genres and average ratings.
+This module provides the `BookRecommender` class, which recommends books based on
+genres and average ratings.
 
-The recommender system fetches data from a MongoDB collection and preprocesses it to
-train the KNN model. Recommendations can be generated based on:
+The recommender system fetches the fields it needs from a MongoDB collection into a compact
+columnar `Catalog`, interns each book's genres into integer IDs and stores them as a sparse
+binary matrix. Candidates are counted by matched genres, from genre posting lists or with a
+sparse matrix product, and ranked by matched genres, average rating and cosine similarity to the query, which
+is the order a brute-force cosine KNN search followed by re-ranking would produce.
+Recommendations can be generated based on:
 - Specific genres with a minimum rating threshold.
 - A reference book's title.
 
+Scoring runs in a bounded thread pool and training in a worker process, so the event
+loop keeps serving requests while either is in progress. Title recommendations are read
+from precomputed neighbor lists (`app.neighbors`) when they are enabled, refreshed in
+the background across a process pool. A retrained model is built
+aside and swapped in atomically. Writes made by other workers are applied through
+`apply_changes`, fed by `app.sync`. The load, encode, fit, queue and score phases are timed
+into `app.metrics`.
+
+Candidates are generated by a pluggable index from `app.indexes`: a genre inverted index
+(the default), so only books sharing a requested genre are scored, brute force, or
+approximate LSH.
+
 Classes
 -------
 - `BookRecommender` : Encapsulates the recommendation logic.
+- `RecommenderBusy` : Raised when the scoring queue is full.
 
 Dependencies
 ------------
-- `sklearn.neighbors` : For the KNN model.
-- `sklearn.preprocessing` : For encoding genres.
+- `scipy.sparse` : For the binarized genre matrix.
 - `pandas` : For data manipulation.
 - `motor` : For asynchronous MongoDB interaction.
 
@@ -32,64 +48,1268 @@ Example:
 
 import logging
 import asyncio
+import contextlib
+import os
+import time
+from collections import namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import MultiLabelBinarizer
-from sklearn.neighbors import NearestNeighbors
-from .database import merged_review_collection 
+from bson import ObjectId
+from scipy import sparse
+from .cache import LRUCache
+from .catalog import CATALOG_PROJECTION, Catalog, StringColumn
+from .database import merged_review_collection
+from .genres import GenreVocabulary, parse_genres
+from .indexes import BruteForceIndex, InvertedIndex, index_factory
+from .metrics import RECOMMENDER_PHASE_SECONDS
+from .neighbors import NeighborTable, genre_groups
+from .snapshot import build_lock, read_snapshot, write_snapshot
 
 logging.basicConfig(level=logging.INFO)
 
+# Genre sets scored per neighbor job
+NEIGHBOR_CHUNK_SIZE = 1024
+# Subdirectory of the snapshot directory the neighbor lists are persisted in
+NEIGHBORS_DIR = 'neighbors'
+
+class TitleIndex:
+    """
+    In-memory index over book titles, aligned with the rows of the recommender's catalog.
+
+    Lookups are resolved in order of precision: exact title, case-insensitive title,
+    case-insensitive prefix and finally case-insensitive substring. The folded titles
+    live in a single newline-joined buffer with an array of offsets, and a second array
+    holds the rows in folded-title order, so the index keeps no Python object per title.
+    Exact and prefix matches are found by binary search over that order, and substring
+    matching runs at `str.find` speed over the buffer. Rows added after construction are
+    kept in a short tail until the index is rebuilt.
+    """
+
+    def __init__(self, titles, order=None):
+        """
+        Build the index.
+
+        Parameters:
+        titles (sequence of str): Book titles, in row order, such as a `StringColumn`.
+        order (array-like of int): Rows in case-folded title order, as returned by
+            `sorted_rows`. Computed when not given.
+        """
+        self._titles = titles
+        self._removed = set()
+        self._tail = {}  # Row -> (title, folded title) for rows added after construction
+        folded_titles = [
+            (title if isinstance(title, str) else "").casefold().replace("\n", " ") for title in titles
+        ]
+        self._offsets = np.zeros(len(folded_titles) + 1, dtype=np.int64)
+        np.cumsum([len(folded) + 1 for folded in folded_titles], out=self._offsets[1:])
+        self._buffer = "\n".join(folded_titles)
+        if order is None:
+            order = sorted(range(len(folded_titles)), key=folded_titles.__getitem__)
+        self._order = np.asarray(order, dtype=np.int32)
+
+    def __len__(self):
+        indexed = len(self._order)
+        removed = sum(1 for row in self._removed if row < indexed)
+        return indexed - removed + sum(1 for row in self._tail if row >= indexed)
+
+    def sorted_rows(self):
+        """
+        Return every row present at construction in case-folded title order, for
+        persisting the index.
+
+        Returns:
+        np.ndarray: Row positions.
+        """
+        return self._order
+
+    def add(self, title, row):
+        """
+        Index a row appended or retitled after construction.
+
+        Parameters:
+        title (str): The book title.
+        row (int): Row position of the book.
+        """
+        title = "" if not isinstance(title, str) else title
+        self._tail[row] = (title, title.casefold())
+        self._removed.discard(row)
+
+    def discard(self, row):
+        """
+        Exclude a row from future lookups.
+
+        Parameters:
+        row (int): Row position of the removed book.
+        """
+        self._removed.add(row)
+        self._tail.pop(row, None)
+
+    def _folded(self, row):
+        return self._buffer[self._offsets[row]:self._offsets[row + 1] - 1]
+
+    def _indexed(self, row):
+        # Retitled rows are looked up through the tail only
+        return row not in self._removed and row not in self._tail
+
+    def _prefix_start(self, folded):
+        low, high = 0, len(self._order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._folded(self._order[middle]) < folded:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, query):
+        """
+        Resolve a title query to a row position.
+
+        Parameters:
+        query (str): Full or partial book title.
+
+        Returns:
+        int or None: Row position of the best match, or None if nothing matches.
+        """
+        if not query:
+            return None
+        folded = query.casefold()
+        start = self._prefix_start(folded)
+        equal = []
+        position = start
+        while position < len(self._order) and self._folded(self._order[position]) == folded:
+            equal.append(int(self._order[position]))
+            position += 1
+        tail = sorted(self._tail.items())
+
+        for row in equal:
+            if self._titles[row] == query and self._indexed(row):
+                return row
+        for row, (title, _) in tail:
+            if title == query:
+                return row
+        for row in equal:
+            if self._indexed(row):
+                return row
+        for row, (_, title) in tail:
+            if title == folded:
+                return row
+
+        matches = [(title, row) for row, (_, title) in tail if title.startswith(folded)]
+        position = start
+        while position < len(self._order) and self._folded(self._order[position]).startswith(folded):
+            row = int(self._order[position])
+            if self._indexed(row):
+                matches.append((self._folded(row), row))
+                break
+            position += 1
+        if matches:
+            return min(matches)[1]
+
+        if "\n" not in folded:
+            position = self._buffer.find(folded)
+            while position >= 0:
+                row = int(np.searchsorted(self._offsets, position, side='right')) - 1
+                if self._indexed(row):
+                    return row
+                position = self._buffer.find(folded, self._offsets[row + 1])
+
+        for row, (_, title) in tail:
+            if folded in title:
+                return row
+        return None
+
+
+def select_top(keys, k):
+    """
+    Select the `k` best positions under a lexicographic ordering without sorting everything.
+
+    Each key is an array over the same positions where smaller values rank first, the first
+    key being the most significant; remaining ties go to the lowest position. Every key is
+    narrowed with `np.partition`, so the cost is linear in the number of positions plus a
+    sort of the `k` selected ones.
+
+    Parameters:
+    keys (list of np.ndarray): Sort keys, most significant first.
+    k (int): Number of positions to select.
+
+    Returns:
+    np.ndarray: The selected positions, best first.
+    """
+    remaining = np.arange(len(keys[0]))
+    if k <= 0:
+        return remaining[:0]
+    selected = []
+    for key in keys:
+        if len(remaining) <= k:
+            break
+        values = key[remaining]
+        kth = np.partition(values, k - 1)[k - 1]
+        better = remaining[values < kth]
+        selected.append(better)
+        k -= len(better)
+        remaining = remaining[values == kth]
+    selected.append(remaining[:k])
+    chosen = np.concatenate(selected)
+    order = np.lexsort([chosen] + [key[chosen] for key in reversed(keys)])
+    return chosen[order]
+
+
+class RecommenderBusy(Exception):
+    """
+    Raised when a recommendation request arrives while the scoring queue is full.
+    """
+
+
+# A fitted model as produced by `build_model` and `compact_model`, with the seconds spent
+# in each phase of building it
+ModelState = namedtuple('ModelState', ['vocabulary', 'catalog', 'features', 'title_index', 'index', 'timings'],
+                        defaults=(None,))
+
+# The arrays a scoring job reads, captured on the event loop when the job is queued
+ModelView = namedtuple('ModelView', ['index', 'ratings', 'genre_counts', 'alive', 'titles'])
+
+
+def _genre_matrix(genre_ids, num_genres):
+    """
+    Build the binary genre matrix from per-book genre ID lists.
+
+    Parameters:
+    genre_ids (list of list of int): Genre IDs for each book.
+    num_genres (int): Size of the genre vocabulary.
+
+    Returns:
+    sparse.csr_matrix: One row per book, one column per genre.
+    """
+    indptr = np.cumsum([0] + [len(ids) for ids in genre_ids])
+    indices = np.fromiter((genre_id for ids in genre_ids for genre_id in ids), dtype=np.int32, count=indptr[-1])
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(genre_ids), num_genres))
+
+
+def build_model(books, index_class=InvertedIndex):
+    """
+    Intern the loaded books' genres and build the catalog, the genre matrix, the title
+    index and the candidate index.
+
+    This is the CPU-bound part of training. It only takes and returns picklable data, so
+    it can run in a worker process.
+
+    Parameters:
+    books (dict or pd.DataFrame): The `merged_review` fields, column by column, as
+        returned by `BookRecommender.load_data`.
+    index_class (type): The `CandidateIndex` to build over the genre matrix.
+
+    Returns:
+    ModelState: The fitted model, timed in its `encode` and `fit` phases.
+    """
+    started = time.perf_counter()
+    vocabulary = GenreVocabulary()
+    genre_column = books.get('genre')
+    genre_ids = [vocabulary.encode(parse_genres(genres)) for genres in (() if genre_column is None else genre_column)]
+
+    # Filter out books with empty genres
+    has_genres = np.array([len(ids) > 0 for ids in genre_ids], dtype=bool)
+    catalog = Catalog.from_columns(books, has_genres)
+    features = _genre_matrix([ids for ids in genre_ids if ids], len(vocabulary))
+    encoded = time.perf_counter()
+    index = index_class(features, catalog.ratings)
+    title_index = TitleIndex(catalog.titles)
+    timings = {'encode': encoded - started, 'fit': time.perf_counter() - encoded}
+    return ModelState(vocabulary, catalog, features, title_index, index, timings)
+
+
+def compact_model(vocabulary, catalog, features, alive, index_class=InvertedIndex):
+    """
+    Drop tombstoned rows from a model.
+
+    Genre IDs are stable, so the surviving rows of the genre matrix are kept as they are.
+
+    Parameters:
+    vocabulary (GenreVocabulary): The model's genre vocabulary.
+    catalog (Catalog): The model's books.
+    features (sparse.csr_matrix): The genre matrix, aligned with `catalog`.
+    alive (np.ndarray): Boolean mask of the rows to keep.
+    index_class (type): The `CandidateIndex` to rebuild over the compacted genre matrix.
+
+    Returns:
+    ModelState: The compacted model, timed in its `fit` phase.
+    """
+    catalog = catalog.select(alive)
+    features = features[alive]
+    started = time.perf_counter()
+    index = index_class(features, catalog.ratings)
+    title_index = TitleIndex(catalog.titles)
+    return ModelState(vocabulary, catalog, features, title_index, index, {'fit': time.perf_counter() - started})
+
+
+def top_candidates(view, rows, matched, min_rating, num_recommendations):
+    """
+    Filter candidate books and select the best ones.
+
+    Parameters:
+    view (ModelView): The model arrays to rank against.
+    rows (np.ndarray): Candidate row positions, in ascending order.
+    matched (np.ndarray): Matched-genre count for each candidate.
+    min_rating (float): Minimum average rating for the recommendations.
+    num_recommendations (int): Number of books to select.
+
+    Returns:
+    tuple: The selected rows, their matched-genre counts and their ratings, best first.
+    """
+    # Ratings are float32, so the threshold is too: a book rated 4.1 passes a 4.1 minimum
+    keep = view.alive[rows] & (view.ratings[rows] >= np.float32(min_rating)) & (matched > 0)
+    candidates = rows[keep]
+    matched = matched[keep].astype(np.int64)
+    ratings = view.ratings[candidates]
+    top = select_top([-matched, -ratings, view.genre_counts[candidates]], num_recommendations)
+    return candidates[top], matched[top], ratings[top]
+
+
+def recommendation_frame(titles, rows, ratings, matched):
+    """
+    Build the recommendations DataFrame for selected rows.
+
+    Parameters:
+    titles (StringColumn): The catalog's titles.
+    rows (np.ndarray): The selected rows, best first.
+    ratings (np.ndarray): Their float32 average ratings.
+    matched (np.ndarray): Their matched-genre counts.
+
+    Returns:
+    pd.DataFrame: The recommended books, indexed by row.
+    """
+    return pd.DataFrame(
+        {
+            'title': titles.take(rows),
+            # The shortest decimal form of each float32 rating, e.g. 4.7 rather than 4.699999809
+            'average_rating': np.asarray(ratings, dtype=np.float32).astype(str).astype(np.float64),
+            'matched_genres': np.asarray(matched, dtype=np.int64),
+        },
+        index=rows,
+    )
+
+
+def rank(view, rows, matched, min_rating, num_recommendations):
+    """
+    Filter and rank candidate books.
+
+    Parameters:
+    view (ModelView): The model arrays to rank against.
+    rows (np.ndarray): Candidate row positions, in ascending order.
+    matched (np.ndarray): Matched-genre count for each candidate.
+    min_rating (float): Minimum average rating for the recommendations.
+    num_recommendations (int): Number of recommendations to return.
+
+    Returns:
+    pd.DataFrame: DataFrame containing the recommended books.
+    """
+    rows, matched, ratings = top_candidates(view, rows, matched, min_rating, num_recommendations)
+    return recommendation_frame(view.titles, rows, ratings, matched)
+
+
+def top_neighbors(view, query_columns, min_rating, k):
+    """
+    Select the top `k` recommendations of many genre sets, as arrays.
+
+    Parameters:
+    view (ModelView): The model arrays to score against.
+    query_columns (list of list of int): Genre IDs of each genre set.
+    min_rating (float): Minimum average rating for the neighbors.
+    k (int): Number of neighbors per genre set.
+
+    Returns:
+    tuple: The neighbors' rows, one row of `k` per genre set padded with -1, and their
+    matched-genre counts.
+    """
+    neighbors = np.full((len(query_columns), k), -1, dtype=np.int32)
+    scores = np.zeros((len(query_columns), k), dtype=np.int16)
+    found = view.index.candidates_many(query_columns, [min_rating] * len(query_columns))
+    for position, (rows, matched) in enumerate(found):
+        rows, matched, _ = top_candidates(view, rows, matched, min_rating, k)
+        neighbors[position, :len(rows)] = rows
+        scores[position, :len(rows)] = matched
+    return neighbors, scores
+
+
+# The view a neighbor worker process scores against, sent once when the process starts
+_neighbor_view = None
+
+
+def _set_neighbor_view(view):
+    global _neighbor_view
+    _neighbor_view = view
+
+
+def _top_neighbors_in_worker(query_columns, min_rating, k):
+    return top_neighbors(_neighbor_view, query_columns, min_rating, k)
+
+
+def score(view, genre_ids, min_rating, num_recommendations):
+    """
+    Score the books sharing genres with a query and rank the matches.
+
+    Parameters:
+    view (ModelView): The model arrays to score against.
+    genre_ids (list of int): The query's genre IDs.
+    min_rating (float): Minimum average rating for the recommendations.
+    num_recommendations (int): Number of recommendations to return.
+
+    Returns:
+    pd.DataFrame: DataFrame containing the recommended books.
+    """
+    rows, matched = view.index.candidates(genre_ids, min_rating)
+    return rank(view, rows, matched, min_rating, num_recommendations)
+
+
+def score_many(view, query_columns, queries):
+    """
+    Score many genre ID sets and rank each query's matches.
+
+    Parameters:
+    view (ModelView): The model arrays to score against.
+    query_columns (list of list of int): Genre IDs for each query.
+    queries (list of dict): The queries, for their `min_rating` and `num_recommendations`.
+
+    Returns:
+    list of pd.DataFrame: The recommended books for each query, in order.
+    """
+    min_ratings = [query.get('min_rating', 4.0) for query in queries]
+    return [
+        rank(view, rows, matched, min_rating, query.get('num_recommendations', 5))
+        for (rows, matched), min_rating, query in zip(view.index.candidates_many(query_columns, min_ratings), min_ratings, queries)
+    ]
+
+
+def recall_at_k(view, query_columns, k=10, min_rating=0.0):
+    """
+    Measure how many of the exact top `k` recommendations the view's index returns.
+
+    Parameters:
+    view (ModelView): The model arrays, with the index to evaluate.
+    query_columns (list of list of int): Genre IDs for each query.
+    k (int): Number of recommendations per query.
+    min_rating (float): Minimum average rating for the recommendations.
+
+    Returns:
+    float: The mean recall@k over the queries with at least one exact result, or 1.0 if
+    there are none.
+    """
+    exact_view = view._replace(index=BruteForceIndex(view.index.features))
+    recalls = []
+    for genre_ids in query_columns:
+        expected = score(exact_view, genre_ids, min_rating, k).index
+        if len(expected):
+            found = score(view, genre_ids, min_rating, k).index
+            recalls.append(len(expected.intersection(found)) / len(expected))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
 class BookRecommender:
-    def __init__(self):
+    def __init__(self, compact_threshold=1000, snapshot_dir=None, scoring_threads=4, max_queued=64,
+                 training_executor='process', result_cache_size=1024, index='inverted', neighbors=0,
+                 neighbor_min_rating=4.0, neighbor_refresh_seconds=None, neighbor_workers=None):
         """
         Initialize the BookRecommender.
+
+        Parameters:
+        compact_threshold (int): Number of incremental changes after which tombstoned rows
+            are compacted away in the background.
+        snapshot_dir (str): Directory for persisted model snapshots, or None to always
+            train from MongoDB.
+        scoring_threads (int): Number of recommendation requests scored at the same time.
+        max_queued (int): Number of requests that may wait for a scoring thread before new
+            ones are rejected with `RecommenderBusy`, or None for no limit.
+        training_executor (str): Where training runs: 'process' for a worker process, or
+            'thread' for a thread of this process.
+        result_cache_size (int): Number of recommendation results memoized per model version.
+        index (str or type): The candidate index: 'inverted' (the default), 'brute' or
+            'lsh', or a `CandidateIndex` subclass.
+        neighbors (int): Number of recommendations precomputed per book for title queries,
+            or 0 to score every title query.
+        neighbor_min_rating (float): The minimum rating the neighbors are selected with.
+            Title queries with another minimum are scored.
+        neighbor_refresh_seconds (float): How often the neighbor lists are recomputed if
+            the model changed, or None to compute them once.
+        neighbor_workers (int): Processes the neighbor lists are computed across, by
+            default one per CPU. With the 'thread' training executor, they are computed in
+            the event loop's thread pool instead.
         """
-        self.mlb = MultiLabelBinarizer()
-        self.knn = NearestNeighbors(n_neighbors=10, metric='cosine')
-        self.features = None
-        self.df = None  # Initialize df as None initially
+        if training_executor not in ('process', 'thread'):
+            raise ValueError(f"Unknown training executor '{training_executor}'")
+        self.vocabulary = GenreVocabulary()
+        self.features = None  # Binarized genre matrix, one row per book
+        self.ratings = None
+        self.genre_counts = None
+        self.catalog = None  # Columnar store of the books, aligned with the genre matrix
+        self.title_index = None
+        self.index = None  # Candidate index over the genre matrix
+        self.index_class = index_factory(index) if isinstance(index, str) else index
+        self.compact_threshold = compact_threshold
+        self.snapshot_dir = snapshot_dir
+        self.scoring_threads = scoring_threads
+        self.max_queued = max_queued
+        self.training_executor = training_executor
+        self.neighbors = neighbors
+        self.neighbor_min_rating = float(neighbor_min_rating)
+        self.neighbor_refresh_seconds = neighbor_refresh_seconds
+        self.neighbor_workers = neighbor_workers
+        self.neighbor_table = None  # Precomputed title recommendations, as of their last refresh
+        self._neighbor_task = None
+        self._row_ids = {}  # Rows of books moved or removed since the catalog was built, None if removed
+        self._alive = None
+        self._appended = []
+        self._pending_changes = 0
+        self._compaction_task = None
+        self.model_version = 0  # Bumped by every retrain and every incremental change
+        self._reloaded_version = 0  # The model_version of the last model reloaded from data
+        self._genre_versions = {}  # Genre ID -> model_version of the last write to a book with it
+        self._results = LRUCache(max_entries=result_cache_size, ttl=float('inf'))
+        self._inflight = {}
+        self._journal = None  # Writes made while a rebuild is running, with the books they touched
+        self._rebuild_lock = None
+        self._scoring_slots = None
+        self._scoring_pool = None
+        self._training_pool = None
+        self._stats = {
+            'queued': 0,
+            'running': 0,
+            'completed': 0,
+            'rejected': 0,
+            'wait_seconds': 0.0,
+            'scoring_seconds': 0.0,
+            'trainings': 0,
+            'training_seconds': 0.0,
+            'compactions': 0,
+            'result_hits': 0,
+            'result_misses': 0,
+            'result_coalesced': 0,
+            'neighbor_hits': 0,
+            'neighbor_misses': 0,
+            'neighbor_refreshes': 0,
+            'neighbor_refresh_seconds': 0.0,
+            'synced_changes': 0,
+        }
 
     async def load_data(self):
         """
-        Load the dataset from MongoDB asynchronously.
-        
+        Load the fields the recommender needs from MongoDB asynchronously.
+
+        Only the fields in `CATALOG_PROJECTION` are fetched, and the documents are
+        streamed into per-field lists, so the full documents are never held at once.
+
         Returns:
-        pd.DataFrame: DataFrame containing the book data.
+        dict: A list of values per projected field, in document order.
         """
-        cursor = merged_review_collection.find({})
-        books_data = await cursor.to_list(length=None)
-        df = pd.DataFrame(books_data)
-        return df
+        columns = {field: [] for field in CATALOG_PROJECTION}
+        async for book in merged_review_collection.find({}, CATALOG_PROJECTION):
+            for field, values in columns.items():
+                values.append(book.get(field))
+        return columns
 
     async def prepare_data(self):
         """
-        Preprocess the data and train the KNN model asynchronously.
+        Load the data and build the model off the event loop, then swap it in.
+
+        The genre matrix and title index are built by `build_model` in the training
+        executor. Book and rating writes that arrive meanwhile are applied to the current
+        model, so requests keep being served. The data may have been read before or after
+        any of them, so they are not replayed onto the new model: the `merged_review`
+        documents of the books they touched are read again and applied as `apply_changes`
+        does, which neither loses a write nor counts a rating twice.
+        """
+        async with self._rebuild():
+            started = time.perf_counter()
+            books = await self.load_data()
+            RECOMMENDER_PHASE_SECONDS.observe(time.perf_counter() - started, 'load')
+            started = time.perf_counter()
+            state = await self._run_training(build_model, books, self.index_class)
+            changes = await self._read_journaled_books()
+            self._install(state, reloaded=True, changes=changes)
+            self._stats['trainings'] += 1
+            self._stats['training_seconds'] += time.perf_counter() - started
+
+    def _install(self, state, reloaded=False, changes=None):
+        """
+        Make a fitted model the current one.
+
+        Every attribute is replaced without yielding to the event loop, so requests see
+        either the old model or the new one. The phases the model was timed in are
+        recorded in `RECOMMENDER_PHASE_SECONDS`. Writes journaled while it was built are
+        replayed onto it, unless `changes` are given instead.
+
+        Parameters:
+        state (ModelState): The model to install.
+        reloaded (bool): Whether the model was loaded from the data rather than compacted
+            from the current one, so that neighbor lists computed before it are stale.
+        changes (tuple): The current documents and the removed IDs of the books written
+            while the model was built, as returned by `_read_journaled_books`.
+        """
+        for phase, seconds in (state.timings or {}).items():
+            RECOMMENDER_PHASE_SECONDS.observe(seconds, phase)
+        journal, self._journal = self._journal, None
+        self.vocabulary = state.vocabulary
+        self.catalog = state.catalog
+        self.features = state.features
+        self.index = state.index
+        self.ratings = state.catalog.ratings
+        self.genre_counts = self.features.getnnz(axis=1)
+        self.title_index = state.title_index
+        self._row_ids = {}
+        self._alive = np.ones(len(state.catalog), dtype=bool)
+        self._appended = []
+        self._pending_changes = 0
+        self.model_version += 1
+        if reloaded:
+            self._reloaded_version = self.model_version
+            self._genre_versions = {}
+        if changes is not None:
+            self._apply_current(*changes)
+            return
+        for _, write, args in journal or ():
+            write(*args)
+
+    async def _read_journaled_books(self):
+        """
+        Read the `merged_review` documents of the books written since the rebuild started.
+
+        Every write reaches the collection before the model, so a document read after a
+        write includes it. Books written while the documents are read are read too.
+
+        Returns:
+        tuple: The documents, with the `CATALOG_PROJECTION` fields, and the IDs of the
+        books no longer in the collection.
+        """
+        documents, read, position = {}, set(), 0
+        while position < len(self._journal):
+            keys = {key for book_ids, _, _ in self._journal[position:] for key in book_ids}
+            position = len(self._journal)
+            read |= keys
+            # Books are stored under ObjectIds, and under strings in tests and imports
+            query = [ObjectId(key) for key in keys if ObjectId.is_valid(key)] + list(keys)
+            async for document in merged_review_collection.find({"_id": {"$in": query}}, CATALOG_PROJECTION):
+                documents[str(document["_id"])] = document
+        return list(documents.values()), sorted(read - set(documents))
+
+    @contextlib.asynccontextmanager
+    async def _rebuild(self):
+        """
+        Serialize model rebuilds and journal the writes made while one is running.
         """
-        df = await self.load_data()
+        if self._rebuild_lock is None:
+            self._rebuild_lock = asyncio.Lock()
+        async with self._rebuild_lock:
+            self._journal = []
+            try:
+                yield
+            finally:
+                self._journal = None
 
-        df['genre'] = df['genre'].apply(lambda x: eval(x))  # Use eval to convert string to list
+    async def _run_training(self, function, *args):
+        if self.training_executor == 'process':
+            if self._training_pool is None:
+                self._training_pool = ProcessPoolExecutor(max_workers=1)
+            executor = self._training_pool
+        else:
+            executor = None  # The event loop's default thread pool
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
 
-        # Filter out books with empty genres
-        df = df[df['genre'].apply(len) > 0]
+    async def _run_scoring(self, function, *args):
+        """
+        Run a scoring function in the scoring thread pool.
+
+        At most `scoring_threads` jobs run at once; the others wait in line, and a request
+        that finds `max_queued` jobs already waiting is rejected.
 
-        df['average_rating'] = pd.to_numeric(df['average_rating'], errors='coerce')
-        genres_encoded = self.mlb.fit_transform(df['genre'])
-        self.features = np.hstack([genres_encoded, df['average_rating'].values.reshape(-1, 1)])
-        self.knn.fit(self.features)
+        Raises:
+        RecommenderBusy: If the queue is full.
+        """
+        if self.max_queued is not None and self._stats['queued'] >= self.max_queued:
+            self._stats['rejected'] += 1
+            raise RecommenderBusy("Too many recommendation requests are waiting; retry later")
+        if self._scoring_slots is None:
+            self._scoring_slots = asyncio.Semaphore(self.scoring_threads)
+            self._scoring_pool = ThreadPoolExecutor(self.scoring_threads, thread_name_prefix='recommender-scoring')
 
-        self.df = df
+        queued_at = time.perf_counter()
+        self._stats['queued'] += 1
+        try:
+            await self._scoring_slots.acquire()
+        finally:
+            self._stats['queued'] -= 1
+        started = time.perf_counter()
+        self._stats['wait_seconds'] += started - queued_at
+        RECOMMENDER_PHASE_SECONDS.observe(started - queued_at, 'queue')
+        self._stats['running'] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._scoring_pool, function, *args)
+        finally:
+            self._scoring_slots.release()
+            self._stats['running'] -= 1
+            self._stats['completed'] += 1
+            elapsed = time.perf_counter() - started
+            self._stats['scoring_seconds'] += elapsed
+            RECOMMENDER_PHASE_SECONDS.observe(elapsed, 'score')
+
+    def executor_stats(self):
+        """
+        Report the recommender's queueing, timing and result cache counters.
+
+        Returns:
+        dict: Jobs `queued` and `running` now; jobs `completed` and `rejected` so far and
+        the total seconds they spent waiting and scoring; the number of `trainings` and
+        `compactions` and the seconds spent training; result cache hits, misses,
+        coalesced requests and evictions; title queries served from the neighbor lists,
+        their refreshes, and the model changes they are behind by (`neighbor_lag`); the
+        changes applied from other workers (`synced_changes`); the `model_version`; and
+        the configured limits.
+        """
+        table = self.neighbor_table
+        return {
+            **self._stats,
+            'result_evictions': self._results.evictions,
+            'neighbor_lag': None if table is None else self.model_version - table.model_version,
+            'model_version': self.model_version,
+            'index': self.index_class.name,
+            'scoring_threads': self.scoring_threads,
+            'max_queued': self.max_queued,
+            'training_executor': self.training_executor,
+        }
+
+    def index_recall(self, queries, k=10, min_rating=0.0):
+        """
+        Measure the recall@k of the candidate index against brute-force scoring.
+
+        Parameters:
+        queries (list of list of str): Genre lists to evaluate.
+        k (int): Number of recommendations per query.
+        min_rating (float): Minimum average rating for the recommendations.
+
+        Returns:
+        float: The mean recall@k, 1.0 for the exact indexes.
+        """
+        return recall_at_k(self._view(), [self.vocabulary.lookup(genres) for genres in queries], k, min_rating)
+
+    def close(self):
+        """
+        Shut down the scoring and training pools and stop refreshing the neighbor lists.
+        """
+        if self._neighbor_task is not None:
+            self._neighbor_task.cancel()
+            self._neighbor_task = None
+        for pool in (self._scoring_pool, self._training_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._scoring_pool = self._training_pool = self._scoring_slots = None
 
     async def train_model(self):
         """
-        Train the KNN model asynchronously.
+        Train the recommender asynchronously.
         """
         await self.prepare_data()
 
+    async def data_fingerprint(self):
+        """
+        Summarize the state of the `merged_review` collection without scanning it.
+
+        Returns:
+        dict: The estimated document count, the newest `_id` and the newest `updated_at`.
+        """
+        count = await merged_review_collection.estimated_document_count()
+        newest = await merged_review_collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        updated = await merged_review_collection.find_one(
+            {"updated_at": {"$exists": True}}, {"updated_at": 1}, sort=[("updated_at", -1)]
+        )
+        return {
+            "count": count,
+            "newest_id": str(newest["_id"]) if newest else None,
+            "updated_at": str(updated["updated_at"]) if updated else None,
+        }
+
+    async def load_or_prepare(self):
+        """
+        Load the model from the snapshot if it matches the data, and rebuild it otherwise.
+
+        Builds are serialized through a lock on the snapshot directory, so when several
+        workers start at once only the first one scans MongoDB and the others load the
+        snapshot it writes.
+        """
+        if self.snapshot_dir is None:
+            await self.prepare_data()
+            self.start_neighbor_refresh()
+            return
+        fingerprint = await self.data_fingerprint()
+        with build_lock(self.snapshot_dir):
+            if self.load_snapshot(self.snapshot_dir, fingerprint):
+                logging.info("Book recommender loaded from snapshot in %s", self.snapshot_dir)
+            else:
+                await self.prepare_data()
+                self.save_snapshot(self.snapshot_dir, fingerprint)
+                logging.info("Book recommender snapshot written to %s", self.snapshot_dir)
+            if self.neighbors and self.load_neighbors(os.path.join(self.snapshot_dir, NEIGHBORS_DIR), fingerprint):
+                logging.info("Book neighbor lists loaded from snapshot in %s", self.snapshot_dir)
+        self.start_neighbor_refresh()
+
+    def start_neighbor_refresh(self):
+        """
+        Compute the neighbor lists in the background, unless they are current, and then
+        every `neighbor_refresh_seconds` while the model keeps changing.
+        """
+        if self.neighbors and (self._neighbor_task is None or self._neighbor_task.done()):
+            self._neighbor_task = asyncio.get_running_loop().create_task(self._refresh_neighbors_periodically())
+
+    async def _refresh_neighbors_periodically(self):
+        while True:
+            table = self.neighbor_table
+            if table is None or table.model_version != self.model_version:
+                try:
+                    await self.refresh_neighbors()
+                except Exception:
+                    logging.exception("Unable to refresh the book neighbor lists")
+            if not self.neighbor_refresh_seconds:
+                return
+            await asyncio.sleep(self.neighbor_refresh_seconds)
+
+    async def refresh_neighbors(self):
+        """
+        Recompute every book's top `neighbors` recommendations and swap them in.
+
+        Books with the same genres get the same recommendations, so books are grouped by
+        genre set and each set is scored once, in chunks of `NEIGHBOR_CHUNK_SIZE`: across
+        `neighbor_workers` processes, which are sent the model once, or in the event
+        loop's thread pool with the 'thread' training executor. With a `snapshot_dir`,
+        the lists are persisted next to the model snapshot.
+        """
+        if self.features is None or not self.neighbors:
+            return
+        fingerprint = None if self.snapshot_dir is None else await self.data_fingerprint()
+        started = time.perf_counter()
+        view = self._view()
+        # Ratings and tombstones are written in place, and titles are not needed
+        view = view._replace(ratings=view.ratings.copy(), alive=view.alive.copy(), titles=None)
+        version, alive = self.model_version, view.alive
+        # Only live rows get an entry, so a book whose genres changed is found once, in its
+        # current genre set
+        ids = self.catalog.ids[alive]
+        groups, query_columns = await asyncio.to_thread(genre_groups, self.features[alive])
+        chunks = [query_columns[start:start + NEIGHBOR_CHUNK_SIZE] for start in range(0, len(query_columns), NEIGHBOR_CHUNK_SIZE)]
+
+        loop = asyncio.get_running_loop()
+        if self.training_executor == 'process':
+            pool = ProcessPoolExecutor(self.neighbor_workers, initializer=_set_neighbor_view, initargs=(view,))
+            try:
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(pool, _top_neighbors_in_worker, chunk, self.neighbor_min_rating, self.neighbors)
+                    for chunk in chunks
+                ))
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(None, top_neighbors, view, chunk, self.neighbor_min_rating, self.neighbors)
+                for chunk in chunks
+            ))
+        neighbors = np.concatenate([result[0] for result in results]) if results else np.empty((0, self.neighbors), dtype=np.int32)
+        scores = np.concatenate([result[1] for result in results]) if results else np.empty((0, self.neighbors), dtype=np.int16)
+        # Neighbors are live rows; store them as positions among the live rows
+        live_positions = np.cumsum(alive, dtype=np.int32) - 1
+        neighbors = np.where(neighbors >= 0, live_positions[neighbors], -1).astype(np.int32)
+        self.neighbor_table = await asyncio.to_thread(
+            NeighborTable, ids, groups, neighbors, scores, self.neighbor_min_rating, model_version=version,
+        )
+
+        elapsed = time.perf_counter() - started
+        self._stats['neighbor_refreshes'] += 1
+        self._stats['neighbor_refresh_seconds'] += elapsed
+        RECOMMENDER_PHASE_SECONDS.observe(elapsed, 'neighbors')
+        logging.info("Book neighbor lists computed for %d books, %d genre sets, in %.1fs", len(ids), len(neighbors), elapsed)
+        if fingerprint is not None:
+            table = self.neighbor_table
+            await asyncio.to_thread(
+                write_snapshot, os.path.join(self.snapshot_dir, NEIGHBORS_DIR), table.arrays(),
+                {**table.meta(), 'fingerprint': fingerprint},
+            )
+
+    def load_neighbors(self, directory, fingerprint=None):
+        """
+        Load persisted neighbor lists, memory-mapping their arrays.
+
+        Parameters:
+        directory (str): The directory the lists were persisted in.
+        fingerprint (dict): If given, the lists are only used when they were computed
+            from data with this `data_fingerprint`.
+
+        Returns:
+        bool: Whether lists were loaded. Lists computed with another `neighbors` or
+        `neighbor_min_rating` are not.
+        """
+        loaded = read_snapshot(directory)
+        if loaded is None:
+            return False
+        arrays, meta = loaded
+        if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+            return False
+        if meta.get('k') != self.neighbors or meta.get('min_rating') != self.neighbor_min_rating:
+            return False
+        self.neighbor_table = NeighborTable.from_arrays(arrays, meta, self.model_version)
+        return True
+
+    def save_snapshot(self, directory, fingerprint=None):
+        """
+        Persist the fitted model to a versioned snapshot.
+
+        Changes made since the model was built, such as tombstoned rows, are compacted
+        in first.
+
+        Parameters:
+        directory (str): The snapshot root directory.
+        fingerprint (dict): The `data_fingerprint` the model was built from.
+
+        Returns:
+        str: The path of the written snapshot.
+        """
+        self._materialize()
+        if self._pending_changes:
+            self._install(compact_model(self.vocabulary, self.catalog, self.features, self._alive, self.index_class))
+        catalog = self.catalog
+        titles = catalog.titles.packed()
+        arrays = {
+            'indptr': self.features.indptr,
+            'indices': self.features.indices,
+            'data': self.features.data,
+            'ids': catalog.ids,
+            'id_order': catalog.id_order,
+            'ratings': catalog.ratings,
+            'rating_counts': catalog.rating_counts,
+            'title_bytes': titles.buffer,
+            'title_offsets': titles.offsets,
+            'title_order': self.title_index.sorted_rows(),
+        }
+        meta = {'fingerprint': fingerprint, 'genres': self.vocabulary.names, 'rows': len(catalog)}
+        return write_snapshot(directory, arrays, meta)
+
+    def load_snapshot(self, directory, fingerprint=None):
+        """
+        Load the model from the current snapshot, memory-mapping its arrays.
+
+        Parameters:
+        directory (str): The snapshot root directory.
+        fingerprint (dict): If given, the snapshot is only used when it was built from
+            data with this `data_fingerprint`.
+
+        Returns:
+        bool: Whether a snapshot was loaded.
+        """
+        loaded = read_snapshot(directory)
+        if loaded is None:
+            return False
+        arrays, meta = loaded
+        if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+            return False
+
+        # The catalog's columns are used as mapped; only the title index is rebuilt
+        catalog = Catalog(
+            arrays['ids'],
+            StringColumn(arrays['title_bytes'], arrays['title_offsets']),
+            arrays['ratings'],
+            arrays['rating_counts'],
+            arrays['id_order'],
+        )
+        vocabulary = GenreVocabulary(meta['genres'])
+        features = sparse.csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=(meta['rows'], len(vocabulary)),
+        )
+        title_index = TitleIndex(catalog.titles, arrays['title_order'])
+        self._install(ModelState(vocabulary, catalog, features, title_index, self.index_class(features, catalog.ratings)), reloaded=True)
+        return True
+
+    def _row_columns(self, row):
+        """
+        Return the genre IDs of a materialized row.
+        """
+        start, end = self.features.indptr[row], self.features.indptr[row + 1]
+        return sorted(self.features.indices[start:end])
+
+    def _materialize(self):
+        """
+        Fold rows appended since the last query into the catalog and feature matrix.
+        """
+        if not self._appended:
+            return
+        appended, self._appended = self._appended, []
+        first_row = len(self.catalog)
+        self.catalog = self.catalog.extend(
+            [book['_id'] for book in appended],
+            [book['title'] for book in appended],
+            [book['average_rating'] for book in appended],
+            [book['review_count'] for book in appended],
+        )
+        # Genres first seen here were interned by upsert_book and get new columns
+        num_genres = len(self.vocabulary)
+        new_features = _genre_matrix([book['genre_ids'] for book in appended], num_genres)
+        features = self.features.copy()  # Scoring jobs may still be reading the current matrix
+        features.resize((features.shape[0], num_genres))
+        self.features = sparse.vstack([features, new_features], format='csr')
+        self.index = self.index.extend(self.features, first_row)
+        self.ratings = self.catalog.ratings
+        self.genre_counts = np.concatenate([self.genre_counts, new_features.getnnz(axis=1)])
+        self._alive = np.concatenate([self._alive, np.ones(len(appended), dtype=bool)])
+        for offset, book in enumerate(appended):
+            self.title_index.add(book['title'], first_row + offset)
+
+    def _view(self):
+        """
+        Capture the arrays a scoring job needs, after folding in pending appends.
+        """
+        self._materialize()
+        return ModelView(self.index, self.ratings, self.genre_counts, self._alive, self.catalog.titles)
+
+    def _locate(self, book_id):
+        key = str(book_id)
+        row = self._row_ids[key] if key in self._row_ids else self.catalog.locate(key)
+        if row is not None and row >= len(self.catalog):
+            self._materialize()
+        return row
+
+    def _note_change(self, genre_ids=()):
+        self.model_version += 1
+        # The neighbor lists of queries sharing one of these genres are now stale
+        for genre_id in genre_ids:
+            self._genre_versions[genre_id] = self.model_version
+        self._pending_changes += 1
+        if self._pending_changes >= self.compact_threshold:
+            self._schedule_compaction()
+
+    def _schedule_compaction(self):
+        if self._compaction_task is not None and not self._compaction_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._compaction_task = loop.create_task(self.compact())
+
+    async def compact(self):
+        """
+        Drop tombstoned rows from the in-memory data.
+
+        Unlike `prepare_data`, this does not reload the collection from MongoDB. The
+        compacted copy is built in a thread from a snapshot of the current arrays, and
+        writes made meanwhile are replayed onto it before it is swapped in.
+        """
+        if self.features is None:
+            return
+        async with self._rebuild():
+            self._materialize()
+            state = await asyncio.get_running_loop().run_in_executor(
+                None,
+                compact_model,
+                self.vocabulary,
+                self.catalog.copy(),
+                self.features,
+                self._alive.copy(),
+                self.index_class,
+            )
+            self._install(state)
+            self._stats['compactions'] += 1
+        logging.info("Book recommender compacted to %d books", len(self.catalog))
+
+    def _write(self, book_ids, write, *args):
+        """
+        Apply a write to the current model, journaling it with the IDs of the books it
+        touches if a rebuild is running.
+        """
+        if self._journal is not None:
+            self._journal.append(([str(book_id) for book_id in book_ids], write, args))
+        if self.features is not None:
+            write(*args)
+
+    async def upsert_book(self, book_id, title, genres, average_rating=float('nan')):
+        """
+        Add a book to the model, or update it in place if it is already known.
+
+        A changed title is patched in place. Changed genres tombstone the old row and append
+        a new one that keeps the book's rating history.
+
+        Parameters:
+        book_id (str or ObjectId): The book's ID.
+        title (str): The book title.
+        genres (list of str or str): The book's genres, in any form accepted by `parse_genres`.
+        average_rating (float): Average rating for a book new to the model.
+        """
+        self._write([book_id], self._upsert_book, book_id, title, genres, average_rating)
+
+    def _upsert_book(self, book_id, title, genres, average_rating):
+        genre_ids = self.vocabulary.encode(parse_genres(genres))
+        key = str(book_id)
+        rating_count = 0
+        changed_genres = list(genre_ids)
+        row = self._locate(key)
+        if row is not None:
+            book = self.catalog[row]
+            columns = self._row_columns(row)
+            if columns == sorted(genre_ids):
+                if book.title != title:
+                    self.catalog.titles.set(row, title)
+                    self.title_index.add(title, row)
+                    self._note_change()
+                return
+            average_rating = book.average_rating
+            rating_count = book.review_count
+            changed_genres += columns
+            self._tombstone(key, row)
+        if not genre_ids:
+            if row is not None:
+                self._note_change(changed_genres)
+            return
+
+        self._row_ids[key] = len(self.catalog) + len(self._appended)
+        self._appended.append({
+            '_id': key,
+            'title': title,
+            'genre_ids': genre_ids,
+            'average_rating': average_rating,
+            'review_count': rating_count,
+        })
+        self._note_change(changed_genres)
+
+    async def remove_book(self, book_id):
+        """
+        Tombstone a book so it is no longer recommended or matched by title.
+
+        Parameters:
+        book_id (str or ObjectId): The book's ID.
+        """
+        self._write([book_id], self._remove_book, book_id)
+
+    def _remove_book(self, book_id):
+        key = str(book_id)
+        row = self._locate(key)
+        if row is not None:
+            self._tombstone(key, row)
+            self._note_change(self._row_columns(row))
+
+    def _tombstone(self, key, row):
+        self._alive[row] = False
+        self.title_index.discard(row)
+        self._row_ids[key] = None
+
+    async def record_rating(self, book_id, rating):
+        """
+        Fold a new review rating into a book's running average rating.
+
+        Parameters:
+        book_id (str or ObjectId): The reviewed book's ID.
+        rating (float): The review rating.
+        """
+        self._write([book_id], self._record_rating, book_id, rating)
+
+    def _record_rating(self, book_id, rating):
+        row = self._locate(book_id)
+        if row is None:
+            return
+        book = self.catalog[row]
+        count, average_rating = book.review_count, book.average_rating
+        if count == 0 or np.isnan(average_rating):
+            average_rating, count = float(rating), 0
+        else:
+            average_rating = (average_rating * count + rating) / (count + 1)
+        self.ratings[row] = average_rating
+        self.index = self.index.rerated(row)
+        self.catalog.rating_counts[row] = count + 1
+        self._note_change(self._row_columns(row))
+
+    async def apply_changes(self, documents, removed_ids=()):
+        """
+        Bring books in line with their current `merged_review` documents.
+
+        This is how writes made by other workers reach this one's model (see
+        `app.sync`). Unlike `upsert_book` and `record_rating`, each document replaces the
+        book's title, genres, average rating and rating count, so applying a document
+        twice, or after this worker already made the same write, changes nothing.
+
+        Parameters:
+        documents (list of dict): The changed documents, with the `CATALOG_PROJECTION`
+            fields.
+        removed_ids (iterable of str or ObjectId): IDs of books deleted from the collection.
+        """
+        removed_ids = list(removed_ids)
+        self._write([document['_id'] for document in documents] + removed_ids, self._apply_changes, documents, removed_ids)
+
+    def _apply_changes(self, documents, removed_ids):
+        self._apply_current(documents, removed_ids)
+        self._stats['synced_changes'] += len(documents) + len(removed_ids)
+
+    def _apply_current(self, documents, removed_ids):
+        if documents:
+            # Ratings and counts are normalized exactly as when the model is loaded
+            batch = Catalog.from_columns({field: [document.get(field) for document in documents] for field in CATALOG_PROJECTION})
+            for position, document in enumerate(documents):
+                self._apply_document(
+                    str(document['_id']), document.get('title'), document.get('genre'),
+                    batch.ratings[position], batch.rating_counts[position],
+                )
+        for book_id in removed_ids:
+            self._remove_book(book_id)
+
+    def _apply_document(self, key, title, genres, average_rating, rating_count):
+        title = title if isinstance(title, str) else ""
+        genre_ids = self.vocabulary.encode(parse_genres(genres))
+        changed_genres = list(genre_ids)
+        row = self._locate(key)
+        if row is not None:
+            columns = self._row_columns(row)
+            if columns == sorted(genre_ids):
+                changed = False
+                if self.catalog.titles[row] != title:
+                    self.catalog.titles.set(row, title)
+                    self.title_index.add(title, row)
+                    changed = True
+                rating = self.ratings[row]
+                if not (rating == average_rating or (np.isnan(rating) and np.isnan(average_rating))):
+                    self.ratings[row] = average_rating
+                    self.index = self.index.rerated(row)
+                    changed = rerated = True
+                else:
+                    rerated = False
+                if self.catalog.rating_counts[row] != rating_count:
+                    self.catalog.rating_counts[row] = rating_count
+                    changed = True
+                if changed:
+                    self._note_change(columns if rerated else ())
+                return
+            changed_genres += columns
+            self._tombstone(key, row)
+            if not genre_ids:
+                self._note_change(changed_genres)
+        if not genre_ids:
+            return
+
+        self._row_ids[key] = len(self.catalog) + len(self._appended)
+        self._appended.append({
+            '_id': key,
+            'title': title,
+            'genre_ids': genre_ids,
+            'average_rating': float(average_rating),
+            'review_count': int(rating_count),
+        })
+        self._note_change(changed_genres)
+
     async def recommend_books(self, genres, min_rating=4.0, num_recommendations=5):
         """
         Recommend books based on genres and minimum average rating.
 
+        Matched-genre counts come from the candidate index: the posting lists of the
+        query's genres by default, or one sparse matrix product with brute force. Books
+        below `min_rating` or without a matched genre are masked out, and the top
+        `num_recommendations` are ranked by matched genres, then average rating, then
+        cosine similarity to the query (fewer genres wins when the first two tie).
+        Scoring runs in the scoring thread pool, so the event loop stays free, and results
+        are memoized until the model next changes.
+
         Parameters:
         genres (list of str): List of genres to base recommendations on.
         min_rating (float): Minimum average rating for the recommendations.
@@ -97,28 +1317,22 @@ class BookRecommender:
 
         Returns:
         pd.DataFrame: DataFrame containing the recommended books.
+
+        Raises:
+        RecommenderBusy: If too many requests are already waiting to be scored.
         """
         if self.features is None:
             await self.train_model()
 
-        genre_vector = self.mlb.transform([genres])
-        avg_rating_vector = np.array([[min_rating]])
-        genre_avg_vector = np.hstack([genre_vector, avg_rating_vector])
-
-        distances, indices = self.knn.kneighbors(genre_avg_vector, n_neighbors=len(self.df))
-
-        recommendations = self.df.iloc[indices[0]]
-        recommendations = recommendations[recommendations['average_rating'] >= min_rating]
-        recommendations['matched_genres'] = recommendations['genre'].apply(lambda x: len(set(genres) & set(x)))
-        recommendations = recommendations[recommendations['matched_genres'] > 0]
-        recommendations = recommendations.sort_values(by=['matched_genres', 'average_rating'], ascending=[False, False])
-
-        return recommendations.head(num_recommendations)[['title', 'average_rating', 'matched_genres']]
+        return await self._score_cached(self.vocabulary.lookup(genres), min_rating, num_recommendations)
 
     async def recommend_books_by_title(self, book_title, min_rating=4.0, num_recommendations=5):
         """
         Recommend books based on a book title.
 
+        The title is resolved against the in-memory title index built by `prepare_data`,
+        so no database query is made on the request path.
+
         Parameters:
         book_title (str): The title of the book to base recommendations on.
         min_rating (float): Minimum average rating for the recommendations.
@@ -126,14 +1340,158 @@ class BookRecommender:
 
         Returns:
         pd.DataFrame: DataFrame containing the recommended books.
+
+        Raises:
+        RecommenderBusy: If too many requests are already waiting to be scored.
         """
-        df = await self.load_data()
+        if self.features is None:
+            await self.train_model()
 
-        book_row = df[df['title'].str.contains(book_title, case=False, na=False)]
+        self._materialize()
+        row = self.title_index.lookup(book_title)
 
-        if book_row.empty:
+        if row is None:
             return f"No book found with the title '{book_title}'"
 
-        genres = eval(book_row.iloc[0]['genre'])  # Convert genre from string to list
+        neighbors = self._lookup_neighbors(row, min_rating, num_recommendations)
+        if neighbors is not None:
+            return neighbors
+        return await self._score_cached(self._row_columns(row), min_rating, num_recommendations)
+
+    def _lookup_neighbors(self, row, min_rating, num_recommendations):
+        """
+        Read a book's recommendations from the neighbor lists.
+
+        The lists are used only while they are exact for the query. They must not be
+        older than the last reload, and no book sharing one of the query's genres may have
+        been added, removed or re-rated since they were computed. Only those books can be
+        recommended for it. Neighbors are served with their current titles and ratings,
+        filtered and ordered as scoring would.
+
+        Returns:
+        pd.DataFrame or None: The recommended books, or None if the query must be scored:
+        the lists are missing, were computed for another minimum rating or fewer books,
+        are stale for the query's genres, do not have the book, or lost too many neighbors.
+        """
+        table = self.neighbor_table
+        if table is None or float(min_rating) != table.min_rating or num_recommendations > table.k:
+            return None
+        if table.model_version != self.model_version:
+            columns = self._row_columns(row)
+            if table.model_version is None or table.model_version < self._reloaded_version or any(
+                self._genre_versions.get(genre_id, 0) > table.model_version for genre_id in columns
+            ):
+                self._stats['neighbor_misses'] += 1
+                return None
+        found = table.lookup(self.catalog.ids[row])
+        if found is None:
+            self._stats['neighbor_misses'] += 1
+            return None
+        ids, scores = found
+        rows, matched = [], []
+        for book_id, score in zip(ids, scores):
+            neighbor = self._locate(book_id.decode())
+            if neighbor is not None:
+                rows.append(neighbor)
+                matched.append(score)
+        # In row order, so that ties are broken as in scoring
+        order = np.argsort(np.asarray(rows, dtype=np.int64), kind='stable')
+        rows = np.asarray(rows, dtype=np.int64)[order]
+        matched = np.asarray(matched, dtype=np.int64)[order]
+        ratings = self.ratings[rows]
+        keep = ratings >= np.float32(min_rating)
+        rows, matched, ratings = rows[keep], matched[keep], ratings[keep]
+        # A full list that lost books may have left out ones that now qualify
+        if len(rows) < num_recommendations and len(ids) == table.k:
+            self._stats['neighbor_misses'] += 1
+            return None
+        self._stats['neighbor_hits'] += 1
+        top = select_top([-matched, -ratings, self.genre_counts[rows]], num_recommendations)
+        return recommendation_frame(self.catalog.titles, rows[top], ratings[top], matched[top])
+
+    async def _score_cached(self, genre_ids, min_rating, num_recommendations):
+        """
+        Score a query through the result cache.
+
+        Results are memoized under the query's sorted genre IDs, minimum rating and count,
+        and are only served for the `model_version` they were computed at, so any retrain
+        or incremental change invalidates them. Concurrent identical misses share one
+        scoring job.
+
+        Parameters:
+        genre_ids (list of int): The query's sorted genre IDs.
+        min_rating (float): Minimum average rating for the recommendations.
+        num_recommendations (int): Number of recommendations to return.
+
+        Returns:
+        pd.DataFrame: DataFrame containing the recommended books.
+        """
+        key = (tuple(int(genre_id) for genre_id in genre_ids), float(min_rating), int(num_recommendations))
+        view = self._view()
+        version = self.model_version
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == version:
+            self._stats['result_hits'] += 1
+            return cached[1].copy()
+
+        job = self._inflight.get((version, key))
+        if job is None:
+            self._stats['result_misses'] += 1
+            job = asyncio.ensure_future(self._run_scoring(score, view, genre_ids, min_rating, num_recommendations))
+            self._inflight[(version, key)] = job
+            job.add_done_callback(partial(self._store_result, version, key))
+        else:
+            self._stats['result_coalesced'] += 1
+        # Shielded, so a cancelled request does not cancel the job for the others sharing it
+        return (await asyncio.shield(job)).copy()
+
+    def _store_result(self, version, key, job):
+        del self._inflight[(version, key)]
+        if not job.cancelled() and job.exception() is None and version == self.model_version:
+            self._results.set(key, (version, job.result()))
+
+    async def recommend_many(self, queries):
+        """
+        Recommend books for many seed titles or genre lists at once.
+
+        The batch takes one scoring thread, and the candidates of every query are found
+        through the index's `candidates_many`. With the brute-force index that is a single
+        sparse matrix product between the genre matrix and the stacked query vectors. The
+        inverted index reads each query's posting lists in turn, so there each query only
+        pays for the books that share at least one of its genres.
+
+        Parameters:
+        queries (list of dict): Each query has either a `title` or a `genres` list, and
+            optionally a `min_rating` (default 4.0) and `num_recommendations` (default 5).
+
+        Returns:
+        list: One entry per query, in order: a DataFrame of recommended books, or a
+            message string if the seed title was not found.
+
+        Raises:
+        RecommenderBusy: If too many requests are already waiting to be scored.
+        """
+        if self.features is None:
+            await self.train_model()
+
+        view = self._view()
+
+        results = [None] * len(queries)
+        scored = []
+        query_columns = []
+        for position, query in enumerate(queries):
+            if query.get('genres') is not None:
+                genre_ids = self.vocabulary.lookup(query['genres'])
+            else:
+                row = self.title_index.lookup(query.get('title'))
+                if row is None:
+                    results[position] = f"No book found with the title '{query.get('title')}'"
+                    continue
+                genre_ids = self._row_columns(row)
+            scored.append((position, query))
+            query_columns.append(genre_ids)
 
-        return await self.recommend_books(genres, min_rating, num_recommendations)
+        recommendations = await self._run_scoring(score_many, view, query_columns, [query for _, query in scored])
+        for (position, _), books in zip(scored, recommendations):
+            results[position] = books
+        return results
@@ -0,0 +1,572 @@
+"""
+search.py
+=========
+
+This module provides the in-memory search index behind `GET /books/search`.
+
+Books are searched by the words of their title and author, with the last word of a
+query matched as a prefix for autocomplete, and filtered by genre and publication year.
+The index is built from `merged_review` at startup and kept in sync with book writes.
+
+Title and author words are tokenized into an inverted index: a sorted term dictionary,
+packed like the recommender's catalog, and for each term the ascending positions of the
+books containing it. A prefix is a contiguous range of the dictionary, found by binary
+search, so the dictionary also serves as the trie for autocomplete. Genres get their own
+posting lists. Books are numbered by average rating, best first, so the intersection of
+posting lists is already ranked and a query only materializes the books it returns.
+
+Books written after the index was built are kept in a small overlay, ranked after the
+indexed books, until the index is compacted in the background.
+
+Classes
+-------
+- `PostingLists` : Sorted keys with the positions of the books that have each one.
+- `SearchIndex` : The searchable books, kept in sync with writes.
+
+Functions
+---------
+- `tokenize` : Split text into lowercase words.
+- `build_search_state` : Build the index arrays from loaded columns.
+
+Constants
+---------
+- `SEARCH_PROJECTION` : The `merged_review` fields the index loads.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import itertools
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .catalog import StringColumn
+from .database import merged_review_collection
+from .genres import parse_genres
+
+SEARCH_PROJECTION = {"_id": 1, "title": 1, "author": 1, "genre": 1, "year_published": 1, "average_rating": 1}
+TOKEN_PATTERN = re.compile(r"\w+")
+# Year of books without one; excluded by any year filter
+MISSING_YEAR = np.iinfo(np.int32).min
+# Sorts after every string that starts with a given prefix
+PREFIX_END = "\U0010ffff"
+
+
+def tokenize(text):
+    """
+    Split text into lowercase words.
+
+    Parameters:
+    text (str): The text, or None.
+
+    Returns:
+    list of str: The words, in order.
+    """
+    return TOKEN_PATTERN.findall(text.casefold()) if isinstance(text, str) else []
+
+
+class PostingLists:
+    """
+    Sorted string keys, each with the ascending positions of the books that have it,
+    and the keys of each book.
+
+    Both directions are stored as compressed sparse rows: `indptr` and `postings` by key,
+    `row_indptr` and `row_keys` by book, where keys are numbered in sorted order so a
+    prefix is a range of key numbers.
+    """
+
+    def __init__(self, keys, indptr, postings, row_indptr, row_keys):
+        self.keys = keys
+        self.indptr = indptr
+        self.postings = postings
+        self.row_indptr = row_indptr
+        self.row_keys = row_keys
+
+    @classmethod
+    def build(cls, rows_keys):
+        """
+        Build the lists from each book's keys.
+
+        Parameters:
+        rows_keys (list of list of str): The keys of each book, in position order.
+
+        Returns:
+        PostingLists: The lists.
+        """
+        lengths = np.fromiter(map(len, rows_keys), dtype=np.int64, count=len(rows_keys))
+        # Keys are numbered in sorted order, as the same str comparisons `key_range` bisects with
+        codes, names = pd.factorize(pd.Series(list(itertools.chain.from_iterable(rows_keys)), dtype=object), sort=True)
+        rows = np.repeat(np.arange(len(rows_keys), dtype=np.int64), lengths)
+        # Keep the first of any key a book repeats, in the book's own order
+        _, first = np.unique(rows * max(len(names), 1) + codes, return_index=True)
+        first.sort()
+        rows = rows[first].astype(np.int32)
+        row_keys = codes[first].astype(np.int32)
+
+        row_indptr = np.zeros(len(rows_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(rows_keys)), out=row_indptr[1:])
+        # A stable sort keeps each key's positions ascending
+        postings = rows[np.argsort(row_keys, kind="stable")]
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_keys, minlength=len(names)), out=indptr[1:])
+        return cls(StringColumn.from_strings(names), indptr, postings, row_indptr, row_keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.indptr.nbytes + self.postings.nbytes + self.row_indptr.nbytes + self.row_keys.nbytes
+
+    def key_range(self, prefix):
+        """
+        Find the keys that start with a prefix.
+
+        Returns:
+        tuple: The first key number and one past the last.
+        """
+        return bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + PREFIX_END)
+
+    def get(self, key):
+        """
+        Return the positions of the books that have a key.
+        """
+        number = bisect.bisect_left(self.keys, key)
+        if number < len(self.keys) and self.keys[number] == key:
+            return self.postings[self.indptr[number]:self.indptr[number + 1]]
+        return self.postings[:0]
+
+    def get_range(self, start, stop):
+        """
+        Return the positions of the books that have any key numbered in a range,
+        ascending and without duplicates.
+        """
+        positions = self.postings[self.indptr[start]:self.indptr[stop]]
+        if stop - start <= 1:
+            return positions
+        if len(positions) < len(self.row_indptr) // 16:
+            return np.unique(positions)
+        present = np.zeros(len(self.row_indptr) - 1, dtype=bool)
+        present[positions] = True
+        return np.flatnonzero(present).astype(np.int32)
+
+    def have_range(self, rows, start, stop):
+        """
+        Check which books have a key numbered in a range.
+
+        Parameters:
+        rows (np.ndarray): Book positions.
+        start (int): The first key number.
+        stop (int): One past the last key number.
+
+        Returns:
+        np.ndarray: Boolean mask over `rows`.
+        """
+        starts = self.row_indptr[rows]
+        lengths = self.row_indptr[rows + 1] - starts
+        owners = np.repeat(np.arange(len(rows)), lengths)
+        # Key i of the gathered keys comes from its book's start plus its place in that book's keys
+        gathered = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        keys = self.row_keys[gathered]
+        return np.bincount(owners[(keys >= start) & (keys < stop)], minlength=len(rows)) > 0
+
+    def keys_of(self, row):
+        """
+        Return the key numbers of one book.
+        """
+        return self.row_keys[self.row_indptr[row]:self.row_indptr[row + 1]]
+
+
+# The index arrays, with books in rank order
+SearchState = namedtuple(
+    'SearchState',
+    ['ids', 'id_order', 'titles', 'authors', 'years', 'ratings', 'terms', 'genres', 'genre_names'],
+)
+
+# A book written since the index was built
+OverlayBook = namedtuple('OverlayBook', ['id', 'title', 'author', 'genres', 'year', 'rating', 'terms', 'genre_keys'])
+
+
+def build_search_state(columns):
+    """
+    Build the index arrays from loaded columns.
+
+    Books are numbered by average rating, best first and unrated last, then by load
+    order. This is CPU-bound, so the index runs it in a thread.
+
+    Parameters:
+    columns (dict): Lists of `_id`, `title`, `author`, `genre`, `year_published` and
+        `average_rating` values, one per book. Missing columns are filled in.
+
+    Returns:
+    SearchState: The index arrays.
+    """
+    count = len(columns.get("_id") or ())
+
+    def column(name):
+        values = columns.get(name)
+        return np.full(count, None, dtype=object) if values is None else np.asarray(values, dtype=object)
+
+    ratings = pd.to_numeric(pd.Series(column("average_rating")), errors="coerce").to_numpy(np.float32)
+    order = np.lexsort((np.arange(count), -np.nan_to_num(ratings, nan=-np.inf)))
+    ids = np.array([str(book_id).encode() for book_id in column("_id")[order]], dtype="S")
+    titles = column("title")[order]
+    authors = column("author")[order]
+    years = pd.to_numeric(pd.Series(column("year_published")[order]), errors="coerce")
+    genres = [parse_genres(value) for value in column("genre")[order]]
+
+    genre_names = {}
+    for names in genres:
+        for name in names:
+            genre_names.setdefault(name.casefold(), name)
+    return SearchState(
+        ids=ids,
+        id_order=np.argsort(ids, kind="stable"),
+        titles=StringColumn.from_strings(titles),
+        authors=StringColumn.from_strings(authors),
+        years=years.fillna(MISSING_YEAR).to_numpy(np.int64).clip(MISSING_YEAR, np.iinfo(np.int32).max).astype(np.int32),
+        ratings=ratings[order],
+        terms=PostingLists.build([tokenize(f"{title or ''} {author or ''}") for title, author in zip(titles, authors)]),
+        genres=PostingLists.build([[name.casefold() for name in names] for names in genres]),
+        genre_names=genre_names,
+    )
+
+
+def _intersect(smaller, larger):
+    """
+    Intersect two ascending arrays of distinct positions, probing the larger with the smaller.
+    """
+    if len(smaller) > len(larger):
+        smaller, larger = larger, smaller
+    found = np.searchsorted(larger, smaller)
+    found[found == len(larger)] = 0
+    return smaller[larger[found] == smaller] if len(larger) else smaller[:0]
+
+
+def _chunks(candidates, total, limit):
+    """
+    Yield candidate positions in rank order, in chunks that start at a few times `limit`
+    and double, so filters stop early when the best candidates match.
+
+    Parameters:
+    candidates (np.ndarray): Ascending positions, or None for all `total` books.
+    total (int): Number of books.
+    limit (int): Number of results wanted.
+    """
+    size = max(4 * limit, 1024)
+    stop = total if candidates is None else len(candidates)
+    start = 0
+    while start < stop:
+        end = min(start + size, stop)
+        yield np.arange(start, end, dtype=np.int32) if candidates is None else candidates[start:end]
+        start = end
+        size *= 2
+
+
+def _compacted_columns(state, overlay, removed):
+    """
+    Gather the columns of the live books, indexed and overlaid, to rebuild from.
+    """
+    keep = np.ones(len(state.ids), dtype=bool)
+    keep[[position for position in removed if position < len(keep)]] = False
+    rows = np.flatnonzero(keep)
+    base = len(state.ids)
+    live = [book for position, book in enumerate(overlay, start=base) if position not in removed]
+    return {
+        "_id": [book_id.decode() for book_id in state.ids[rows]] + [book.id for book in live],
+        "title": state.titles.take(rows.tolist()) + [book.title for book in live],
+        "author": state.authors.take(rows.tolist()) + [book.author for book in live],
+        "genre": [
+            [state.genre_names[state.genres.keys[key]] for key in state.genres.keys_of(row)] for row in rows
+        ] + [book.genres for book in live],
+        "year_published": [None if year == MISSING_YEAR else int(year) for year in state.years[rows]]
+        + [book.year for book in live],
+        "average_rating": state.ratings[rows].tolist() + [book.rating for book in live],
+    }
+
+
+def _compact(state, overlay, removed):
+    return build_search_state(_compacted_columns(state, overlay, removed))
+
+
+class SearchIndex:
+    """
+    The searchable books, kept in sync with book writes.
+
+    Writes go to an overlay of books appended after the indexed ones and a set of
+    removed positions. Once `compact_threshold` writes have accumulated, the index is
+    rebuilt in a background thread without them. Writes made while a build runs are
+    journaled and replayed onto its result, so none is lost.
+    """
+
+    def __init__(self, compact_threshold=1000):
+        """
+        Parameters:
+        compact_threshold (int): Writes after which the index is rebuilt in the background.
+        """
+        self.compact_threshold = compact_threshold
+        self.state = None
+        self._overlay = []
+        self._overlay_terms = {}  # Term -> positions of overlaid books with it
+        self._overlay_genres = {}
+        self._moved = {}  # ID -> position of books written since the build, None if removed
+        self._removed = set()
+        self._pending_changes = 0
+        self._compaction_task = None
+        self._journal = None
+        self._rebuild_lock = None
+
+    async def load(self):
+        """
+        Build the index from `merged_review`, off the event loop, and swap it in.
+        """
+        async with self._rebuild():
+            columns = {field: [] for field in SEARCH_PROJECTION}
+            async for book in merged_review_collection.find({}, SEARCH_PROJECTION):
+                for field, values in columns.items():
+                    values.append(book.get(field))
+            self._install(await asyncio.to_thread(build_search_state, columns))
+
+    def _install(self, state):
+        journal, self._journal = self._journal, None
+        self.state = state
+        self._overlay = []
+        self._overlay_terms = {}
+        self._overlay_genres = {}
+        self._moved = {}
+        self._removed = set()
+        self._pending_changes = 0
+        for write, args in journal or ():
+            write(*args)
+
+    @contextlib.asynccontextmanager
+    async def _rebuild(self):
+        if self._rebuild_lock is None:
+            self._rebuild_lock = asyncio.Lock()
+        async with self._rebuild_lock:
+            self._journal = []
+            try:
+                yield
+            finally:
+                self._journal = None
+
+    async def compact(self):
+        """
+        Rebuild the index without the overlay and removed books, off the event loop.
+        """
+        async with self._rebuild():
+            if self.state is not None:
+                state = await asyncio.to_thread(_compact, self.state, list(self._overlay), set(self._removed))
+                self._install(state)
+
+    def _locate(self, book_id):
+        key = str(book_id)
+        if key in self._moved:
+            return self._moved[key]
+        state = self.state
+        encoded = key.encode()
+        position = np.searchsorted(state.ids, encoded, sorter=state.id_order)
+        if position < len(state.id_order):
+            row = int(state.id_order[position])
+            if state.ids[row] == encoded and row not in self._removed:
+                return row
+        return None
+
+    def _write(self, write, *args):
+        if self.state is None:
+            return
+        if self._journal is not None:
+            self._journal.append((write, args))
+        write(*args)
+        self._pending_changes += 1
+        if self._pending_changes >= self.compact_threshold and (self._compaction_task is None or self._compaction_task.done()):
+            self._compaction_task = asyncio.ensure_future(self.compact())
+
+    async def upsert_book(self, book_id, title, author, genres, year_published, average_rating=float("nan")):
+        """
+        Add a book to the index, or replace its indexed fields.
+
+        Parameters:
+        book_id (str or ObjectId): The book's ID.
+        title (str): The title.
+        author (str): The author.
+        genres (list or str): The genres, in any form `parse_genres` accepts.
+        year_published (int): The publication year, or None.
+        average_rating (float): The average rating, or NaN to keep the indexed one.
+        """
+        self._write(self._upsert_book, str(book_id), title, author, parse_genres(genres), year_published, average_rating)
+
+    def _upsert_book(self, book_id, title, author, genres, year_published, average_rating):
+        previous = self._locate(book_id)
+        if previous is not None:
+            if np.isnan(average_rating):
+                average_rating = self._book(previous)["average_rating"]
+            self._removed.add(previous)
+        position = len(self.state.ids) + len(self._overlay)
+        book = OverlayBook(
+            book_id, title, author, genres, year_published,
+            float("nan") if average_rating is None else float(average_rating),
+            set(tokenize(title) + tokenize(author)), {name.casefold() for name in genres},
+        )
+        self._overlay.append(book)
+        for term in book.terms:
+            self._overlay_terms.setdefault(term, []).append(position)
+        for genre in book.genre_keys:
+            self._overlay_genres.setdefault(genre, []).append(position)
+        self._moved[book_id] = position
+
+    async def remove_book(self, book_id):
+        """
+        Remove a book from the index.
+        """
+        self._write(self._remove_book, str(book_id))
+
+    def _remove_book(self, book_id):
+        position = self._locate(book_id)
+        if position is not None:
+            self._removed.add(position)
+        self._moved[book_id] = None
+
+    def _postings(self, lists, overlay, key):
+        positions = lists.get(key)
+        extra = overlay.get(key)
+        return np.concatenate([positions, np.asarray(extra, dtype=np.int32)]) if extra else positions
+
+    def _prefix_postings(self, prefix):
+        terms = self.state.terms
+        positions = terms.get_range(*terms.key_range(prefix))
+        extra = [
+            position for position, book in enumerate(self._overlay, start=len(self.state.ids))
+            if any(term.startswith(prefix) for term in book.terms)
+        ]
+        return np.concatenate([positions, np.asarray(extra, dtype=np.int32)]) if extra else positions
+
+    def _have_prefix(self, positions, prefix):
+        base = len(self.state.ids)
+        indexed = positions < base
+        mask = np.zeros(len(positions), dtype=bool)
+        mask[indexed] = self.state.terms.have_range(positions[indexed], *self.state.terms.key_range(prefix))
+        for i in np.flatnonzero(~indexed):
+            mask[i] = any(term.startswith(prefix) for term in self._overlay[positions[i] - base].terms)
+        return mask
+
+    def _years(self, positions):
+        base = len(self.state.ids)
+        years = self.state.years[np.minimum(positions, base - 1)] if base else np.zeros(len(positions), dtype=np.int32)
+        for i in np.flatnonzero(positions >= base):
+            year = self._overlay[positions[i] - base].year
+            years[i] = MISSING_YEAR if year is None else year
+        return years
+
+    def _book(self, position):
+        state = self.state
+        if position >= len(state.ids):
+            book = self._overlay[position - len(state.ids)]
+            return {
+                "id": book.id,
+                "title": book.title,
+                "author": book.author,
+                "genre": book.genres,
+                "year_published": book.year,
+                "average_rating": None if np.isnan(book.rating) else book.rating,
+            }
+        rating = state.ratings[position]
+        year = state.years[position]
+        return {
+            "id": state.ids[position].decode(),
+            "title": state.titles[position],
+            "author": state.authors[position],
+            "genre": [state.genre_names[state.genres.keys[key]] for key in state.genres.keys_of(position)],
+            "year_published": None if year == MISSING_YEAR else int(year),
+            # The shortest decimal form of the float32 rating, e.g. 4.7 rather than 4.699999809
+            "average_rating": None if np.isnan(rating) else float(str(rating)),
+        }
+
+    def search(self, query="", genres=(), year_from=None, year_to=None, prefix=True, limit=20):
+        """
+        Find books by title and author words, genres and publication year.
+
+        Every word of the query must appear in the book's title or author. Unless the
+        query ends with a space, its last word is matched as a prefix. Every given genre
+        must be one of the book's, case-insensitively. Results are ordered by average
+        rating as of the last build, best first, followed by books written since.
+
+        Parameters:
+        query (str): The words to look for.
+        genres (list of str): Genres the books must have.
+        year_from (int): Earliest publication year, or None.
+        year_to (int): Latest publication year, or None.
+        prefix (bool): Match the last word as a prefix.
+        limit (int): Maximum number of books to return.
+
+        Returns:
+        list of dict: The matching books, with their `id`, `title`, `author`, `genre`,
+        `year_published` and `average_rating`.
+        """
+        if self.state is None:
+            return []
+        words = list(dict.fromkeys(tokenize(query)))
+        partial = words.pop() if prefix and words and not query[-1:].isspace() else None
+        lists = [self._postings(self.state.terms, self._overlay_terms, word) for word in words]
+        lists += [self._postings(self.state.genres, self._overlay_genres, genre.strip().casefold()) for genre in genres]
+
+        # Smallest lists first, so every intersection probes with as few positions as possible
+        candidates = None
+        for positions in sorted(lists, key=len):
+            candidates = positions if candidates is None else _intersect(candidates, positions)
+        total = len(self.state.ids) + len(self._overlay)
+        if partial is not None:
+            start, stop = self.state.terms.key_range(partial)
+            matches = self.state.terms.indptr[stop] - self.state.terms.indptr[start]
+            scanned = total if candidates is None else len(candidates)
+            # Scanning the candidates stops once `limit` match, after about limit * scanned / matches
+            # of them; gathering the prefix's postings costs `matches`. Dense prefixes are scanned.
+            if matches * matches <= limit * scanned:
+                positions = self._prefix_postings(partial)
+                candidates = positions if candidates is None else _intersect(candidates, positions)
+                partial = None
+
+        found = []
+        remaining = limit
+        for chunk in _chunks(candidates, total, limit):
+            if partial is not None:
+                chunk = chunk[self._have_prefix(chunk, partial)]
+            if self._removed:
+                chunk = chunk[~np.isin(chunk, np.fromiter(self._removed, dtype=np.int64))]
+            if year_from is not None or year_to is not None:
+                years = self._years(chunk)
+                keep = years != MISSING_YEAR
+                if year_from is not None:
+                    keep &= years >= year_from
+                if year_to is not None:
+                    keep &= years <= year_to
+                chunk = chunk[keep]
+            found.extend(chunk[:remaining].tolist())
+            remaining = limit - len(found)
+            if remaining <= 0:
+                break
+        return [self._book(position) for position in found]
+
+    def stats(self):
+        """
+        Report the size of the index.
+
+        Returns:
+        dict: The number of indexed `books`, `terms` and `genres`, the books in the
+        `overlay` and `removed` since the last build, and the `bytes` of the arrays.
+        """
+        state = self.state
+        if state is None:
+            return {"books": 0, "terms": 0, "genres": 0, "overlay": 0, "removed": 0, "bytes": 0}
+        return {
+            "books": len(state.ids) + len(self._overlay) - len(self._removed),
+            "terms": len(state.terms),
+            "genres": len(state.genres),
+            "overlay": len(self._overlay),
+            "removed": len(self._removed),
+            "bytes": state.ids.nbytes + state.titles.nbytes + state.authors.nbytes + state.years.nbytes
+            + state.ratings.nbytes + state.terms.nbytes + state.genres.nbytes,
+        }
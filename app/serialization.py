@@ -0,0 +1,115 @@
+"""
+serialization.py
+================
+
+This module provides the JSON encoding used by the read endpoints in `app.main`.
+
+Responses are encoded with orjson instead of being passed through FastAPI's
+`jsonable_encoder` and the standard library encoder. The hot read paths also skip
+response model validation: stored documents were validated when they were written, so
+they are only cut down to the model's fields, and MongoDB is asked for those fields
+alone. Recommendation frames are encoded from their columns rather than converted to
+records through pandas.
+
+Classes
+-------
+- `FastJSONResponse` : A JSON response encoded with orjson.
+
+Functions
+---------
+- `dumps` : Encode a value as JSON bytes.
+- `model_projection` : MongoDB projection for a pydantic model's fields.
+- `project_documents` : Cut documents down to a pydantic model's fields.
+- `frame_records` : Convert a DataFrame to a list of records, column by column.
+"""
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    """
+    Encode the values orjson does not know natively.
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if hasattr(value, "item"):
+        # NumPy scalars of types orjson does not serialize, e.g. float16
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value):
+    """
+    Encode a value as JSON.
+
+    NumPy arrays and scalars are encoded natively, ObjectIds as strings, and NaN as null.
+
+    Parameters:
+    value: The value to encode.
+
+    Returns:
+    bytes: The UTF-8 encoded JSON.
+    """
+    return orjson.dumps(value, default=_default, option=OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSON response encoded with `dumps`.
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+def model_projection(model):
+    """
+    Build the MongoDB projection for a pydantic model's fields.
+
+    `_id` is included, as pagination needs it.
+
+    Parameters:
+    model: The pydantic model class.
+
+    Returns:
+    dict: The projection.
+    """
+    return {field: 1 for field in model.model_fields}
+
+
+def project_documents(documents, model):
+    """
+    Cut documents down to a pydantic model's fields, without validating them.
+
+    Parameters:
+    documents (list): The documents, as read from MongoDB.
+    model: The pydantic model class.
+
+    Returns:
+    list: One dictionary per document with exactly the model's fields, missing ones
+    set to None.
+    """
+    fields = tuple(model.model_fields)
+    return [{field: document.get(field) for field in fields} for document in documents]
+
+
+def frame_records(frame):
+    """
+    Convert a DataFrame to a list of records.
+
+    Each column is converted to Python values in one call, which is much faster than
+    `DataFrame.to_dict(orient="records")` boxing every cell separately.
+
+    Parameters:
+    frame (pd.DataFrame): The frame to convert. Its index is not included.
+
+    Returns:
+    list: One dictionary per row, keyed by column name.
+    """
+    columns = [str(column) for column in frame.columns]
+    values = [frame[column].tolist() for column in frame.columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
@@ -0,0 +1,135 @@
+"""
+snapshot.py
+===========
+
+This module persists the recommender's fitted state to disk so that workers can start
+without rescanning MongoDB.
+
+A snapshot is a directory of `.npy` arrays plus a `meta.json` file. Each build is written
+to its own directory and published by atomically replacing a `CURRENT` pointer file, so
+readers never observe a half-written snapshot. Arrays are loaded with copy-on-write
+memory mapping: workers on the same host share the page cache for the snapshot, and a
+worker only gets private pages for the rows it later modifies.
+
+Functions
+---------
+- `write_snapshot` : Write and publish a new snapshot.
+- `read_snapshot` : Memory-map the current snapshot, if it is compatible.
+- `build_lock` : Serialize snapshot builds between processes on one host.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+
+SNAPSHOT_VERSION = 2
+POINTER_FILE = "CURRENT"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+
+def write_snapshot(directory, arrays, meta):
+    """
+    Write a snapshot and make it the current one.
+
+    Parameters:
+    directory (str): The snapshot root directory.
+    arrays (dict of str to np.ndarray): Arrays to store, by name.
+    meta (dict): JSON-serializable metadata stored alongside the arrays.
+
+    Returns:
+    str: The path of the published snapshot.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"snapshot-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(path, f"{array_name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+    with open(os.path.join(path, META_FILE), "w") as meta_file:
+        json.dump({**meta, "version": SNAPSHOT_VERSION, "arrays": sorted(arrays), "created_at": time.time()}, meta_file)
+
+    previous = _current_name(directory)
+    pointer = os.path.join(directory, f".{POINTER_FILE}.{name}")
+    with open(pointer, "w") as pointer_file:
+        pointer_file.write(name)
+    os.replace(pointer, os.path.join(directory, POINTER_FILE))
+
+    # Readers that already mapped the old arrays keep them; unlinking does not unmap them
+    if previous and previous != name:
+        shutil.rmtree(os.path.join(directory, previous), ignore_errors=True)
+    return path
+
+
+def read_snapshot(directory):
+    """
+    Load the current snapshot with copy-on-write memory-mapped arrays.
+
+    Parameters:
+    directory (str): The snapshot root directory.
+
+    Returns:
+    tuple or None: `(arrays, meta)`, or None if there is no snapshot or its format
+    version does not match `SNAPSHOT_VERSION`.
+    """
+    name = _current_name(directory)
+    if name is None:
+        return None
+    path = os.path.join(directory, name)
+    try:
+        with open(os.path.join(path, META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            logging.info("Ignoring recommender snapshot with format version %s", meta.get("version"))
+            return None
+        arrays = {
+            array_name: np.load(os.path.join(path, f"{array_name}.npy"), mmap_mode="c", allow_pickle=False)
+            for array_name in meta["arrays"]
+        }
+    except (OSError, ValueError, KeyError) as error:
+        logging.warning("Unable to read recommender snapshot %s: %s", path, error)
+        return None
+    return arrays, meta
+
+
+@contextlib.contextmanager
+def build_lock(directory):
+    """
+    Hold an exclusive lock on the snapshot directory.
+
+    Workers that start together take turns, so only the first one rebuilds a stale
+    snapshot and the others load the result. Without `fcntl` this is a no-op.
+
+    Parameters:
+    directory (str): The snapshot root directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _current_name(directory):
+    try:
+        with open(os.path.join(directory, POINTER_FILE)) as pointer_file:
+            return pointer_file.read().strip() or None
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,273 @@
+"""
+sync.py
+=======
+
+This module keeps each worker's recommender in step with writes made by other workers.
+
+Every book and review write ends in `merged_review` (see `app.pipelines`), so that
+collection alone is followed. `ChangeFeed` reads its MongoDB change stream and passes
+the changed documents to a callback in coalesced micro-batches. Changes arriving within
+`batch_seconds` of the first one, up to `batch_size` books, are applied together, with
+only the latest version of each book. Whole documents are passed rather than deltas, so
+a worker receiving its own writes back, or a change applied twice, changes nothing.
+
+Change streams need a replica set or a sharded cluster. Against a standalone server or
+an in-memory stand-in, the feed polls instead. Every `poll_seconds` it reads the
+documents whose `updated_at` is at or after the newest one seen, less
+`POLL_OVERLAP_SECONDS` for writes that committed out of timestamp order. `updated_at`
+does not record deletions, so every `reconcile_seconds` the polling feed also compares
+the IDs in the collection with the previous ones.
+
+Classes
+-------
+- `ChangeFeed` : Follows a collection and applies its changes in micro-batches.
+
+Constants
+---------
+- `CHANGE_STREAM_PIPELINE` : The change stream events that are followed.
+- `POLL_OVERLAP_SECONDS` : How far before the watermark each poll reads.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+
+import numpy as np
+from pymongo.errors import OperationFailure, PyMongoError
+
+CHANGE_STREAM_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+POLL_OVERLAP_SECONDS = 1.0
+# Raised when a resume token has fallen off the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+class ChangeFeed:
+    """
+    Follows a collection and applies its changes in micro-batches.
+    """
+
+    def __init__(self, collection, apply, resync=None, projection=None, mode="auto", batch_seconds=0.1,
+                 batch_size=1000, poll_seconds=1.0, reconcile_seconds=60.0):
+        """
+        Configure the feed. Nothing is read until `start`.
+
+        Parameters:
+        collection: The Motor collection to follow.
+        apply (callable): Coroutine function called with a list of changed documents and a
+            list of removed document IDs.
+        resync (callable): Coroutine function called to reload everything when the change
+            stream cannot be resumed, or None.
+        projection (dict): The fields of the changed documents to read when polling.
+        mode (str): 'watch' for change streams, 'poll' for polling, or 'auto' to use
+            change streams where the server supports them.
+        batch_seconds (float): How long changes are collected before they are applied.
+        batch_size (int): Number of changed documents that are applied at once, at most.
+        poll_seconds (float): Interval between polls, and between attempts to reopen a
+            failed change stream.
+        reconcile_seconds (float): Interval between deletion checks when polling.
+        """
+        if mode not in ("auto", "watch", "poll"):
+            raise ValueError(f"Unknown change feed mode '{mode}'")
+        self.collection = collection
+        self.apply = apply
+        self.resync = resync
+        self.projection = projection
+        self.mode = mode
+        self.batch_seconds = batch_seconds
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.reconcile_seconds = reconcile_seconds
+        self.source = None  # 'change_stream' or 'polling' once started
+        self._task = None
+        self._watermark = None
+        self._recent = {}  # Documents read at or after the watermark, by ID -> updated_at
+        self._ids = None
+        self._reconciled_at = None
+        self._stats = {
+            'batches': 0,
+            'changes': 0,
+            'removals': 0,
+            'resyncs': 0,
+            'errors': 0,
+            'apply_seconds': 0.0,
+            'last_applied': None,
+        }
+
+    async def start(self):
+        """
+        Start following the collection in a background task.
+
+        Changes are followed from the moment this returns, so a model loaded afterwards
+        misses nothing.
+
+        Raises:
+        RuntimeError: If change streams were requested and the server does not support them.
+        """
+        if self.mode != "poll":
+            operation_time = await self._operation_time()
+            if operation_time is not None:
+                self.source = "change_stream"
+                self._task = asyncio.get_running_loop().create_task(self._follow(operation_time))
+                return
+            if self.mode == "watch":
+                raise RuntimeError("Change streams need a replica set or a sharded cluster")
+            logging.info("Change streams are unavailable, polling %s for changes", self.collection.name)
+        self.source = "polling"
+        self._watermark = await self._newest_update()
+        self._ids = await self._current_ids()
+        self._reconciled_at = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._poll())
+
+    def close(self):
+        """
+        Stop following the collection.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        """
+        Report the feed's counters.
+
+        Returns:
+        dict: The `source` followed, the number of `batches` applied with their
+        `changes` and `removals` and the seconds spent applying them, the number of
+        `resyncs` and read `errors`, and the seconds since the last batch.
+        """
+        last_applied = self._stats['last_applied']
+        return {
+            **self._stats,
+            'source': self.source,
+            'last_applied': None if last_applied is None else time.monotonic() - last_applied,
+        }
+
+    async def _operation_time(self):
+        """
+        Return the server's current operation time, or None if it has no change streams.
+        """
+        try:
+            reply = await self.collection.database.command("ping")
+        except (PyMongoError, NotImplementedError):
+            return None
+        # Only replica set members and mongos report an operation time
+        return reply.get("operationTime") if isinstance(reply, dict) else None
+
+    async def _apply(self, documents, removed_ids):
+        if not documents and not removed_ids:
+            return
+        started = time.perf_counter()
+        for start in range(0, max(len(documents), 1), self.batch_size):
+            await self.apply(documents[start:start + self.batch_size], removed_ids if start == 0 else [])
+        self._stats['batches'] += 1
+        self._stats['changes'] += len(documents)
+        self._stats['removals'] += len(removed_ids)
+        self._stats['apply_seconds'] += time.perf_counter() - started
+        self._stats['last_applied'] = time.monotonic()
+
+    async def _follow(self, start_at):
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(
+                    CHANGE_STREAM_PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    start_at_operation_time=None if resume_token is not None else start_at,
+                    max_await_time_ms=max(int(self.batch_seconds * 1000), 1),
+                ) as stream:
+                    while stream.alive:
+                        changes = await self._next_batch(stream)
+                        if stream.resume_token is not None:
+                            resume_token = stream.resume_token
+                        # Deletions, and updates of since-deleted documents, have no document
+                        await self._apply(
+                            [document for document in changes.values() if document is not None],
+                            [book_id for book_id, document in changes.items() if document is None],
+                        )
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as exc:
+                self._stats['errors'] += 1
+                if exc.code != CHANGE_STREAM_HISTORY_LOST:
+                    logging.exception("The %s change stream failed", self.collection.name)
+                else:
+                    logging.warning("The %s change stream cannot be resumed, reloading", self.collection.name)
+                    resume_token = None
+                    start_at = await self._operation_time()
+                    if self.resync is not None:
+                        await self.resync()
+                    self._stats['resyncs'] += 1
+            except PyMongoError:
+                self._stats['errors'] += 1
+                logging.exception("The %s change stream failed", self.collection.name)
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _next_batch(self, stream):
+        """
+        Collect the changes that arrive within `batch_seconds` of the first one.
+
+        Returns:
+        dict: The latest full document of each changed ID, or None for removed ones.
+        """
+        changes = {}
+        deadline = None
+        while stream.alive and len(changes) < self.batch_size:
+            # Waits up to `batch_seconds` for a change on the server
+            change = await stream.try_next()
+            if change is not None:
+                changes[str(change["documentKey"]["_id"])] = change.get("fullDocument")
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_seconds
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return changes
+
+    async def _newest_update(self):
+        newest = await self.collection.find_one(
+            {"updated_at": {"$exists": True}}, {"updated_at": 1}, sort=[("updated_at", -1)]
+        )
+        return None if newest is None else newest["updated_at"]
+
+    async def _current_ids(self):
+        ids = [str(document["_id"]).encode() async for document in self.collection.find({}, {"_id": 1})]
+        return np.array(ids, dtype="S") if ids else np.array([], dtype="S1")
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self.poll()
+            except PyMongoError:
+                self._stats['errors'] += 1
+                logging.exception("Polling %s for changes failed", self.collection.name)
+
+    async def poll(self):
+        """
+        Read and apply the documents updated since the last poll, and the deletions since
+        the last reconciliation when it is due.
+        """
+        if self._watermark is None:
+            query = {"updated_at": {"$exists": True}}
+        else:
+            query = {"updated_at": {"$gte": self._watermark - datetime.timedelta(seconds=POLL_OVERLAP_SECONDS)}}
+        changed = []
+        recent = {}
+        async for document in self.collection.find(query, self.projection).sort("updated_at", 1):
+            key, updated_at = str(document["_id"]), document["updated_at"]
+            recent[key] = updated_at
+            # Documents in the overlap window are read again; skip those already applied
+            if self._recent.get(key) != updated_at:
+                changed.append(document)
+            if self._watermark is None or updated_at > self._watermark:
+                self._watermark = updated_at
+        self._recent = recent
+
+        removed = []
+        if time.monotonic() - self._reconciled_at >= self.reconcile_seconds:
+            ids = await self._current_ids()
+            removed = [book_id.decode() for book_id in np.setdiff1d(self._ids, ids)]
+            self._ids = ids
+            self._reconciled_at = time.monotonic()
+        await self._apply(changed, removed)
@@ -0,0 +1,80 @@
+"""
+batch_recommendations.py
+========================
+
+Compares `BookRecommender.recommend_many` against one `recommend_books` call per query
+on a synthetic in-memory catalog, and prints the timings as JSON.
+
+Usage
+-----
+    python -m benchmarks.batch_recommendations --books 100000 --queries 200
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.recommender import BookRecommender
+
+
+def synthetic_catalog(num_books, num_genres=500, seed=0):
+    """
+    Generate a catalog shaped like `merged_review`.
+
+    Args:
+        num_books (int): Number of books to generate.
+        num_genres (int): Size of the genre vocabulary.
+        seed (int): Random seed.
+
+    Returns:
+        pd.DataFrame: Books with `title`, stringified `genre` lists and `average_rating`.
+    """
+    rng = np.random.default_rng(seed)
+    genres = [f"Genre {i}" for i in range(num_genres)]
+    return pd.DataFrame({
+        "title": [f"Book {i}" for i in range(num_books)],
+        "genre": [str([genres[g] for g in rng.choice(num_genres, size=rng.integers(1, 8), replace=False)]) for _ in range(num_books)],
+        "average_rating": rng.uniform(2.0, 5.0, size=num_books).round(2),
+    })
+
+
+async def run(num_books, num_queries):
+    catalog = synthetic_catalog(num_books)
+    recommender = BookRecommender()
+
+    async def load_data():
+        return catalog.copy()
+
+    recommender.load_data = load_data
+    await recommender.prepare_data()
+
+    queries = [{"title": f"Book {i}", "num_recommendations": 10} for i in range(num_queries)]
+
+    started = time.perf_counter()
+    for query in queries:
+        await recommender.recommend_books_by_title(query["title"], num_recommendations=10)
+    sequential = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await recommender.recommend_many(queries)
+    batched = time.perf_counter() - started
+
+    return {
+        "books": num_books,
+        "queries": num_queries,
+        "sequential_seconds": sequential,
+        "batch_seconds": batched,
+        "speedup": sequential / batched,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch vs. per-query recommendation throughput.")
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.books, args.queries)), indent=2))
@@ -0,0 +1,66 @@
+"""
+candidate_indexes.py
+====================
+
+Compares the recommender's candidate indexes on a synthetic in-memory catalog: build
+time, mean query latency and recall@k against brute force. Prints the results as JSON.
+
+Usage
+-----
+    python -m benchmarks.candidate_indexes --books 1000000 --queries 200 --k 10
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from app.indexes import INDEXES
+from app.recommender import BookRecommender, recall_at_k, score
+from benchmarks.batch_recommendations import synthetic_catalog
+
+
+async def run(num_books, num_queries, k):
+    catalog = synthetic_catalog(num_books)
+    rng = np.random.default_rng(1)
+    results = []
+    for name in INDEXES:
+        recommender = BookRecommender(index=name, training_executor='thread')
+
+        async def load_data():
+            return catalog.copy()
+
+        recommender.load_data = load_data
+        started = time.perf_counter()
+        await recommender.prepare_data()
+        build_seconds = time.perf_counter() - started
+
+        view = recommender._view()
+        queries = [
+            sorted(rng.choice(len(recommender.vocabulary), size=rng.integers(1, 4), replace=False).tolist())
+            for _ in range(num_queries)
+        ]
+        started = time.perf_counter()
+        for genre_ids in queries:
+            score(view, genre_ids, 0.0, k)
+        query_seconds = (time.perf_counter() - started) / num_queries
+
+        results.append({
+            "index": name,
+            "build_seconds": build_seconds,
+            "query_ms": query_seconds * 1000,
+            f"recall@{k}": recall_at_k(view, queries, k),
+        })
+        recommender.close()
+    return {"books": num_books, "queries": num_queries, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Candidate index build time, latency and recall@k.")
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.books, args.queries, args.k)), indent=2))
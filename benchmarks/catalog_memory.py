@@ -0,0 +1,125 @@
+"""
+catalog_memory.py
+=================
+
+Measures the memory the recommender holds for a synthetic `merged_review` collection,
+against a pandas DataFrame of the full documents, which is how the recommender used to
+keep its books. Allocations are traced with `tracemalloc`, and the results are printed
+as JSON, in megabytes.
+
+`model_mb` covers everything the recommender keeps: the catalog, the genre matrix, the
+title index and the candidate index.
+
+Usage
+-----
+    python -m benchmarks.catalog_memory --books 1000000
+"""
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import tracemalloc
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from app.recommender import BookRecommender
+
+MB = 1024 * 1024
+
+
+def synthetic_documents(num_books, num_genres=500, seed=0):
+    """
+    Generate documents shaped like the ones `refresh_merged_review` writes.
+
+    Args:
+        num_books (int): Number of books to generate.
+        num_genres (int): Size of the genre vocabulary.
+        seed (int): Random seed.
+
+    Yields:
+        dict: One `merged_review` document.
+    """
+    rng = np.random.default_rng(seed)
+    genres = [f"Genre {i}" for i in range(num_genres)]
+    updated_at = datetime.datetime(2024, 1, 1)
+    for i in range(num_books):
+        review_count = int(rng.integers(0, 200))
+        rating_sum = float(rng.uniform(1.0, 5.0) * review_count)
+        title = f"Book {i}"
+        yield {
+            "_id": ObjectId(),
+            "title": title,
+            "title_key": title.lower(),
+            "author": f"Author {i % 50000}",
+            "year_published": int(rng.integers(1900, 2024)),
+            "genre": [genres[g] for g in rng.choice(num_genres, size=rng.integers(1, 8), replace=False)],
+            "review_count": review_count,
+            "rating_sum": rating_sum,
+            "updated_at": updated_at,
+            "average_rating": rating_sum / review_count if review_count else None,
+        }
+
+
+class _Collection:
+    """
+    Stand-in for `merged_review_collection` that serves generated documents.
+    """
+
+    def __init__(self, num_books):
+        self.num_books = num_books
+
+    async def find(self, query, projection):
+        for document in synthetic_documents(self.num_books):
+            yield {field: document[field] for field in projection if field in document}
+
+
+def traced(function):
+    """
+    Run a function under `tracemalloc`.
+
+    Returns:
+        tuple: The function's result, the megabytes still allocated afterwards and the
+        peak megabytes allocated while it ran.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current / MB, peak / MB
+
+
+def run(num_books):
+    df, df_mb, df_peak_mb = traced(lambda: pd.DataFrame(list(synthetic_documents(num_books))))
+    del df
+
+    recommender = BookRecommender(training_executor='thread')
+
+    def train():
+        with patch("app.recommender.merged_review_collection", _Collection(num_books)):
+            asyncio.run(recommender.prepare_data())
+
+    _, model_mb, model_peak_mb = traced(train)
+    features = recommender.features
+    return {
+        "books": num_books,
+        "documents_dataframe_mb": df_mb,
+        "documents_dataframe_peak_mb": df_peak_mb,
+        "model_mb": model_mb,
+        "model_peak_mb": model_peak_mb,
+        "catalog_mb": recommender.catalog.nbytes / MB,
+        "genre_matrix_mb": (features.data.nbytes + features.indices.nbytes + features.indptr.nbytes) / MB,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommender memory against a DataFrame of documents.")
+    parser.add_argument("--books", type=int, default=1_000_000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.books), indent=2))
@@ -0,0 +1,496 @@
+"""
+suite.py
+========
+
+A reproducible performance baseline for the API and the recommender.
+
+For each catalog size, the suite generates books, reviews and their `merged_review`
+documents, loads them into a database, and measures:
+
+- `prepare_data`: training time, and the memory the trained model holds and peaks at.
+- `recommend_books` and `recommend_books_by_title`: latency percentiles of sequential
+  queries, with the recommender's result cache disabled.
+- Neighbor lists: the time to precompute every book's recommendations, and the latency
+  of `recommend_books_by_title` served from them.
+- `SearchIndex`: build time and memory, and latency percentiles of autocomplete, whole
+  word and genre- and year-filtered searches.
+- `GET /books`, `GET /books/{id}` and `GET /reviews/{book_id}`: throughput and latency
+  percentiles under concurrent load, driven in-process through the ASGI app.
+- Bulk ingest: records per second for books and reviews through `app.ingest.ingest`.
+
+Results are printed, or written with `--output`, as JSON together with the commit they
+were measured at, so runs can be compared between commits. Latencies are in
+milliseconds and memory in megabytes.
+
+By default the suite runs against an in-memory stand-in for MongoDB (mongomock-motor),
+so it needs no server. The stand-in runs every query synchronously in Python, so its
+numbers track the application's own cost rather than the database's, and concurrent
+requests do not overlap their queries. It has no indexes either, so each API query
+scans its collection: on the stand-in, only the first `STAND_IN_API_BOOKS` books of a
+catalog are written to `books` and `reviews`, while `merged_review` and the recommender
+get all of them. Nor can it run the `$lookup` pipeline behind `refresh_merged_review`,
+so during ingest the refresh is done by an equivalent Python function. Pass `--backend mongo` to measure against the server configured by
+`MONGO_DETAILS` instead; the collections of `MONGO_DATABASE`, which defaults to
+"BooksLibraryBenchmark" here, are dropped and regenerated.
+
+Usage
+-----
+    python -m benchmarks.suite --books 10000 100000 --output baseline.json
+    python -m benchmarks.suite --books 1000000 --requests 2000 --concurrency 32
+    MONGO_DETAILS=mongodb://localhost:27017 python -m benchmarks.suite --backend mongo
+"""
+
+import argparse
+import asyncio
+import datetime
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext
+from unittest.mock import patch
+
+import numpy as np
+from bson import ObjectId
+
+BACKENDS = ("stand-in", "mongo")
+INSERT_CHUNK_SIZE = 10000
+# The stand-in has no indexes, so every API query scans its collection
+STAND_IN_API_BOOKS = 10000
+MB = 1024 * 1024
+
+
+def install_stand_in():
+    """
+    Replace Motor's client with mongomock-motor's, so `app.database` connects to an
+    in-memory database. Must run before anything from `app` is imported.
+    """
+    import motor.motor_asyncio
+    from mongomock.collection import Cursor
+    from mongomock_motor import AsyncMongoMockClient
+
+    def next_document(cursor):
+        # mongomock slices its whole result list again for every document it returns,
+        # which makes reading a large collection quadratic, so the slice is kept
+        results = cursor._compute_results()
+        key = (id(results), cursor._skip, cursor._limit)
+        if cursor.__dict__.get("_window_key") != key:
+            cursor._window = cursor._compute_results(with_limit_and_skip=True)
+            cursor._window_key = key
+        if cursor._emitted >= len(cursor._window):
+            raise StopIteration()
+        cursor._emitted += 1
+        return cursor._window[cursor._emitted - 1]
+
+    Cursor.__next__ = next_document
+
+    class StandInClient(AsyncMongoMockClient):
+        def __init__(self, host=None, event_listeners=None, **options):
+            super().__init__()
+
+        @property
+        def options(self):
+            return None
+
+        def close(self):
+            pass
+
+    motor.motor_asyncio.AsyncIOMotorClient = StandInClient
+
+
+async def refresh_merged_review_stand_in(book_ids=None):
+    """
+    Python equivalent of `app.pipelines.refresh_merged_review`, for the stand-in.
+    """
+    from app.database import books_collection, merged_review_collection, reviews_collection
+    from app.pipelines import GENRE_TRIM_CHARS
+
+    query = {} if book_ids is None else {"_id": {"$in": list(book_ids)}}
+    books = await books_collection.find(query).to_list(None)
+    stats = {}
+    async for review in reviews_collection.find({"book_id": {"$in": [book["_id"] for book in books]}}):
+        count, total = stats.get(review["book_id"], (0, 0.0))
+        stats[review["book_id"]] = (count + 1, total + review["rating"])
+    documents = []
+    for book in books:
+        count, total = stats.get(book["_id"], (0, 0.0))
+        genre = book.get("genre")
+        if not isinstance(genre, list):
+            genre = [name.strip(GENRE_TRIM_CHARS) for name in str(genre or "").split(",")]
+        documents.append({
+            "_id": book["_id"],
+            "title": book["title"],
+            "title_key": book["title"].lower(),
+            "author": book.get("author"),
+            "year_published": book.get("year_published"),
+            "genre": [name for name in genre if name],
+            "review_count": count,
+            "rating_sum": total,
+            "average_rating": total / count if count else None,
+            "updated_at": datetime.datetime.utcnow(),
+        })
+    if documents:
+        await merged_review_collection.delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+        await merged_review_collection.insert_many(documents)
+
+
+def generate_books(num_books, reviews_per_book=2, num_genres=500, seed=0):
+    """
+    Generate books, their reviews and their `merged_review` documents, in chunks.
+
+    Args:
+        num_books (int): Number of books to generate.
+        reviews_per_book (int): Average number of reviews per book.
+        num_genres (int): Size of the genre vocabulary.
+        seed (int): Random seed.
+
+    Yields:
+        tuple: Lists of `books`, `reviews` and `merged_review` documents for up to
+        `INSERT_CHUNK_SIZE` books.
+    """
+    rng = np.random.default_rng(seed)
+    genres = [f"Genre {i}" for i in range(num_genres)]
+    updated_at = datetime.datetime(2024, 1, 1)
+    for start in range(0, num_books, INSERT_CHUNK_SIZE):
+        books, reviews, merged = [], [], []
+        for i in range(start, min(start + INSERT_CHUNK_SIZE, num_books)):
+            book_id = ObjectId()
+            names = [genres[g] for g in rng.choice(num_genres, size=rng.integers(1, 8), replace=False)]
+            book = {
+                "_id": book_id,
+                "title": f"Book {i}",
+                "author": f"Author {i % 50000}",
+                "genre": ", ".join(names),
+                "year_published": int(rng.integers(1900, 2024)),
+                "summary": f"Summary of book {i}.",
+            }
+            ratings = rng.integers(1, 6, size=rng.poisson(reviews_per_book)).tolist()
+            reviews += [
+                {"_id": ObjectId(), "book_id": book_id, "user_id": f"user{j}", "review_text": "A review.", "rating": float(rating)}
+                for j, rating in enumerate(ratings)
+            ]
+            books.append(book)
+            merged.append({
+                "_id": book_id,
+                "title": book["title"],
+                "title_key": book["title"].lower(),
+                "author": book["author"],
+                "year_published": book["year_published"],
+                "genre": names,
+                "review_count": len(ratings),
+                "rating_sum": float(sum(ratings)),
+                "average_rating": sum(ratings) / len(ratings) if ratings else None,
+                "updated_at": updated_at,
+            })
+        yield books, reviews, merged
+
+
+def percentiles(latencies):
+    """
+    Summarize latencies, given in seconds, in milliseconds.
+    """
+    values = np.asarray(latencies) * 1000
+    if not len(values):
+        return {}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "mean_ms": values.mean(), "max_ms": values.max()}
+
+
+async def seed(num_books, api_books, reviews_per_book):
+    """
+    Replace the collections' contents with a generated catalog.
+
+    Args:
+        num_books (int): Books written to `merged_review`, which the recommender reads.
+        api_books (int): How many of them are also written, with their reviews, to
+            `books` and `reviews`, which the API reads.
+        reviews_per_book (int): Average number of reviews per book.
+
+    Returns:
+        tuple: The IDs of the books in `books`, and the titles of all books.
+    """
+    from app.database import books_collection, merged_review_collection, reviews_collection
+
+    for collection in (books_collection, reviews_collection, merged_review_collection):
+        await collection.delete_many({})
+    book_ids, titles = [], []
+    for books, reviews, merged in generate_books(num_books, reviews_per_book):
+        await merged_review_collection.insert_many(merged)
+        titles += [book["title"] for book in books]
+        books = books[:max(api_books - len(book_ids), 0)]
+        if books:
+            kept = {book["_id"] for book in books}
+            await books_collection.insert_many(books)
+            reviews = [review for review in reviews if review["book_id"] in kept]
+            if reviews:
+                await reviews_collection.insert_many(reviews)
+            book_ids += [book["_id"] for book in books]
+    return book_ids, titles
+
+
+async def bench_prepare_data():
+    """
+    Train a recommender from `merged_review`, timed, then again under `tracemalloc`,
+    which slows allocation too much to time the same run.
+
+    Returns:
+        tuple: The trained recommender and its measurements.
+    """
+    from app.recommender import BookRecommender
+
+    recommender = BookRecommender(training_executor="thread", result_cache_size=0)
+    started = time.perf_counter()
+    await recommender.prepare_data()
+    seconds = time.perf_counter() - started
+
+    traced_recommender = BookRecommender(training_executor="thread")
+    gc.collect()
+    tracemalloc.start()
+    await traced_recommender.prepare_data()
+    gc.collect()
+    model, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    traced_recommender.close()
+    return recommender, {"seconds": seconds, "model_mb": model / MB, "peak_mb": peak / MB, "books": len(recommender.catalog)}
+
+
+async def bench_recommendations(recommender, titles, queries, rng):
+    """
+    Time sequential genre and title queries against a trained recommender.
+    """
+    vocabulary = list(recommender.vocabulary.names)
+    genre_latencies, title_latencies = [], []
+    for _ in range(queries):
+        genres = rng.sample(vocabulary, rng.randint(1, 3))
+        min_rating = rng.choice((0.0, 3.5, 4.0))
+        started = time.perf_counter()
+        await recommender.recommend_books(genres, min_rating=min_rating, num_recommendations=10)
+        genre_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await recommender.recommend_books_by_title(rng.choice(titles), min_rating=min_rating, num_recommendations=10)
+        title_latencies.append(time.perf_counter() - started)
+    return {
+        "recommend_books": {"queries": queries, **percentiles(genre_latencies)},
+        "recommend_books_by_title": {"queries": queries, **percentiles(title_latencies)},
+    }
+
+
+async def bench_neighbors(recommender, titles, queries, rng, workers=None):
+    """
+    Precompute the recommender's neighbor lists across a process pool, timed, then time
+    sequential title queries served from them.
+    """
+    recommender.neighbors = 10
+    recommender.training_executor = "process"
+    recommender.neighbor_workers = workers
+    started = time.perf_counter()
+    await recommender.refresh_neighbors()
+    seconds = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(queries):
+        title = rng.choice(titles)
+        started = time.perf_counter()
+        await recommender.recommend_books_by_title(title, num_recommendations=10)
+        latencies.append(time.perf_counter() - started)
+    table = recommender.neighbor_table
+    return {
+        "refresh_seconds": seconds,
+        "genre_sets": len(table.neighbors),
+        "table_mb": table.nbytes / MB,
+        "hits": recommender.executor_stats()["neighbor_hits"],
+        "recommend_books_by_title": {"queries": queries, **percentiles(latencies)},
+    }
+
+
+async def bench_search(titles, queries, rng):
+    """
+    Build a search index from `merged_review` and time sequential searches against it.
+
+    Every generated title starts with "Book", so the one-letter prefix matches the whole
+    catalog and the filtered searches intersect it with a genre and a year range.
+    """
+    from app.search import SearchIndex
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    await index.load()
+    result = {"load_seconds": time.perf_counter() - started, "index_mb": index.stats()["bytes"] / MB}
+
+    searches = {
+        "autocomplete": lambda title: index.search(title[:rng.randint(1, len(title))]),
+        "words": lambda title: index.search(title + " "),
+        "filtered": lambda title: index.search(
+            "b", genres=[f"Genre {rng.randrange(500)}"], year_from=rng.randint(1900, 2000), year_to=2023,
+        ),
+    }
+    for name, search in searches.items():
+        latencies = []
+        for _ in range(queries):
+            title = rng.choice(titles)
+            started = time.perf_counter()
+            search(title)
+            latencies.append(time.perf_counter() - started)
+        result[name] = {"queries": queries, **percentiles(latencies)}
+    return result
+
+
+async def load(client, paths, concurrency):
+    """
+    Issue GET requests from `concurrency` concurrent clients.
+
+    Returns:
+        dict: Throughput, latency percentiles and the count of each response status.
+    """
+    pending = iter(paths)
+    latencies, statuses = [], {}
+
+    async def worker():
+        for path in pending:
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "requests_per_second": len(latencies) / elapsed,
+        **percentiles(latencies),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def bench_http(book_ids, requests, concurrency, rng):
+    """
+    Load the read endpoints through the ASGI app. The entity cache is cleared before
+    each endpoint, so repeated IDs are served from it as they would be in production.
+    """
+    import httpx
+
+    from app.main import app, entity_cache
+
+    def sample_ids():
+        return [rng.choice(book_ids) for _ in range(requests)]
+
+    endpoints = {
+        "get_books": ["/books?limit=100"] + [f"/books?limit=100&after={book_id}" for book_id in sample_ids()[1:]],
+        "get_book": [f"/books/{book_id}" for book_id in sample_ids()],
+        "get_reviews": [f"/reviews/{book_id}" for book_id in sample_ids()],
+    }
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        for name, paths in endpoints.items():
+            entity_cache.local.clear()
+            results[name] = await load(client, paths, concurrency)
+    return results
+
+
+async def bench_ingest(book_ids, records, rng):
+    """
+    Bulk-import generated books, then reviews of existing books, from NDJSON.
+    """
+    from app.ingest import iter_records, ingest
+
+    books = "".join(
+        json.dumps({"title": f"Imported {i}", "author": "Author", "genre": "Genre 1, Genre 2", "year_published": 2000, "summary": "Imported."}) + "\n"
+        for i in range(records)
+    )
+    reviews = "".join(
+        json.dumps({"book_id": str(rng.choice(book_ids)), "user_id": "importer", "review_text": "Imported.", "rating": rng.randint(1, 5)}) + "\n"
+        for _ in range(records)
+    )
+    results = {}
+    for kind, text in (("books", books), ("reviews", reviews)):
+        started = time.perf_counter()
+        report = await ingest(kind, iter_records(io.StringIO(text), "ndjson"))
+        seconds = time.perf_counter() - started
+        results[kind] = {"records": records, "inserted": report["inserted"], "seconds": seconds, "records_per_second": records / seconds}
+    return results
+
+
+async def run_catalog(num_books, args):
+    """
+    Seed a catalog of `num_books` books and run every benchmark against it.
+    """
+    rng = random.Random(args.seed)
+    api_books = min(num_books, args.api_books or (STAND_IN_API_BOOKS if args.backend == "stand-in" else num_books))
+    started = time.perf_counter()
+    book_ids, titles = await seed(num_books, api_books, args.reviews_per_book)
+    result = {"books": num_books, "api_books": api_books, "seed_seconds": time.perf_counter() - started}
+
+    recommender, result["prepare_data"] = await bench_prepare_data()
+    result.update(await bench_recommendations(recommender, titles, args.queries, rng))
+    result["neighbors"] = await bench_neighbors(recommender, titles, args.queries, rng)
+    recommender.close()
+    result["search"] = await bench_search(titles, args.queries, rng)
+    result["http"] = await bench_http(book_ids, args.requests, args.concurrency, rng)
+    result["ingest"] = await bench_ingest(book_ids, args.ingest_records, rng)
+    return result
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    # The database is chosen, and the stand-in installed, before `app` is first imported
+    os.environ.setdefault("MONGO_DATABASE", "BooksLibraryBenchmark")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.backend == "stand-in":
+        install_stand_in()
+        refresh = patch("app.ingest.refresh_merged_review", refresh_merged_review_stand_in)
+    else:
+        refresh = nullcontext()
+
+    from app.database import connect, ensure_indexes
+    if args.backend == "mongo":
+        await connect()
+        await ensure_indexes()
+
+    with refresh:
+        catalogs = [await run_catalog(num_books, args) for num_books in args.books]
+    return {
+        "commit": commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "backend": args.backend,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("books", "output")},
+        "catalogs": catalogs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API and the recommender on generated catalogs.")
+    parser.add_argument("--books", type=int, nargs="+", default=[10000, 100000], help="Catalog sizes, e.g. 10000 100000 1000000")
+    parser.add_argument("--backend", choices=BACKENDS, default="stand-in")
+    parser.add_argument("--api-books", type=int, help=f"Books served by the API, default all, or {STAND_IN_API_BOOKS} on the stand-in")
+    parser.add_argument("--reviews-per-book", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=500, help="Recommender queries per kind")
+    parser.add_argument("--requests", type=int, default=500, help="HTTP requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ingest-records", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of printing it")
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=2, default=float)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
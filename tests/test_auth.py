@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from app import auth
+from app.auth import Authenticator, MemoryUserStore, authenticator_from_environ, hash_password, verify_password
+
+# Few iterations keep the tests fast; the format and the checks are the same
+ITERATIONS = 1000
+
+
+@pytest.fixture
+def authenticator():
+    """Fixture for an authenticator over one user, with tokens enabled."""
+    store = MemoryUserStore({"Joe": hash_password("librarian", iterations=ITERATIONS)})
+    return Authenticator(store, token_secret="secret")
+
+
+def test_hash_and_verify_password():
+    """Test that hashes are salted and only match their password."""
+    password_hash = hash_password("librarian", iterations=ITERATIONS)
+
+    assert password_hash.startswith(f"pbkdf2_sha256${ITERATIONS}$")
+    assert password_hash != hash_password("librarian", iterations=ITERATIONS)
+    assert verify_password("librarian", password_hash)
+    assert not verify_password("Librarian", password_hash)
+    assert not verify_password("librarian", "md5$1$abc$def")
+    assert not verify_password("librarian", "not a hash")
+
+
+@pytest.mark.asyncio
+async def test_authenticate_caches_verified_credentials(authenticator):
+    """Test that verified credentials skip the password hash until the password changes."""
+    with patch("app.auth.verify_password", wraps=verify_password) as mock_verify:
+        assert await authenticator.authenticate("Joe", "librarian")
+        assert await authenticator.authenticate("Joe", "librarian")
+        assert mock_verify.call_count == 1
+
+        assert not await authenticator.authenticate("Joe", "wrong")
+        assert not await authenticator.authenticate("Nobody", "librarian")
+        # Unknown users are checked against a hash too, so they take as long as wrong passwords
+        assert mock_verify.call_count == 3
+
+        await authenticator.set_password("Joe", "new password")
+        assert not await authenticator.authenticate("Joe", "librarian")
+        assert await authenticator.authenticate("Joe", "new password")
+
+    stats = authenticator.stats()
+    assert (stats["cache_hits"], stats["failures"], stats["cached"]) == (1, 3, 1)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_authentications_share_verification(authenticator):
+    """Test that concurrent requests with the same credentials run one verification."""
+    results = await asyncio.gather(*(authenticator.authenticate("Joe", "librarian") for _ in range(5)))
+
+    assert results == [True] * 5
+    assert authenticator.stats()["verifications"] == 1
+    assert authenticator.stats()["coalesced"] == 4
+
+
+def test_tokens(authenticator):
+    """Test that tokens carry the username and are rejected when tampered with or expired."""
+    token = authenticator.issue_token("Joe")
+    payload, signature = token.split(".")
+
+    assert authenticator.verify_token(token) == "Joe"
+    assert authenticator.verify_token(f"{payload}x.{signature}") is None
+    assert authenticator.verify_token("garbage") is None
+    assert Authenticator(authenticator.store, token_secret="other").verify_token(token) is None
+
+    expired = Authenticator(authenticator.store, token_secret="secret", token_ttl=-1)
+    assert expired.verify_token(expired.issue_token("Joe")) is None
+
+    disabled = Authenticator(authenticator.store)
+    assert disabled.verify_token(token) is None
+    with pytest.raises(ValueError):
+        disabled.issue_token("Joe")
+
+
+def test_authenticator_from_environ():
+    """Test the user store and cache configuration from the environment."""
+    password_hash = hash_password("secret", iterations=ITERATIONS)
+    authenticator = authenticator_from_environ({"AUTH_USERS": f"Ann:{password_hash}", "AUTH_CACHE_SIZE": "0"})
+
+    assert authenticator.store.users == {"Ann": password_hash}
+    assert authenticator.stats()["cached"] == 0
+    assert authenticator.token_secret is None
+    assert set(authenticator_from_environ({}).store.users) == {auth.DEFAULT_USERNAME}
+    assert isinstance(authenticator_from_environ({"AUTH_USER_STORE": "mongo"}).store, auth.MongoUserStore)
+    with pytest.raises(ValueError, match="AUTH_USERS"):
+        authenticator_from_environ({"AUTH_USERS": "Ann"})
+    with pytest.raises(ValueError, match="user store"):
+        authenticator_from_environ({"AUTH_USER_STORE": "ldap"})
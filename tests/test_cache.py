@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from app.cache import LRUCache, MemoryBackend, ReadThroughCache, compute_etag, etag_matches
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache_eviction_and_ttl():
+    """Test that the least recently used entry is evicted and expired entries are dropped."""
+    clock = FakeClock()
+    cache = LRUCache(max_entries=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), cache.evictions) == (1, 3, 1)
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+
+def test_etag_matches():
+    """Test If-None-Match evaluation."""
+    etag = compute_etag({"title": "Book 1"})
+    assert etag == compute_etag({"title": "Book 1"})
+    assert etag != compute_etag({"title": "Book 2"})
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+
+@pytest.mark.asyncio
+async def test_read_through_with_shared_backend():
+    """Test that misses load once, and a second worker is served from the shared backend."""
+    shared = MemoryBackend()
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return {"title": "Book 1"}
+
+    worker = ReadThroughCache(LRUCache(), shared)
+    other_worker = ReadThroughCache(LRUCache(), shared)
+    entry = await worker.get("book:1", load)
+    assert await worker.get("book:1", load) == entry
+    assert await other_worker.get("book:1", load) == entry
+    assert len(loads) == 1
+    assert (worker.stats()["hits"], worker.stats()["misses"], other_worker.stats()["shared_hits"]) == (1, 1, 1)
+
+    await worker.invalidate("book:1")
+    assert await shared.get("book:1") is None
+    await worker.get("book:1", load)
+    assert len(loads) == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_load_is_not_overwritten():
+    """Test that a value loaded before a concurrent write is not cached."""
+    cache = ReadThroughCache()
+    loading = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_load():
+        loading.set()
+        await release.wait()
+        return {"title": "Old title"}
+
+    pending = asyncio.ensure_future(cache.get("book:1", slow_load))
+    await loading.wait()
+    await cache.invalidate("book:1")
+    release.set()
+    assert (await pending)["value"] == {"title": "Old title"}
+
+    async def load():
+        return {"title": "New title"}
+
+    assert (await cache.get("book:1", load))["value"] == {"title": "New title"}
+
+
+@pytest.mark.asyncio
+async def test_missing_values_are_not_cached():
+    """Test that a loader returning None is retried on the next lookup."""
+    cache = ReadThroughCache()
+
+    async def load():
+        return None
+
+    assert await cache.get("book:1", load) is None
+    assert len(cache.local) == 0
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.catalog import BookRecord, Catalog, StringColumn
+
+
+@pytest.fixture
+def columns():
+    """Fixture for loaded catalog columns."""
+    return {
+        "_id": ["id-2", "id-0", "id-1", "id-3"],
+        "title": ["Dune", "Die Verwandlung", "Cien años de soledad", None],
+        "genre": [["Science Fiction"], ["Fiction"], ["Fiction"], []],
+        "average_rating": [4.25, None, "3.9", 4.0],
+        "review_count": [12, None, 3, None],
+    }
+
+
+def test_string_column_round_trip():
+    """Test packing, patching, extending and selecting strings."""
+    column = StringColumn.from_strings(["Dune", "", "Cien años", None])
+
+    assert len(column) == 4
+    assert list(column) == ["Dune", "", "Cien años", ""]
+    assert column.offsets.tolist() == [0, 4, 4, 14, 14]
+
+    column.set(0, "Dune Messiah")
+    extended = column.extend(["Emma"])
+    assert extended.take([3, 4, 0]) == ["", "Emma", "Dune Messiah"]
+    assert column.select(np.array([True, False, True, False])).take([0, 1]) == ["Dune Messiah", "Cien años"]
+
+    packed = extended.packed()
+    assert (packed.patches, packed.appended) == ({}, ())
+    assert len(packed.buffer) == len("Dune MessiahCien añosEmma".encode())
+    assert packed.select(np.array([False, False, True, False, True])).take([0, 1]) == ["Cien años", "Emma"]
+
+
+def test_catalog_from_columns(columns):
+    """Test that loaded columns become compact, typed columns."""
+    catalog = Catalog.from_columns(columns, keep=np.array([True, True, True, False]))
+
+    assert len(catalog) == 3
+    assert catalog.ratings.dtype == np.float32
+    assert catalog.rating_counts.dtype == np.int32
+    assert catalog.ids.dtype.kind == "S"
+    assert np.isnan(catalog.ratings[1])
+    # A missing count is one rating when there is an average, and none otherwise
+    assert catalog.rating_counts.tolist() == [12, 0, 3]
+    assert catalog.titles.take([2]) == ["Cien años de soledad"]
+
+
+def test_catalog_locate(columns):
+    """Test ID lookups across appends and selections."""
+    catalog = Catalog.from_columns(columns)
+
+    assert [catalog.locate(f"id-{i}") for i in range(4)] == [1, 2, 0, 3]
+    assert catalog.locate("id-9") is None
+    assert catalog.locate("id-00") is None
+
+    extended = catalog.extend(["id-4"], ["Emma"], [4.5], [1])
+    assert len(extended) == 5
+    assert extended.locate("id-4") is None  # Appended rows are located by the recommender
+
+    selected = extended.select(np.array([False, True, True, True, True]))
+    assert selected.locate("id-4") == 3
+    assert selected.locate("id-2") is None
+
+
+def test_book_record(columns):
+    """Test that records read the catalog's current values."""
+    catalog = Catalog.from_columns(pd.DataFrame(columns))
+    book = catalog[0]
+
+    assert isinstance(book, BookRecord)
+    assert (book.id, book.title, book.average_rating, book.review_count) == ("id-2", "Dune", 4.25, 12)
+    catalog.ratings[0] = 4.5
+    assert book.average_rating == 4.5
+    with pytest.raises(AttributeError):
+        book.extra = 1
@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from pymongo import monitoring
+from pymongo.errors import ServerSelectionTimeoutError
+from app.database import PoolMetrics, client_options, connect
+
+ADDRESS = ("localhost", 27017)
+
+
+def test_client_options():
+    """Test that pool, timeout, read preference and compression options come from the environment."""
+    environ = {
+        "MONGO_MAX_POOL_SIZE": "50",
+        "MONGO_MIN_POOL_SIZE": "10",
+        "MONGO_SERVER_SELECTION_TIMEOUT_MS": "2000",
+        "MONGO_READ_PREFERENCE": "secondaryPreferred",
+        "MONGO_COMPRESSORS": "zstd,zlib",
+        "MONGO_SOCKET_TIMEOUT_MS": "",
+    }
+
+    assert client_options(environ) == {
+        "maxPoolSize": 50,
+        "minPoolSize": 10,
+        "serverSelectionTimeoutMS": 2000,
+        "readPreference": "secondaryPreferred",
+        "compressors": "zstd,zlib",
+    }
+    assert client_options({}) == {}
+    with pytest.raises(ValueError, match="MONGO_MAX_POOL_SIZE"):
+        client_options({"MONGO_MAX_POOL_SIZE": "many"})
+
+
+def test_pool_metrics():
+    """Test that pool events are summed into utilization counters."""
+    metrics = PoolMetrics()
+    metrics.pool_created(monitoring.PoolCreatedEvent(ADDRESS, {"maxPoolSize": 4}))
+    for connection_id in (1, 2):
+        metrics.connection_created(monitoring.ConnectionCreatedEvent(ADDRESS, connection_id))
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+        metrics.connection_checked_out(monitoring.ConnectionCheckedOutEvent(ADDRESS, connection_id, 0.002))
+    metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+    metrics.connection_checked_in(monitoring.ConnectionCheckedInEvent(ADDRESS, 2))
+
+    stats = metrics.stats()
+
+    assert (stats["open"], stats["in_use"], stats["idle"], stats["waiting"]) == (2, 1, 1, 1)
+    assert stats["utilization"] == 0.25
+    assert stats["mean_checkout_ms"] == pytest.approx(2.0)
+    assert (stats["servers"], stats["max_pool_size"]) == (1, 4)
+
+
+@pytest.mark.asyncio
+async def test_connect_warms_pool():
+    """Test that connect pings the server once, then once per connection to warm."""
+    with patch("app.database.client", MagicMock()) as mock_client:
+        mock_client.admin.command = AsyncMock()
+        mock_client.options.pool_options.min_pool_size = 5
+
+        await connect()
+
+        assert mock_client.admin.command.await_count == 6
+
+        mock_client.admin.command.side_effect = ServerSelectionTimeoutError("No servers")
+        with pytest.raises(ServerSelectionTimeoutError):
+            await connect(warm_connections=0)
@@ -0,0 +1,35 @@
+from app.diagnostics import hot_queries, summarize_plan
+
+
+def test_summarize_index_plan():
+    """Test summarizing a plan that uses an index."""
+    explain = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "LIMIT",
+                "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "book_id_id"}},
+            }
+        },
+        "executionStats": {"totalKeysExamined": 3, "totalDocsExamined": 3, "nReturned": 3},
+    }
+
+    summary = summarize_plan(explain)
+
+    assert summary["stages"] == ["LIMIT", "FETCH", "IXSCAN"]
+    assert summary["indexes"] == ["book_id_id"]
+    assert not summary["collscan"]
+    assert summary["docs_examined"] == summary["returned"] == 3
+
+
+def test_summarize_collscan_plan():
+    """Test that a collection scan is flagged, including in slot-based engine plans."""
+    explain = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}}}
+
+    assert summarize_plan(explain)["collscan"]
+
+
+def test_hot_queries_cover_request_path():
+    """Test that every paginated endpoint query is explained."""
+    names = {query["name"] for query in hot_queries()}
+
+    assert {"get_book", "get_books", "get_reviews"} <= names
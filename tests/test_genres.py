@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.genres import GenreVocabulary, normalize_genre_field, parse_genres
+
+
+def test_parse_genres():
+    """Test parsing stringified lists, comma-separated strings and native arrays."""
+    assert parse_genres("['Fantasy', 'Adventure']") == ["Fantasy", "Adventure"]
+    assert parse_genres("Fantasy, Science Fiction") == ["Fantasy", "Science Fiction"]
+    assert parse_genres(["Fantasy", " "]) == ["Fantasy"]
+    assert parse_genres("[]") == []
+    assert parse_genres(None) == []
+
+
+def test_parse_genres_does_not_execute_code():
+    """Test that genre strings are never evaluated as code."""
+    assert parse_genres("[__import__('os').getcwd()]") == []
+
+
+def test_genre_vocabulary():
+    """Test interning genres into dense IDs."""
+    vocabulary = GenreVocabulary(["Fantasy"])
+
+    assert vocabulary.encode(["Horror", "Fantasy", "Horror"]) == [1, 0]
+    assert vocabulary.lookup(["Horror", "Missing", "Fantasy"]) == [0, 1]
+    assert len(vocabulary) == 2
+    assert "Missing" not in vocabulary
+
+
+@pytest.mark.asyncio
+async def test_normalize_genre_field():
+    """Test that stringified genres are rewritten as native arrays in bulk."""
+    documents = [{"_id": i, "genre": "['Fantasy', 'Adventure']"} for i in range(3)]
+
+    async def iterate():
+        for document in documents:
+            yield document
+
+    cursor = MagicMock()
+    cursor.batch_size.return_value = iterate()
+    collection = MagicMock()
+    collection.find.return_value = cursor
+    collection.bulk_write = AsyncMock(side_effect=lambda updates, ordered: MagicMock(modified_count=len(updates)))
+
+    assert await normalize_genre_field(collection, batch_size=2) == 3
+    assert collection.bulk_write.await_count == 2
+    first_update = collection.bulk_write.await_args_list[0].args[0][0]
+    assert first_update._doc == {"$set": {"genre": ["Fantasy", "Adventure"]}}
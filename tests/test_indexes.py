@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from app.indexes import BruteForceIndex, InvertedIndex, LSHIndex, PostingLists, index_factory
+
+
+@pytest.fixture
+def features():
+    """Fixture for a random binary genre matrix."""
+    rng = np.random.default_rng(0)
+    rows = [rng.choice(40, size=rng.integers(1, 5), replace=False) for _ in range(2000)]
+    indptr = np.cumsum([0] + [len(row) for row in rows])
+    indices = np.concatenate(rows).astype(np.int32)
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(len(rows), 40))
+
+
+def assert_same_candidates(actual, expected):
+    np.testing.assert_array_equal(actual[0], expected[0])
+    np.testing.assert_array_equal(actual[1], expected[1])
+
+
+def test_inverted_index_matches_brute_force(features):
+    """Test that the inverted index returns exactly the brute-force candidates."""
+    brute, inverted = BruteForceIndex(features), InvertedIndex(features)
+    queries = [[3], [0, 7, 21], [39, 1], []]
+
+    for query, many in zip(queries, brute.candidates_many(queries)):
+        assert_same_candidates(inverted.candidates(query), brute.candidates(query))
+        assert_same_candidates(many, brute.candidates(query))
+
+
+def test_posting_lists_round_trip(features):
+    """Test that delta-encoded postings decode to the genre matrix's columns."""
+    columns = features.tocsc()
+    columns.sort_indices()
+
+    postings = PostingLists(columns, offset=10)
+
+    assert postings.gaps.dtype.itemsize == 1
+    assert postings.nbytes < columns.indices.nbytes + columns.indptr.nbytes
+    for genre_id in range(columns.shape[1]):
+        expected = columns.indices[columns.indptr[genre_id]:columns.indptr[genre_id + 1]] + 10
+        np.testing.assert_array_equal(postings.rows(genre_id), expected)
+    assert len(postings.rows(columns.shape[1])) == 0
+
+
+def test_rating_ordered_candidates(features):
+    """Test that a minimum rating only drops books below it, including re-rated ones."""
+    ratings = np.random.default_rng(1).uniform(1, 5, size=features.shape[0])
+    inverted = InvertedIndex(features, ratings)
+    query = [0, 7, 21]
+
+    rows, matched = inverted.candidates(query, min_rating=4.0)
+    brute_rows, brute_matched = BruteForceIndex(features).candidates(query)
+    passing = ratings[brute_rows] >= 4.0
+    assert_same_candidates((rows, matched), (brute_rows[passing], brute_matched[passing]))
+
+    low_row = brute_rows[~passing][0]
+    rerated = inverted.rerated(low_row)
+    assert low_row in rerated.candidates(query, min_rating=4.0)[0]
+    assert low_row not in inverted.candidates(query, min_rating=4.0)[0]
+
+
+def test_indexes_extend_with_appended_rows(features):
+    """Test that extended indexes cover appended rows, including new genre columns."""
+    appended = sparse.csr_matrix(([1.0, 1.0], [3, 40], [0, 1, 2]), shape=(2, 41), dtype=np.float32)
+    grown = features.copy()
+    grown.resize((features.shape[0], 41))
+    grown = sparse.vstack([grown, appended], format="csr")
+    brute = BruteForceIndex(grown)
+
+    for index in (InvertedIndex(features), LSHIndex(features)):
+        extended = index.extend(grown, features.shape[0])
+        rows, _ = extended.candidates([40])
+        assert list(rows) == [features.shape[0] + 1]
+        if isinstance(index, InvertedIndex):
+            assert_same_candidates(extended.candidates([3]), brute.candidates([3]))
+
+
+def test_lsh_candidates_are_scored_exactly(features):
+    """Test that LSH returns a subset of the brute-force candidates with exact match counts."""
+    brute, lsh = BruteForceIndex(features), LSHIndex(features, tables=16, bits=6)
+
+    rows, matched = lsh.candidates([5, 9])
+    brute_rows, brute_matched = brute.candidates([5, 9])
+
+    assert set(rows) <= set(brute_rows)
+    assert len(rows) > len(brute_rows) // 2
+    np.testing.assert_array_equal(matched, brute_matched[np.searchsorted(brute_rows, rows)])
+
+
+def test_index_factory():
+    """Test index lookup by name."""
+    assert index_factory("inverted") is InvertedIndex
+    with pytest.raises(ValueError):
+        index_factory("faiss")
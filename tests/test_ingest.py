@@ -0,0 +1,79 @@
+import io
+import pytest
+from bson import ObjectId
+from unittest.mock import AsyncMock, patch
+from pymongo.errors import BulkWriteError
+from app.ingest import ingest, iter_records
+
+
+def test_iter_records_ndjson():
+    """Test that NDJSON lines are parsed and malformed lines are reported."""
+    file = io.StringIO('{"title": "Book 1"}\n\nnot json\n[1]\n')
+
+    records = list(iter_records(file, "ndjson"))
+
+    assert records[0] == (1, {"title": "Book 1"})
+    assert [row for row, _ in records[1:]] == [3, 4]
+    assert all(isinstance(record, ValueError) for _, record in records[1:])
+
+
+def test_iter_records_csv():
+    """Test that CSV rows, including quoted newlines, are read against the header."""
+    file = io.StringIO('user_id,review_text,rating\nu1,"Great\nbook",5\nu2,Fine,3,extra\n')
+
+    records = list(iter_records(file, "csv"))
+
+    assert records[0] == (3, {"user_id": "u1", "review_text": "Great\nbook", "rating": "5"})
+    assert isinstance(records[1][1], ValueError)
+
+
+@patch("app.ingest.refresh_merged_review", new_callable=AsyncMock)
+@patch("app.ingest.books_collection")
+@pytest.mark.asyncio
+async def test_ingest_books(mock_books, mock_refresh):
+    """Test batched inserts, per-row errors and one merged_review refresh per batch."""
+    def insert_many(batch, ordered):
+        assert ordered is False
+        for document in batch:
+            document["_id"] = ObjectId()
+        if batch[0]["title"] == "Duplicate":
+            raise BulkWriteError({"writeErrors": [{"index": 0, "errmsg": "duplicate key"}]})
+
+    mock_books.insert_many = AsyncMock(side_effect=insert_many)
+    book = {"author": "Author", "genre": "Fantasy", "year_published": 2000, "summary": "Summary"}
+    records = [
+        (1, dict(book, title="Book 1")),
+        (2, {"title": "Missing fields"}),
+        (3, dict(book, title="Book 2")),
+        (4, dict(book, title="Duplicate")),
+        (5, ValueError("Invalid JSON")),
+    ]
+
+    report = await ingest("books", records, batch_size=2, concurrency=2)
+
+    assert (report["inserted"], report["failed"]) == (2, 3)
+    assert [error["row"] for error in report["errors"]] == [2, 5, 4]
+    assert mock_books.insert_many.await_count == 2
+    assert mock_refresh.await_count == 1
+    assert len(report["book_ids"]) == 2
+
+
+@patch("app.ingest.refresh_merged_review", new_callable=AsyncMock)
+@patch("app.ingest.reviews_collection")
+@pytest.mark.asyncio
+async def test_ingest_reviews(mock_reviews, mock_refresh):
+    """Test that reviews are linked to their book and refresh each reviewed book once."""
+    mock_reviews.insert_many = AsyncMock()
+    book_id = ObjectId()
+    records = [
+        (1, {"book_id": str(book_id), "user_id": "u1", "review_text": "Good", "rating": "4"}),
+        (2, {"book_id": str(book_id), "user_id": "u2", "review_text": "Bad", "rating": 1}),
+        (3, {"book_id": "not-an-id", "user_id": "u3", "review_text": "Meh", "rating": 3}),
+    ]
+
+    report = await ingest("reviews", records)
+
+    assert (report["inserted"], report["failed"]) == (2, 1)
+    inserted = mock_reviews.insert_many.await_args.args[0]
+    assert [review["book_id"] for review in inserted] == [book_id, book_id]
+    mock_refresh.assert_awaited_once_with([book_id])
@@ -0,0 +1,79 @@
+import time
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.metrics import (
+    MONGODB_COMMAND_SECONDS, REQUEST_SECONDS, RESPONSE_BYTES, UNMATCHED_ROUTE,
+    CommandMetrics, MetricsRegistry, RequestMetricsMiddleware, SlowRequestProfiler,
+)
+
+
+def count(histogram, *label_values):
+    value = histogram.value(*label_values)
+    return 0 if value is None else value["count"]
+
+
+def test_registry_render():
+    """Test the Prometheus text format of histograms, gauges and exported statistics."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", labels=("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, '/a"b')
+    registry.gauge("in_flight", "In flight").inc()
+    registry.register_stats("cache", lambda: {"hits": 3, "ratio": 0.5, "name": "local", "enabled": True}, "Cache counter")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{route="/a\\"b",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a\\"b",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a\\"b"} 3.65' in lines
+    assert 'latency_seconds_count{route="/a\\"b"} 4' in lines
+    assert "in_flight 1" in lines
+    assert "cache_hits 3" in lines and "cache_ratio 0.5" in lines
+    assert not any(line.startswith(("cache_name", "cache_enabled")) for line in lines)
+    assert registry.histogram("latency_seconds", "Latency", labels=("route",)) is histogram
+
+
+def test_request_metrics_middleware():
+    """Test that requests are recorded by route template, status and response size, and slow ones profiled."""
+    app = FastAPI()
+    profiler = SlowRequestProfiler(threshold=0.03, interval=0.001)
+    app.add_middleware(RequestMetricsMiddleware, profiler=profiler)
+
+    @app.get("/slow/{item_id}")
+    def slow(item_id: str):
+        time.sleep(0.05)
+        return {"item_id": item_id}
+
+    @app.get("/fast")
+    def fast():
+        return {}
+
+    before = count(REQUEST_SECONDS, "GET", "/slow/{item_id}", "200"), count(REQUEST_SECONDS, "GET", UNMATCHED_ROUTE, "404")
+    client = TestClient(app)
+    assert client.get("/slow/1").status_code == 200
+    assert client.get("/fast").status_code == 200
+    assert client.get("/missing").status_code == 404
+
+    after = count(REQUEST_SECONDS, "GET", "/slow/{item_id}", "200"), count(REQUEST_SECONDS, "GET", UNMATCHED_ROUTE, "404")
+    assert after == (before[0] + 1, before[1] + 1)
+    assert RESPONSE_BYTES.value("GET", "/slow/{item_id}")["sum"] >= len('{"item_id":"1"}')
+
+    profiles = profiler.profiles()
+    assert [(profile["method"], profile["path"]) for profile in profiles] == [("GET", "/slow/1")]
+    assert profiles[0]["samples"] > 0
+    assert any("slow (test_metrics.py" in stack["stack"] for stack in profiles[0]["stacks"])
+
+
+def test_command_metrics():
+    """Test that command durations are recorded by command name and outcome."""
+    listener = CommandMetrics()
+    before = count(MONGODB_COMMAND_SECONDS, "find", "succeeded"), count(MONGODB_COMMAND_SECONDS, "find", "failed")
+
+    listener.succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+    listener.failed(SimpleNamespace(command_name="find", duration_micros=500))
+
+    assert count(MONGODB_COMMAND_SECONDS, "find", "succeeded") == before[0] + 1
+    assert count(MONGODB_COMMAND_SECONDS, "find", "failed") == before[1] + 1
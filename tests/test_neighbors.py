@@ -0,0 +1,32 @@
+import numpy as np
+from scipy import sparse
+from app.neighbors import NeighborTable, genre_groups
+
+
+def test_genre_groups():
+    """Test that rows with the same genre set share a group."""
+    features = sparse.csr_matrix(np.array([[1, 1, 0], [0, 0, 1], [1, 1, 0], [0, 0, 0]], dtype=np.float32))
+
+    groups, columns = genre_groups(features)
+
+    assert list(groups) == [0, 1, 0, 2]
+    assert columns == [[0, 1], [2], []]
+
+
+def test_neighbor_table_lookup():
+    """Test that lookups return a book's group's neighbors by ID, without padding."""
+    ids = np.array([b"c", b"a", b"b"])
+    table = NeighborTable(
+        ids,
+        groups=np.array([0, 1, 0], dtype=np.int32),
+        neighbors=np.array([[2, 0], [1, -1]], dtype=np.int32),
+        scores=np.array([[2, 1], [1, 0]], dtype=np.int16),
+        min_rating=4.0,
+    )
+
+    found_ids, scores = table.lookup("b")
+    assert list(found_ids) == [b"b", b"c"] and list(scores) == [2, 1]
+    found_ids, scores = table.lookup(b"a")
+    assert list(found_ids) == [b"a"] and list(scores) == [1]
+    assert table.lookup("d") is None
+    assert table.meta() == {"min_rating": 4.0, "k": 2, "books": 3, "genre_sets": 2}
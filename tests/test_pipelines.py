@@ -0,0 +1,108 @@
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+from unittest.mock import AsyncMock, patch
+from app.pipelines import merged_review_pipeline, rating_bucket, rating_stats, record_review, refresh_merged_review
+
+
+def test_merged_review_pipeline_for_changed_books():
+    """Test that a refresh only matches the changed books and merges into merged_review."""
+    book_id = ObjectId()
+
+    pipeline = merged_review_pipeline([book_id])
+
+    assert pipeline[0] == {"$match": {"_id": {"$in": [book_id]}}}
+    assert pipeline[1]["$lookup"]["from"] == "reviews"
+    assert pipeline[-1]["$merge"]["into"] == "merged_review"
+    assert pipeline[-1]["$merge"]["on"] == "_id"
+    assert len(pipeline[3]["$project"]["rating_histogram"]) == 5
+
+
+def test_merged_review_pipeline_full_rebuild():
+    """Test that a full rebuild does not filter books."""
+    assert "$match" not in merged_review_pipeline()[0]
+
+
+@patch("app.pipelines.books_collection")
+@pytest.mark.asyncio
+async def test_refresh_merged_review(mock_books):
+    """Test that the pipeline runs server-side against the books collection."""
+    mock_books.aggregate.return_value.to_list = AsyncMock(return_value=[])
+    book_id = ObjectId()
+
+    await refresh_merged_review([book_id])
+
+    pipeline = mock_books.aggregate.call_args.args[0]
+    assert pipeline == merged_review_pipeline([book_id])
+
+
+@patch("app.pipelines.merged_review_collection")
+@pytest.mark.asyncio
+async def test_record_review(mock_merged_review):
+    """Test that a review updates counters and the average in one atomic update."""
+    mock_merged_review.update_one = AsyncMock()
+    book_id = ObjectId()
+
+    await record_review(book_id, 4.0)
+
+    query, update = mock_merged_review.update_one.await_args.args
+    assert query == {"_id": book_id}
+    assert isinstance(update, list)
+    assert update[-1] == {"$set": {"average_rating": {"$divide": ["$rating_sum", "$review_count"]}}}
+    assert update[1]["$set"]["rating_histogram"][3] == {"$add": [{"$ifNull": [{"$arrayElemAt": ["$rating_histogram", 3]}, 0]}, 1]}
+    assert update[1]["$set"]["rating_histogram"][2]["$add"][1] == 0
+
+
+async def merge_refreshed_book(collection, refreshed):
+    """
+    Run the refresh pipeline's `$merge` on a stored book, with `refreshed` as the output of
+    the stages before it. Mongomock has no `$mergeObjects`, so `$$new` is merged here.
+    """
+    set_legacy_rating, replace_root, *stages = merged_review_pipeline()[-1]["$merge"]["whenMatched"]
+    assert replace_root == {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$$new", {"legacy_rating": "$legacy_rating"}]}}}
+    await collection.update_one({"_id": refreshed["_id"]}, [set_legacy_rating])
+    stored = await collection.find_one({"_id": refreshed["_id"]})
+    await collection.replace_one({"_id": refreshed["_id"]}, {**refreshed, "legacy_rating": stored["legacy_rating"]})
+    await collection.update_one({"_id": refreshed["_id"]}, stages)
+    return await collection.find_one({"_id": refreshed["_id"]}, {"_id": 0, "review_count": 1, "rating_sum": 1, "average_rating": 1})
+
+
+@pytest.mark.asyncio
+async def test_legacy_rating_counts_once_in_both_paths():
+    """Test that a refresh and record_review both count an imported average as one rating."""
+    collection = AsyncMongoMockClient().BooksLibrary.merged_review
+    book_id = ObjectId()
+    # The refresh output for the book once its one review, rated 5, is in `reviews`
+    refreshed = {
+        "_id": book_id, "title": "Dune", "review_count": 1, "rating_sum": 5.0, "average_rating": 5.0,
+        "rating_histogram": [0, 0, 0, 0, 1],
+    }
+    expected = {"review_count": 2, "rating_sum": 9.0, "average_rating": 4.5}
+
+    await collection.insert_one({"_id": book_id, "title": "Dune", "average_rating": 4.0})
+    with patch("app.pipelines.merged_review_collection", collection):
+        await record_review(book_id, 5.0)
+    recorded = await collection.find_one({"_id": book_id}, {"_id": 0, "review_count": 1, "rating_sum": 1, "average_rating": 1})
+    assert recorded == expected
+    # A refresh after the review keeps the legacy rating it recorded
+    assert await merge_refreshed_book(collection, refreshed) == expected
+
+    await collection.replace_one({"_id": book_id}, {"title": "Dune", "average_rating": 4.0})
+    assert await merge_refreshed_book(collection, refreshed) == expected
+    # A refresh repeated on its own output does not count the legacy rating twice
+    assert await merge_refreshed_book(collection, refreshed) == expected
+
+
+def test_rating_bucket():
+    """Test that ratings are bucketed by whole stars, clamped to 1 to 5."""
+    assert [rating_bucket(rating) for rating in [0, 1, 1.9, 2, 4.5, 5, 7, float("nan")]] == [0, 0, 0, 1, 3, 4, 4, 0]
+
+
+def test_rating_stats():
+    """Test that statistics are read from counters, or from a lone imported average."""
+    document = {"review_count": 2, "rating_sum": 9.0, "average_rating": 4.5, "rating_histogram": [0, 0, 0, 1, 1]}
+    assert rating_stats(document) == document
+    assert rating_stats({"average_rating": 4.2}) == {
+        "review_count": 1, "rating_sum": 4.2, "average_rating": 4.2, "rating_histogram": [0, 0, 0, 0, 0],
+    }
+    assert rating_stats({"average_rating": float("nan")})["average_rating"] is None
@@ -1,8 +1,14 @@
 import pytest
 import asyncio
+import numpy as np
 import pandas as pd
 from unittest.mock import AsyncMock, patch
-from app.recommender import BookRecommender
+from mongomock_motor import AsyncMongoMockClient
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import MultiLabelBinarizer
+from app.catalog import CATALOG_PROJECTION
+from app.genres import parse_genres
+from app.recommender import BookRecommender, RecommenderBusy, TitleIndex, select_top
 
 
 @pytest.fixture
@@ -21,17 +27,19 @@ def recommender():
     return BookRecommender()
 
 
-@patch("recommender.merged_review_collection.find")
+@patch("app.recommender.merged_review_collection")
 @pytest.mark.asyncio
-async def test_load_data(mock_find, recommender, mock_books_data):
-    """Test the load_data method."""
-    mock_find.return_value = AsyncMock()
-    mock_find.return_value.to_list.return_value = mock_books_data
+async def test_load_data(mock_collection, recommender, mock_books_data):
+    """Test that load_data fetches only the projected fields, column by column."""
+    mock_collection.find.return_value.__aiter__.return_value = mock_books_data
 
-    df = await recommender.load_data()
-    assert isinstance(df, pd.DataFrame)
-    assert df.shape[0] == len(mock_books_data)
-    assert list(df.columns) == ["title", "genre", "average_rating"]
+    columns = await recommender.load_data()
+
+    mock_collection.find.assert_called_once_with({}, CATALOG_PROJECTION)
+    assert list(columns) == list(CATALOG_PROJECTION)
+    assert columns["title"] == ["Book 1", "Book 2", "Book 3"]
+    assert columns["average_rating"] == [4.5, 3.8, 4.7]
+    assert columns["review_count"] == [None, None, None]
 
 
 @patch.object(BookRecommender, "load_data")
@@ -43,23 +51,70 @@ async def test_prepare_data(mock_load_data, recommender, mock_books_data):
     await recommender.prepare_data()
 
     assert recommender.features is not None
-    assert recommender.df is not None
-    assert recommender.knn is not None
+    assert len(recommender.catalog) == 3
+    assert recommender.features.shape == (3, 3)
 
 
-@patch.object(BookRecommender, "prepare_data")
+@patch.object(BookRecommender, "load_data")
 @pytest.mark.asyncio
-async def test_recommend_books(mock_prepare_data, recommender, mock_books_data):
+async def test_recommend_books(mock_load_data, recommender, mock_books_data):
     """Test the recommend_books method."""
-    mock_prepare_data.return_value = None
-    recommender.df = pd.DataFrame(mock_books_data)
-    recommender.features = [[1, 4.5], [0, 3.8], [1, 4.7]]
+    mock_load_data.return_value = pd.DataFrame(mock_books_data)
+    await recommender.prepare_data()
 
     result = await recommender.recommend_books(["Fantasy"], min_rating=4.0, num_recommendations=2)
 
     assert not result.empty
     assert "title" in result.columns
     assert len(result) <= 2
+    assert list(result["title"]) == ["Book 3", "Book 1"]
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_recommend_books_matches_knn_ranking(mock_load_data, recommender):
+    """Test that the vectorized ranking matches a full KNN pass followed by re-ranking."""
+    rng = np.random.default_rng(7)
+    all_genres = [f"Genre {i}" for i in range(12)]
+    books = [
+        {
+            "title": f"Book {i}",
+            "genre": str([str(g) for g in rng.choice(all_genres, size=rng.integers(1, 5), replace=False)]),
+            "average_rating": round(float(rng.uniform(2.5, 5.0)), 2),
+        }
+        for i in range(300)
+    ]
+    mock_load_data.return_value = pd.DataFrame(books)
+    await recommender.prepare_data()
+
+    df = pd.DataFrame(books)
+    df["genre"] = df["genre"].apply(parse_genres)
+    mlb = MultiLabelBinarizer()
+    features = np.hstack([mlb.fit_transform(df["genre"]), df[["average_rating"]].values])
+    knn = NearestNeighbors(metric="cosine").fit(features)
+
+    for genres in (["Genre 1"], ["Genre 2", "Genre 5"], ["Genre 0", "Genre 3", "Genre 7", "Missing"]):
+        query = np.hstack([mlb.transform([[g for g in genres if g in mlb.classes_]]), [[3.5]]])
+        _, indices = knn.kneighbors(query, n_neighbors=len(df))
+        expected = df.iloc[indices[0]]
+        expected = expected[expected["average_rating"] >= 3.5]
+        expected = expected.assign(matched_genres=expected["genre"].apply(lambda x: len(set(genres) & set(x))))
+        expected = expected[expected["matched_genres"] > 0]
+        expected = expected.sort_values(by=["matched_genres", "average_rating"], ascending=[False, False], kind="stable")
+
+        result = await recommender.recommend_books(genres, min_rating=3.5, num_recommendations=10)
+
+        assert list(result["title"]) == list(expected["title"].head(10))
+
+
+def test_select_top():
+    """Test lexicographic top-k selection with ties resolved by position."""
+    primary = np.array([0, -2, -1, -2, 0, -2])
+    secondary = np.array([5, 3, 1, 1, 0, 1])
+
+    assert list(select_top([primary, secondary], 3)) == [3, 5, 1]
+    assert list(select_top([primary, secondary], 10)) == [3, 5, 1, 2, 4, 0]
+    assert list(select_top([primary, secondary], 0)) == []
 
 
 @patch.object(BookRecommender, "load_data")
@@ -72,3 +127,380 @@ async def test_recommend_books_by_title(mock_load_data, recommender, mock_books_
 
     assert isinstance(result, pd.DataFrame)
     assert "title" in result.columns
+
+
+def test_title_index_lookup():
+    """Test exact, case-insensitive, prefix and substring title resolution."""
+    index = TitleIndex(["The Hobbit", "Harry Potter and the Sorcerer's Stone", "Dune", "Dune Messiah"])
+
+    assert index.lookup("Dune") == 2
+    assert index.lookup("the hobbit") == 0
+    assert index.lookup("harry pot") == 1
+    assert index.lookup("messiah") == 3
+    assert index.lookup("Silmarillion") is None
+
+
+def test_title_index_updates():
+    """Test lookups after rows are retitled, appended and discarded."""
+    index = TitleIndex(["Dune", "Emma", "DUNE"])
+    index.add("Persuasion", 1)
+    index.add("Dune", 3)
+
+    assert index.lookup("DUNE") == 2
+    assert index.lookup("dune") == 0
+    assert index.lookup("Emma") is None
+    assert index.lookup("suasion") == 1
+
+    index.discard(0)
+    assert index.lookup("Dune") == 3
+    assert index.lookup("du") == 2
+    assert len(index) == 3
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_incremental_updates(mock_load_data, recommender, mock_books_data):
+    """Test that book and review writes are reflected without retraining."""
+    mock_load_data.return_value = pd.DataFrame(
+        [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    )
+    await recommender.prepare_data()
+
+    await recommender.upsert_book("id-new", "Book 4", "Fantasy, Adventure")
+    await recommender.record_rating("id-new", 5.0)
+    await recommender.remove_book("id-2")
+
+    result = await recommender.recommend_books(["Fantasy"], min_rating=4.0, num_recommendations=5)
+
+    assert list(result["title"]) == ["Book 4", "Book 1"]
+    assert await recommender.recommend_books_by_title("Book 3") == "No book found with the title 'Book 3'"
+    mock_load_data.assert_called_once()
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_apply_changes(mock_load_data, mock_books_data):
+    """Test that another worker's writes converge this one's model, and reapplying is a no-op."""
+    mock_load_data.return_value = pd.DataFrame(
+        [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    )
+    writer, follower = BookRecommender(training_executor="thread"), BookRecommender(training_executor="thread")
+    await writer.prepare_data()
+    await follower.prepare_data()
+
+    await writer.upsert_book("id-new", "Book 4", "Fantasy, Adventure")
+    await writer.record_rating("id-new", 5.0)
+    await writer.record_rating("id-0", 3.0)
+    await writer.remove_book("id-2")
+    documents = [
+        {"_id": "id-new", "title": "Book 4", "genre": ["Fantasy", "Adventure"], "average_rating": 5.0, "review_count": 1},
+        {"_id": "id-0", "title": "Book 1", "genre": ["Fantasy", "Adventure"], "average_rating": 3.75, "review_count": 2},
+    ]
+    await follower.apply_changes(documents, ["id-2"])
+
+    for recommender in (writer, follower):
+        result = await recommender.recommend_books(["Fantasy"], min_rating=3.0, num_recommendations=5)
+        assert list(result["title"]) == ["Book 4", "Book 1"]
+        assert list(result["average_rating"]) == [5.0, 3.75]
+    assert follower.executor_stats()["synced_changes"] == 3
+
+    version = writer.model_version
+    await writer.apply_changes(documents, ["id-2"])
+    await follower.apply_changes(documents, ["id-2"])
+    assert writer.model_version == version
+
+    await follower.apply_changes([{"_id": "id-new", "title": "Book 4", "genre": ["Science Fiction"], "average_rating": 5.0, "review_count": 1}])
+    result = await follower.recommend_books(["Science Fiction"], min_rating=3.0)
+    assert list(result["title"]) == ["Book 4", "Book 2"]
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_recommend_many(mock_load_data, recommender, mock_books_data):
+    """Test that batch recommendations match one call per query."""
+    mock_load_data.return_value = pd.DataFrame(mock_books_data)
+    await recommender.prepare_data()
+
+    results = await recommender.recommend_many([
+        {"genres": ["Fantasy"], "num_recommendations": 1},
+        {"title": "book 2", "min_rating": 3.0},
+        {"title": "Missing"},
+        {"genres": ["Fantasy"]},
+    ])
+
+    assert len(results) == 4
+    pd.testing.assert_frame_equal(results[0], await recommender.recommend_books(["Fantasy"], num_recommendations=1))
+    pd.testing.assert_frame_equal(results[1], await recommender.recommend_books_by_title("book 2", min_rating=3.0))
+    assert results[2] == "No book found with the title 'Missing'"
+    pd.testing.assert_frame_equal(results[3], await recommender.recommend_books(["Fantasy"]))
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_snapshot_round_trip(mock_load_data, recommender, mock_books_data, tmp_path):
+    """Test that a saved snapshot restores the same model without loading data."""
+    mock_load_data.return_value = pd.DataFrame(
+        [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    )
+    await recommender.prepare_data()
+    await recommender.remove_book("id-1")
+    recommender.save_snapshot(str(tmp_path), fingerprint={"count": 3})
+
+    restored = BookRecommender()
+    assert not restored.load_snapshot(str(tmp_path), fingerprint={"count": 4})
+    assert restored.load_snapshot(str(tmp_path), fingerprint={"count": 3})
+
+    pd.testing.assert_frame_equal(
+        await restored.recommend_books_by_title("book 1"),
+        await recommender.recommend_books_by_title("book 1"),
+    )
+    await restored.record_rating("id-2", 1.0)
+    assert restored.ratings[restored.title_index.lookup("Book 3")] == pytest.approx(2.85)
+    mock_load_data.assert_called_once()
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_scoring_queue_limit(mock_load_data, mock_books_data):
+    """Test that requests beyond the scoring queue limit are rejected."""
+    mock_load_data.return_value = pd.DataFrame(mock_books_data)
+    recommender = BookRecommender(scoring_threads=1, max_queued=1, training_executor="thread")
+    await recommender.prepare_data()
+
+    results = await asyncio.gather(
+        *(recommender.recommend_books(["Fantasy"], min_rating=rating) for rating in (3.0, 4.0, 4.5)),
+        return_exceptions=True,
+    )
+
+    assert sum(isinstance(result, RecommenderBusy) for result in results) == 1
+    stats = recommender.executor_stats()
+    assert (stats["completed"], stats["rejected"], stats["queued"], stats["running"]) == (2, 1, 0, 0)
+    assert stats["trainings"] == 1
+    recommender.close()
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_writes_during_training_are_applied(mock_load_data, recommender, mock_books_data):
+    """Test that books written while the model is rebuilt are read again for the new model."""
+    books = [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    mock_load_data.return_value = pd.DataFrame(books)
+    await recommender.prepare_data()
+    # The rebuild reads the data before the writes below reach it
+    collection = AsyncMongoMockClient().BooksLibrary.merged_review
+    await collection.insert_many(books[1:] + [{"_id": "id-3", "title": "Book 4", "genre": "Fantasy, Mystery", "average_rating": 4.9}])
+
+    with patch("app.recommender.merged_review_collection", collection):
+        retraining = asyncio.ensure_future(recommender.prepare_data())
+        await asyncio.sleep(0)
+        await recommender.upsert_book("id-3", "Book 4", "Fantasy, Mystery", 4.9)
+        await recommender.remove_book("id-0")
+        assert recommender.title_index.lookup("Book 1") is None  # Served by the old model meanwhile
+        await retraining
+
+    recommendations = await recommender.recommend_books(["Fantasy"])
+    assert list(recommendations["title"]) == ["Book 4", "Book 3"]
+
+
+@pytest.mark.asyncio
+async def test_rating_during_training_counted_once(recommender):
+    """Test that a rating recorded while the model is rebuilt is not counted twice."""
+    collection = AsyncMongoMockClient().BooksLibrary.merged_review
+    await collection.insert_one({"_id": "id-0", "title": "Book 1", "genre": "Fantasy", "average_rating": 5.0, "review_count": 1})
+    loading = asyncio.Event()
+    loaded = asyncio.Event()
+    load_data = BookRecommender.load_data
+
+    async def slow_load_data(self):
+        loading.set()
+        await loaded.wait()
+        return await load_data(self)
+
+    with patch("app.recommender.merged_review_collection", collection), \
+            patch.object(BookRecommender, "load_data", slow_load_data):
+        loaded.set()
+        await recommender.prepare_data()
+        loading.clear()
+        loaded.clear()
+        retraining = asyncio.ensure_future(recommender.prepare_data())
+        await loading.wait()
+        # The review reaches the collection, then the model, before the rebuild reads the data
+        await collection.update_one({"_id": "id-0"}, {"$set": {"average_rating": 4.0, "review_count": 2}})
+        await recommender.record_rating("id-0", 3.0)
+        loaded.set()
+        await retraining
+
+    book = recommender.catalog[recommender.catalog.locate("id-0")]
+    assert (book.average_rating, book.review_count) == (4.0, 2)
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_result_cache(mock_load_data, recommender, mock_books_data):
+    """Test that results are memoized, coalesced and invalidated by model changes."""
+    mock_load_data.return_value = pd.DataFrame(
+        [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    )
+    await recommender.prepare_data()
+
+    first, second = await asyncio.gather(
+        recommender.recommend_books(["Fantasy"]), recommender.recommend_books(["Fantasy", "Unknown"])
+    )
+    pd.testing.assert_frame_equal(first, second)
+    # "Book 3" has exactly the Fantasy genre, so its title query shares the cached result
+    pd.testing.assert_frame_equal(await recommender.recommend_books_by_title("Book 3"), first)
+    stats = recommender.executor_stats()
+    assert (stats["result_misses"], stats["result_coalesced"], stats["result_hits"]) == (1, 1, 1)
+
+    await recommender.record_rating("id-0", 5.0)
+    assert list((await recommender.recommend_books(["Fantasy"]))["average_rating"]) == [4.75, 4.7]
+    assert recommender.executor_stats()["result_misses"] == 2
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+@pytest.mark.parametrize("index", ["inverted", "lsh"])
+async def test_candidate_index_recall(mock_load_data, index, mock_books_data):
+    """Test that each candidate index serves recommendations and reports its recall."""
+    mock_load_data.return_value = pd.DataFrame(mock_books_data)
+    recommender = BookRecommender(index=index, training_executor="thread")
+    await recommender.prepare_data()
+
+    recommendations = await recommender.recommend_books(["Fantasy"])
+
+    assert list(recommendations["title"]) == ["Book 3", "Book 1"]
+    assert recommender.index_recall([["Fantasy"], ["Adventure", "Science Fiction"]], k=2) == 1.0
+    recommender.close()
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+@pytest.mark.parametrize("training_executor", ["thread", "process"])
+async def test_neighbor_lists_match_scoring(mock_load_data, training_executor):
+    """Test that title recommendations read from the neighbor lists match scoring the title's genres."""
+    rng = np.random.default_rng(11)
+    all_genres = [f"Genre {i}" for i in range(6)]
+    books = [
+        {
+            "_id": f"id-{i}",
+            "title": f"Book {i}",
+            "genre": str([str(g) for g in rng.choice(all_genres, size=rng.integers(1, 3), replace=False)]),
+            "average_rating": round(float(rng.uniform(3.0, 5.0)), 2),
+        }
+        for i in range(200)
+    ]
+    mock_load_data.return_value = pd.DataFrame(books)
+    recommender = BookRecommender(training_executor=training_executor, neighbors=5, neighbor_workers=2)
+    await recommender.prepare_data()
+    await recommender.refresh_neighbors()
+
+    # Books with the same genres share one list
+    assert len(recommender.neighbor_table.neighbors) < len(books)
+    for book in books[::9]:
+        served = await recommender.recommend_books_by_title(book["title"])
+        pd.testing.assert_frame_equal(served, await recommender.recommend_books(parse_genres(book["genre"])))
+    stats = recommender.executor_stats()
+    assert (stats["neighbor_hits"], stats["neighbor_refreshes"], stats["neighbor_lag"]) == (len(books[::9]), 1, 0)
+    recommender.close()
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_neighbor_lists_after_writes(mock_load_data, mock_books_data):
+    """Test that the lists keep serving queries whose genres no write touched, and that the others are scored."""
+    mock_load_data.return_value = pd.DataFrame(
+        [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    )
+    recommender = BookRecommender(training_executor="thread", neighbors=2)
+    await recommender.prepare_data()
+    await recommender.refresh_neighbors()
+
+    assert list((await recommender.recommend_books_by_title("Book 3", num_recommendations=2))["title"]) == ["Book 3", "Book 1"]
+    await recommender.record_rating("id-1", 5.0)
+    assert list((await recommender.recommend_books_by_title("Book 3", num_recommendations=2))["title"]) == ["Book 3", "Book 1"]
+    await recommender.remove_book("id-0")
+    await recommender.upsert_book("id-new", "Book 4", "Fantasy", 5.0)
+    # Stale for Fantasy, more books than the lists hold, and another minimum rating
+    assert list((await recommender.recommend_books_by_title("Book 3", num_recommendations=2))["title"]) == ["Book 4", "Book 3"]
+    assert list((await recommender.recommend_books_by_title("Book 3", num_recommendations=3))["title"]) == ["Book 4", "Book 3"]
+    assert list((await recommender.recommend_books_by_title("Book 3", min_rating=3.0, num_recommendations=2))["title"]) == ["Book 4", "Book 3"]
+
+    stats = recommender.executor_stats()
+    assert (stats["neighbor_hits"], stats["neighbor_misses"], stats["neighbor_lag"]) == (2, 1, 3)
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_neighbor_lists_after_rating_changes(mock_load_data):
+    """Test that re-rated and added neighbors are reflected without a refresh or a removal."""
+    mock_load_data.return_value = pd.DataFrame(
+        [{"_id": f"id{i}", "title": f"Book {i}", "genre": "['Fantasy']", "average_rating": 4.5} for i in range(3)]
+    )
+    recommender = BookRecommender(training_executor="thread", neighbors=5)
+    await recommender.prepare_data()
+    await recommender.refresh_neighbors()
+
+    async def assert_matches_scoring():
+        pd.testing.assert_frame_equal(
+            await recommender.recommend_books_by_title("Book 0"), await recommender.recommend_books(parse_genres("['Fantasy']")),
+        )
+
+    await assert_matches_scoring()
+    await recommender.record_rating("id1", 1.0)
+    await assert_matches_scoring()
+    assert "Book 1" not in list((await recommender.recommend_books_by_title("Book 0"))["title"])
+    await recommender.upsert_book("id3", "Book 3", "Fantasy", 5.0)
+    await assert_matches_scoring()
+    assert list((await recommender.recommend_books_by_title("Book 0"))["title"])[0] == "Book 3"
+
+    await recommender.refresh_neighbors()
+    await assert_matches_scoring()
+    assert recommender.executor_stats()["neighbor_hits"] == 2
+
+
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_neighbor_lists_after_genre_change(mock_load_data):
+    """Test that a book whose genres changed before a refresh is listed with its new genres only."""
+    mock_load_data.return_value = pd.DataFrame([
+        {"_id": "a", "title": "Dune", "genre": "['SciFi']", "average_rating": 4.5},
+        {"_id": "b", "title": "Emma", "genre": "['Romance']", "average_rating": 4.2},
+        {"_id": "c", "title": "Persuasion", "genre": "['Romance']", "average_rating": 4.4},
+    ])
+    recommender = BookRecommender(training_executor="thread", neighbors=5)
+    await recommender.prepare_data()
+    await recommender.upsert_book("a", "Dune", ["Romance"])
+    await recommender.refresh_neighbors()
+
+    assert len(recommender.neighbor_table) == 3
+    served = await recommender.recommend_books_by_title("Dune", num_recommendations=3)
+    assert list(served["title"]) == ["Dune", "Persuasion", "Emma"]
+    pd.testing.assert_frame_equal(served, await recommender.recommend_books(["Romance"], num_recommendations=3))
+    assert recommender.executor_stats()["neighbor_hits"] == 1
+
+
+@patch.object(BookRecommender, "data_fingerprint", AsyncMock(return_value={"count": 3}))
+@patch.object(BookRecommender, "load_data")
+@pytest.mark.asyncio
+async def test_neighbor_lists_persisted(mock_load_data, mock_books_data, tmp_path):
+    """Test that neighbor lists persisted next to the snapshot are loaded at startup."""
+    mock_load_data.return_value = pd.DataFrame(
+        [dict(book, _id=f"id-{i}") for i, book in enumerate(mock_books_data)]
+    )
+    recommender = BookRecommender(snapshot_dir=str(tmp_path), training_executor="thread", neighbors=5)
+    await recommender.load_or_prepare()
+    await recommender._neighbor_task
+
+    restored = BookRecommender(snapshot_dir=str(tmp_path), training_executor="thread", neighbors=5)
+    await restored.load_or_prepare()
+    assert restored.neighbor_table is not None
+    await restored._neighbor_task
+    assert restored.executor_stats()["neighbor_refreshes"] == 0
+
+    pd.testing.assert_frame_equal(
+        await restored.recommend_books_by_title("Book 1"),
+        await recommender.recommend_books_by_title("Book 1"),
+    )
+    assert restored.executor_stats()["neighbor_hits"] == 1
+    assert not BookRecommender(neighbors=3).load_neighbors(str(tmp_path / "neighbors"))
+    mock_load_data.assert_called_once()
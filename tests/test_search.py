@@ -0,0 +1,86 @@
+import pytest
+from unittest.mock import patch
+from app.search import SEARCH_PROJECTION, SearchIndex, build_search_state, tokenize
+
+
+@pytest.fixture
+def mock_books_data():
+    """Fixture for mock `merged_review` documents."""
+    return [
+        {"_id": "1", "title": "The Hobbit", "author": "J.R.R. Tolkien", "genre": "['Fantasy', 'Adventure']", "year_published": 1937, "average_rating": 4.7},
+        {"_id": "2", "title": "Harry Potter", "author": "J.K. Rowling", "genre": "['Fantasy']", "year_published": 1997, "average_rating": 4.5},
+        {"_id": "3", "title": "The Hunger Games", "author": "Suzanne Collins", "genre": "['Dystopian']", "year_published": 2008},
+        {"_id": "4", "title": "Dune", "author": "Frank Herbert", "genre": "['Science Fiction']", "average_rating": 4.9},
+    ]
+
+
+@pytest.fixture
+def index(mock_books_data):
+    """Fixture for a search index built from the mock documents."""
+    index = SearchIndex()
+    index._install(build_search_state({field: [book.get(field) for book in mock_books_data] for field in SEARCH_PROJECTION}))
+    return index
+
+
+def titles(books):
+    return [book["title"] for book in books]
+
+
+def test_tokenize():
+    """Test that text is split into lowercase words."""
+    assert tokenize("The Lord of the Rings: Fellowship") == ["the", "lord", "of", "the", "rings", "fellowship"]
+    assert tokenize("J.R.R. Tolkien") == ["j", "r", "r", "tolkien"]
+    assert tokenize(None) == []
+
+
+@patch("app.search.merged_review_collection")
+@pytest.mark.asyncio
+async def test_load(mock_collection, mock_books_data):
+    """Test that load fetches only the projected fields and indexes every book."""
+    mock_collection.find.return_value.__aiter__.return_value = mock_books_data
+    index = SearchIndex()
+
+    await index.load()
+
+    mock_collection.find.assert_called_once_with({}, SEARCH_PROJECTION)
+    assert index.stats()["books"] == 4
+    assert index.stats()["genres"] == 4
+
+
+def test_search(index):
+    """Test word, prefix, genre and year matching, ranked by average rating."""
+    assert titles(index.search("the")) == ["The Hobbit", "The Hunger Games"]
+    assert titles(index.search("h")) == ["Dune", "The Hobbit", "Harry Potter", "The Hunger Games"]
+    assert titles(index.search("the h")) == ["The Hobbit", "The Hunger Games"]
+    assert titles(index.search("the hob ")) == []
+    assert titles(index.search("tolk", prefix=False)) == []
+    assert titles(index.search("ROWLING")) == ["Harry Potter"]
+    assert titles(index.search("", genres=["fantasy"])) == ["The Hobbit", "Harry Potter"]
+    assert titles(index.search("", genres=["Fantasy", "Adventure"])) == ["The Hobbit"]
+    assert titles(index.search("", year_from=1990)) == ["Harry Potter", "The Hunger Games"]
+    assert titles(index.search("", year_to=1990)) == ["The Hobbit"]
+    assert titles(index.search("", limit=2)) == ["Dune", "The Hobbit"]
+    assert index.search("dune") == [{
+        "id": "4", "title": "Dune", "author": "Frank Herbert", "genre": ["Science Fiction"],
+        "year_published": None, "average_rating": 4.9,
+    }]
+
+
+@pytest.mark.asyncio
+async def test_writes_and_compaction(index):
+    """Test that written books are searchable at once and survive compaction."""
+    index.compact_threshold = 3
+    await index.upsert_book("2", "Harry Potter and the Philosopher's Stone", "J.K. Rowling", "Fantasy, Magic", 1997)
+    await index.remove_book("1")
+
+    assert titles(index.search("the")) == ["The Hunger Games", "Harry Potter and the Philosopher's Stone"]
+    assert index.search("philo")[0]["genre"] == ["Fantasy", "Magic"]
+    assert index.search("philo")[0]["average_rating"] == 4.5
+    assert index.stats()["books"] == 3
+
+    await index.upsert_book("5", "The Silmarillion", "J.R.R. Tolkien", ["Fantasy"], 1977)
+    await index._compaction_task
+
+    assert index.stats()["overlay"] == 0
+    assert titles(index.search("tolkien")) == ["The Silmarillion"]
+    assert titles(index.search("", genres=["fantasy"], year_from=1970)) == ["Harry Potter and the Philosopher's Stone", "The Silmarillion"]
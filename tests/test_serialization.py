@@ -0,0 +1,37 @@
+import numpy as np
+import orjson
+import pandas as pd
+from bson import ObjectId
+from app.models import Book
+from app.serialization import dumps, frame_records, model_projection, project_documents
+
+
+def test_dumps():
+    """Test that NumPy values, ObjectIds and NaN are encoded."""
+    book_id = ObjectId()
+    value = {"id": book_id, "ratings": np.array([4.5, 3.0]), "count": np.int64(2), "missing": float("nan")}
+
+    assert orjson.loads(dumps(value)) == {"id": str(book_id), "ratings": [4.5, 3.0], "count": 2, "missing": None}
+
+
+def test_project_documents():
+    """Test that documents are cut down to the model's fields."""
+    documents = [{"_id": ObjectId(), "title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction", "year_published": 1965, "extra": 1}]
+
+    assert model_projection(Book) == {"title": 1, "author": 1, "genre": 1, "year_published": 1, "summary": 1}
+    assert project_documents(documents, Book) == [{
+        "title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction", "year_published": 1965, "summary": None,
+    }]
+
+
+def test_frame_records():
+    """Test that frames are converted to the same records as `to_dict`, with Python scalars."""
+    frame = pd.DataFrame(
+        {"title": ["Dune", "Emma"], "average_rating": np.array([4.7, 4.1]), "matched_genres": np.array([2, 1])},
+        index=[7, 3],
+    )
+    records = frame_records(frame)
+
+    assert records == frame.to_dict(orient="records")
+    assert type(records[0]["matched_genres"]) is int
+    assert frame_records(frame.iloc[:0]) == []
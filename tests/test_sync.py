@@ -0,0 +1,81 @@
+import datetime
+import pytest
+from unittest.mock import AsyncMock
+from mongomock_motor import AsyncMongoMockClient
+from app.sync import ChangeFeed
+
+
+class FakeChangeStream:
+    """A change stream stand-in that returns queued events, then nothing."""
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.alive = True
+
+    async def try_next(self):
+        return self.events.pop(0) if self.events else None
+
+
+@pytest.fixture
+def collection():
+    """Fixture for an in-memory `merged_review` stand-in."""
+    return AsyncMongoMockClient().BooksLibrary.merged_review
+
+
+@pytest.mark.asyncio
+async def test_polling(collection):
+    """Test that polling applies updated documents once, and finds deleted ones."""
+    now = datetime.datetime(2024, 1, 1)
+    await collection.insert_many([
+        {"_id": "1", "title": "Dune", "updated_at": now},
+        {"_id": "2", "title": "Emma", "updated_at": now},
+    ])
+    apply = AsyncMock()
+    feed = ChangeFeed(collection, apply, mode="poll", reconcile_seconds=0)
+    await feed.start()
+    feed.close()
+    assert feed.source == "polling"
+
+    await collection.update_one({"_id": "1"}, {"$set": {"title": "Dune Messiah", "updated_at": now + datetime.timedelta(seconds=5)}})
+    await collection.delete_one({"_id": "2"})
+    await feed.poll()
+
+    documents, removed = apply.await_args.args
+    assert [document["title"] for document in documents] == ["Dune Messiah"]
+    assert removed == ["2"]
+
+    apply.reset_mock()
+    await feed.poll()
+    apply.assert_not_awaited()
+    assert feed.stats()["changes"] == 1
+    assert feed.stats()["removals"] == 1
+
+
+@pytest.mark.asyncio
+async def test_change_stream_batches(collection):
+    """Test that stream events are coalesced per document, with deletions separated."""
+    stream = FakeChangeStream([
+        {"documentKey": {"_id": "1"}, "fullDocument": {"_id": "1", "title": "Dune"}},
+        {"documentKey": {"_id": "2"}, "fullDocument": {"_id": "2", "title": "Emma"}},
+        {"documentKey": {"_id": "1"}, "fullDocument": {"_id": "1", "title": "Dune Messiah"}},
+        {"documentKey": {"_id": "2"}},
+    ])
+    feed = ChangeFeed(collection, AsyncMock(), batch_seconds=0.05)
+
+    assert await feed._next_batch(stream) == {"1": {"_id": "1", "title": "Dune Messiah"}, "2": None}
+
+    feed.batch_size = 1
+    stream.events = [{"documentKey": {"_id": "3"}, "fullDocument": {"_id": "3"}}, {"documentKey": {"_id": "4"}, "fullDocument": {"_id": "4"}}]
+    assert list(await feed._next_batch(stream)) == ["3"]
+
+
+@pytest.mark.asyncio
+async def test_start_without_change_streams(collection):
+    """Test that change streams are required in watch mode, and polled for otherwise."""
+    with pytest.raises(RuntimeError):
+        await ChangeFeed(collection, AsyncMock(), mode="watch").start()
+
+    feed = ChangeFeed(collection, AsyncMock())
+    await feed.start()
+    feed.close()
+    assert feed.source == "polling"